@@ -36,6 +36,7 @@ Usage:
     autorippr.py   ( --rip | --compress | --extra )  [options]
     autorippr.py   ( --rip [ --compress ] )          [options]
     autorippr.py   --all                             [options]
+    autorippr.py   --daemon                          [options]
     autorippr.py   --test
 
 Options:
@@ -46,30 +47,84 @@ Options:
     --compress          Compress using HandBrake or FFmpeg.
     --extra             Lookup, rename and/or download extras.
     --all               Do everything.
+    --pipeline          With --all, compress and rename while still ripping.
+    --daemon            Keep running and rip discs as soon as they are inserted.
     --test              Tests config and requirements.
     --silent            Silent mode.
     --skip-compress     Skip the compression step.
     --force_db=(tv|movie)     Force use of the TheTVDB or TheMovieDB
+    --trace=<file>      Write a Chrome trace of the run to file.
+    --profile           Profile each stage, saved to the profiles folder.
 
 """
 
+import Queue
 import errno
 import os
+import signal
 import subprocess
 import sys
+import threading
 
 import yaml
-from tendo import singleton
 
-from classes import *
+# Every mode uses these. The classes of a single mode are imported by the
+# functions that run it, so a plain --rip does not pay for loading the
+# compression and extras code or the libraries behind them
+from classes import database, docopt, logger, metrics, notification, process, profiling, progress, staging, tracing
 
 __version__ = "1.7.0"
 
-me = singleton.SingleInstance()
+
+def single_instance():
+    """
+        Makes sure only one autorippr runs at a time, the way tendo's
+            SingleInstance does and with the same lock file. Importing
+            tendo loads pbr and pkg_resources for its version number,
+            which took a third of every start
+        Exits if another autorippr holds the lock
+        Returns the lock file, which has to stay open
+    """
+    import fcntl
+    import tempfile
+
+    name = os.path.splitext(os.path.abspath(sys.argv[0]))[0].replace(
+        "/", "-").replace(":", "") + '-.lock'
+    lockfile = open(os.path.normpath(tempfile.gettempdir() + '/' + name), 'w')
+
+    try:
+        fcntl.lockf(lockfile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except IOError:
+        sys.exit("Another instance is already running, quitting.")
+
+    return lockfile
+
+
+me = single_instance()
 CONFIG_FILE = "{}/settings.cfg".format(
     os.path.dirname(os.path.abspath(__file__)))
+PROFILE_PATH = "{}/profiles".format(
+    os.path.dirname(os.path.abspath(__file__)))
 
 notify = None
+stager = None
+meter = None
+
+def setup(config):
+    """
+        Creates the helpers every mode shares
+        Returns nothing
+    """
+    global stager, meter, notify
+
+    process.configure(config)
+    progress.configure(config)
+
+    stager = staging.Staging(config)
+    meter = metrics.Metrics(config)
+
+    notify = notification.Notification(
+        config, config['debug'], config['silent'])
 
 
 def eject(config, drive):
@@ -118,127 +173,432 @@ def eject(config, drive):
         del log
 
 
-def rip(config):
+def file_size(path):
     """
-        Main function for ripping
-        Does everything
+        Returns the size of a file, None if it does not exist
+    """
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return None
+
+
+def rip_finished(config, log, dbvideo, status, ripped=None):
+    """
+        Records the outcome of ripping a single title
+        Passes successful rips on to ripped() when given
         Returns nothing
     """
+    if status:
+        ripfile = u"%s/%s" % (dbvideo.path, dbvideo.filename)
+        if os.path.isfile(ripfile):
+            dbvideo.ripsize = os.path.getsize(ripfile)
+
+        database.update_video(dbvideo, 4)
+
+        if 'rip' in config['notification']['notify_on_state']:
+            notify.rip_complete(dbvideo)
+
+        if ripped is not None:
+            ripped(dbvideo)
+
+    else:
+        with database.atomic():
+            database.update_video(dbvideo, 2)
+
+            database.insert_history(
+                dbvideo,
+                "MakeMKV failed to rip video"
+            )
+        notify.rip_fail(dbvideo)
+
+        log.info(
+            "MakeMKV did not did not complete successfully")
+        log.info("See log for more details")
+
+
+def verify_rip(config, log, mkv_api, disc_path, dvdTitle, dbvideo):
+    """
+        Checks a ripped title against the length MakeMKV reported for it
+        A damaged rip is ripped again while the disc is still in the drive,
+            up to verify.retries times
+        Returns True if the rip is good
+    """
+    from classes import verify
+
+    verifier = verify.Verifier(config)
+    ripfile = u"%s/%s" % (disc_path, dvdTitle['title'])
+    expected = mkv_api.discInfo.get_duration(dvdTitle['index'])
+
+    for attempt in range(verifier.retries + 1):
+        if attempt > 0:
+            remove_file(log, ripfile)
+            database.insert_history(dbvideo, "Video resubmitted to MakeMKV")
+            if not mkv_api.rip_disc(disc_path, dvdTitle['index']):
+                return False
+
+        passed, reason = verifier.check(ripfile, expected)
+        database.set_verified(dbvideo, passed)
+
+        if passed:
+            log.debug(u"{} passed verification ({})".format(dvdTitle['title'], reason))
+            return True
+
+        log.error(u"{} failed verification: {}".format(dvdTitle['title'], reason))
+        database.insert_history(dbvideo, u"Verification failed: {}".format(reason), 7)
+
+    return False
+
+
+def watchdog_requeue(config, log, dbvideo, ex, status):
+    """
+        Records a job that the watchdog killed
+        Puts the video back in the given status, or marks it as failed
+            once it has stalled more than watchdog.retries times
+        Returns True if the video was put back
+    """
+    retries = int((config.get('watchdog') or {}).get('retries', 2))
+
+    with database.atomic():
+        database.insert_history(dbvideo, u"Watchdog: {}".format(ex), 5)
+
+        if status is not None and database.count_history(dbvideo, 5) <= retries:
+            log.info(u"{} stalled and was put back in the queue".format(dbvideo.vidname))
+            database.update_video(dbvideo, status)
+            return True
+
+        log.error(u"{} stalled and was marked as failed".format(dbvideo.vidname))
+        database.update_video(dbvideo, 2)
+        return False
+
+
+def make_disc_path(disc_path):
+    """
+        Creates the save folder of a disc
+        Returns False if another worker created it first
+    """
+    try:
+        os.makedirs(disc_path)
+    except OSError as ex:
+        if ex.errno == errno.EEXIST:
+            return False
+        raise
+
+    return True
+
+
+def register_disc(log, mkv_api, disc_path, quickkey):
+    """
+        Adds a newly scanned disc to the database under a folder no other
+            disc uses. Different discs with the same name are numbered
+        Returns None if an identical disc was registered in the meantime
+    """
+    fingerprint = mkv_api.discInfo.fingerprint()
+    info = u"\n".join(mkv_api.infoLines)
+
+    number = 1
+    while True:
+        path = disc_path
+        if number > 1:
+            path = u"{} ({})".format(disc_path, number)
+        number += 1
+
+        if database.disc_by_path(path) is not None or os.path.exists(path):
+            continue
+
+        disc = database.insert_disc(fingerprint, quickkey, mkv_api.label, path, info)
+        if disc is None:
+            if database.disc_by_fingerprint(fingerprint) is not None:
+                return None
+            continue
+
+        if path != disc_path:
+            log.info(u"Another disc is already called {}, using {}".format(
+                os.path.basename(disc_path), os.path.basename(path)))
+
+        make_disc_path(path)
+        return disc
+
+
+@tracing.traced('rip drive')
+@profiling.profiled('rip drive')
+def rip_drive(config, dvd, ripped=None):
+    """
+        Rips the disc in a single drive
+        Uses its own MakeMKV instance so several drives can run at once
+        Returns nothing
+    """
+    from classes import makemkv, scheduler
+
     log = logger.Logger("Rip", config['debug'], config['silent'])
 
-    mkv_save_path = config['makemkv']['savePath']
+    mkv_save_path = stager.work_path()
 
-    log.debug("Ripping initialised")
     mkv_api = makemkv.MakeMKV(config)
+    mkv_api.set_title(dvd["discTitle"])
+    if dvd["discIndex"] is None:
+        mkv_api.set_device(dvd["location"])
+    else:
+        mkv_api.set_index(dvd["discIndex"])
 
-    log.debug("Checking for disks")
-    dvds = mkv_api.find_disc()
-
-    log.debug("{} disk(s) found".format(len(dvds)))
+    disc_title = mkv_api.get_title()
 
-    if len(dvds) > 0:
-        # Best naming convention ever
-        for dvd in dvds:
-            mkv_api.set_title(dvd["discTitle"])
-            mkv_api.set_index(dvd["discIndex"])
+    if not config['force_db']:
+        disc_type = mkv_api.get_type()
+    else:
+        disc_type = config['force_db']
 
-            disc_title = mkv_api.get_title()
-            
-            if not config['force_db']:
-                disc_type = mkv_api.get_type()
-            else:
-                disc_type = config['force_db']
+    disc_path = u'{}/{}'.format(mkv_save_path, disc_title)
+    quickkey = mkv_api.get_quick_key(dvd['location'])
+    disc = database.disc_by_quickkey(quickkey)
 
-            disc_path = u'{}/{}'.format(mkv_save_path, disc_title)
-            if not os.path.exists(disc_path):
-                os.makedirs(disc_path)
+    # Folders from before discs were fingerprinted are left alone
+    if disc is None and os.path.exists(disc_path) and database.disc_by_path(disc_path) is None:
+        log.info(u"Video folder {} already exists".format(disc_title))
+        return
 
+    ripQueue = []
+    footprint = 0
+    try:
+        if disc is not None:
+            log.info(u"{} is a known disc, using its saved title list".format(disc_title))
+            mkv_api.load_disc_info(disc.info.splitlines())
+        else:
+            with meter.stage('scan') as t:
                 mkv_api.get_disc_info()
+                t.success = mkv_api.discInfo is not None
 
-                saveFiles = mkv_api.get_savefiles()
+            if mkv_api.discInfo is None:
+                return
 
-                if len(saveFiles) != 0:
-                    filebot = config['filebot']['enable']
+            disc = database.disc_by_fingerprint(mkv_api.discInfo.fingerprint())
 
-                    for dvdTitle in saveFiles:
-                        dbvideo = database.insert_video(
-                            disc_title,
-                            disc_path,
-                            disc_type,
-                            dvdTitle['realIndex'],
-                            filebot
-                        )
+        if disc is not None:
+            database.disc_seen(disc, quickkey)
+
+            if database.disc_ripped(disc):
+                log.info(u"{} has already been ripped to {}".format(disc_title, disc.path))
+                return
+
+            disc_path = disc.path
+            make_disc_path(disc_path)
+
+        else:
+            disc = register_disc(log, mkv_api, disc_path, quickkey)
+            if disc is None:
+                log.info(u"{} is already being ripped".format(disc_title))
+                return
+
+            disc_path = disc.path
+
+        saveFiles = mkv_api.get_savefiles()
+
+        if len(saveFiles) != 0:
+            footprint = stager.rip_footprint(mkv_api.discInfo, saveFiles)
+            if not stager.admit(disc_path, footprint, disc_title):
+                footprint = 0
+                try:
+                    os.rmdir(disc_path)
+                except OSError:
+                    pass
+                return
+
+            filebot = config['filebot']['enable']
+            priority = scheduler.Scheduler(config).default_priority(disc_type)
+
+            for dvdTitle in saveFiles:
+                with database.atomic():
+                    dbvideo = database.insert_video(
+                        disc_title,
+                        disc_path,
+                        disc_type,
+                        dvdTitle['realIndex'],
+                        filebot,
+                        disc.discid,
+                        mkv_api.discInfo.get_duration(dvdTitle['index']),
+                        priority
+                    )
+
+                    database.insert_history(
+                        dbvideo,
+                        "Video added to database"
+                    )
+
+                    database.update_video(
+                        dbvideo,
+                        3,
+                        dvdTitle['title']
+                    )
+
+                ripQueue.append((dvdTitle, dbvideo))
+
+            if config['makemkv'].get('batch', True):
+                log.debug(u"Attempting to rip {} title(s) from {}".format(
+                    len(ripQueue),
+                    disc_title
+                ))
+
+                with meter.stage('rip', bytesin=footprint) as t:
+                    with database.atomic():
+                        for dvdTitle, dbvideo in ripQueue:
+                            database.insert_history(
+                                dbvideo,
+                                "Video submitted to MakeMKV"
+                            )
+                    results = mkv_api.rip_titles(disc_path, saveFiles)
+
+                    t.success = all(results.values())
+                    t.bytesout = sum(file_size(u"%s/%s" % (disc_path, dvdTitle['title'])) or 0
+                                     for dvdTitle in saveFiles)
 
+                log.info(u"It took {} minute(s) to complete the ripping of {} title(s) from {}".format(
+                    t.minutes,
+                    len(ripQueue),
+                    disc_title
+                ))
+
+                for dvdTitle, dbvideo in ripQueue:
+                    status = results[dvdTitle['index']] and verify_rip(
+                        config, log, mkv_api, disc_path, dvdTitle, dbvideo)
+                    rip_finished(config, log, dbvideo, status, ripped)
+
+            else:
+                for dvdTitle, dbvideo in ripQueue:
+                    log.debug(u"Attempting to rip {} from {}".format(
+                        dvdTitle['title'],
+                        disc_title
+                    ))
+
+                    with meter.stage('rip', dbvideo, mkv_api.discInfo.get_size(dvdTitle['index'])) as t:
                         database.insert_history(
                             dbvideo,
-                            "Video added to database"
+                            "Video submitted to MakeMKV"
                         )
+                        status = mkv_api.rip_disc(
+                            disc_path, dvdTitle['index'])
 
-                        database.update_video(
-                            dbvideo,
-                            3,
-                            dvdTitle['title']
-                        )
+                        t.success = status
+                        t.bytesout = file_size(u"%s/%s" % (disc_path, dvdTitle['title']))
 
-                        log.debug(u"Attempting to rip {} from {}".format(
+                    if status:
+                        log.info(u"It took {} minute(s) to complete the ripping of {} from {}".format(
+                            t.minutes,
                             dvdTitle['title'],
                             disc_title
                         ))
 
-                        with stopwatch.StopWatch() as t:
-                            database.insert_history(
-                                dbvideo,
-                                "Video submitted to MakeMKV"
-                            )
-                            status = mkv_api.rip_disc(
-                                mkv_save_path, dvdTitle['index'])
+                        status = verify_rip(
+                            config, log, mkv_api, disc_path, dvdTitle, dbvideo)
 
-                        if status:
-                            log.info(u"It took {} minute(s) to complete the ripping of {} from {}".format(
-                                t.minutes,
-                                dvdTitle['title'],
-                                disc_title
-                            ))
+                    rip_finished(config, log, dbvideo, status, ripped)
 
-                            database.update_video(dbvideo, 4)
+            if config['makemkv']['eject']:
+                eject(config, dvd['location'])
 
-                            if 'rip' in config['notification']['notify_on_state']:
-                                notify.rip_complete(dbvideo)
+        else:
+            log.info("No video titles found")
+            log.info(
+                "Try decreasing 'minLength' in the config and try again")
 
-                        else:
-                            database.update_video(dbvideo, 2)
+    except process.Stalled as ex:
+        log.error(u"Ripping {} was stopped: {}".format(disc_title, ex))
 
-                            database.insert_history(
-                                dbvideo,
-                                "MakeMKV failed to rip video"
-                            )
-                            notify.rip_fail(dbvideo)
+        for dvdTitle, dbvideo in ripQueue:
+            if dbvideo.statusid == 3:
+                watchdog_requeue(config, log, dbvideo, ex, None)
 
-                            log.info(
-                                "MakeMKV did not did not complete successfully")
-                            log.info("See log for more details")
+        if config['makemkv']['eject']:
+            eject(config, dvd['location'])
 
-                    if config['makemkv']['eject']:
-                        eject(config, dvd['location'])
+    finally:
+        stager.release(disc_path, footprint)
 
-                else:
-                    log.info("No video titles found")
-                    log.info(
-                        "Try decreasing 'minLength' in the config and try again")
 
-            else:
-                log.info(u"Video folder {} already exists".format(disc_title))
+@tracing.traced('rip')
+@profiling.profiled('rip')
+def rip(config, ripped=None):
+    """
+        Main function for ripping
+        Does everything
+        Calls ripped(dbvideo) for every title that was ripped successfully
+        Returns nothing
+    """
+    from classes import makemkv
+
+    log = logger.Logger("Rip", config['debug'], config['silent'])
+
+    log.debug("Ripping initialised")
+    mkv_api = makemkv.MakeMKV(config)
+
+    log.debug("Checking for disks")
+    dvds = mkv_api.find_disc()
+
+    log.debug("{} disk(s) found".format(len(dvds)))
+
+    if len(dvds) > 1 and config['makemkv'].get('parallel', True):
+        workers = []
+        for dvd in dvds:
+            worker = threading.Thread(
+                target=rip_drive,
+                args=(config, dvd, ripped),
+                name="Rip-{}".format(dvd['discIndex'])
+            )
+            worker.start()
+            workers.append(worker)
+
+        for worker in workers:
+            worker.join()
+
+    elif len(dvds) > 0:
+        # Best naming convention ever
+        for dvd in dvds:
+            rip_drive(config, dvd, ripped)
 
     else:
         log.info("Could not find any DVDs in drive list")
 
 
+def rip_device(config, device, ripped=None):
+    """
+        Rips the disc that was just inserted into a drive
+        Only this drive is looked at, MakeMKV opens it by its device
+        Returns nothing
+    """
+    from classes import makemkv, volume
+
+    log = logger.Logger("Rip", config['debug'], config['silent'])
+
+    label = volume.read_label(device)
+    if label is not None:
+        rip_drive(config, {
+            "discIndex": None,
+            "discTitle": label,
+            "location": device
+        }, ripped)
+        return
+
+    # The drive could not be read directly, ask MakeMKV for every drive
+    log.debug(u"Could not read the label in {}, listing all drives".format(device))
+    mkv_api = makemkv.MakeMKV(config)
+
+    for dvd in mkv_api.find_disc():
+        if dvd['location'].strip('"') == device:
+            rip_drive(config, dvd, ripped)
+            return
+
+    log.info(u"No readable disc found in {}".format(device))
+
+
+@tracing.traced('skip compress')
+@profiling.profiled('skip compress')
 def skip_compress(config):
     """
         Main function for skipping compression
         Does everything
         Returns nothing
     """
+    from classes import compression
+
     log = logger.Logger("Skip compress", config['debug'], config['silent'])
 
     log.debug("Looking for videos to skip compression")
@@ -248,178 +608,575 @@ def skip_compress(config):
 
     for dbvideo in dbvideos:
         if comp.check_exists(dbvideo) is not False:
-            database.update_video(dbvideo, 6)
+            if stager.staged(dbvideo):
+                stager.move(dbvideo)
+            else:
+                database.update_video(dbvideo, 6)
             log.info(u"Skipping compression for {} from {}" .format(
                 dbvideo.filename, dbvideo.vidname))
 
 
-def compress(config):
+@tracing.traced('compress video')
+@profiling.profiled('compress video')
+def compress_video(config, log, comp, dbvideo, moved=None):
     """
-        Main function for compressing
-        Does everything
-        Returns nothing
+        Compresses a single video from the queue
+        Videos on the scratch volume are moved to the library afterwards,
+            moved(dbvideo) is called once it is ready for the extras stage
+        Returns True if the video is ready for the extras stage,
+            None if another worker claimed it first or there was no
+            room for the output
     """
-    log = logger.Logger("Compress", config['debug'], config['silent'])
+    from classes import verify
 
-    comp = compression.Compression(config)
+    if not database.claim_video(dbvideo, 4, 5):
+        log.debug(u"{} was claimed by another worker".format(dbvideo.filename))
+        return None
 
-    log.debug("Compressing initialised")
-    log.debug("Looking for videos to compress")
+    verifier = verify.Verifier(config)
 
-    dbvideos = database.next_video_to_compress()
+    if comp.check_exists(dbvideo) is not False:
 
-    for dbvideo in dbvideos:
-        if comp.check_exists(dbvideo) is not False:
+        source = dbvideo.filename
+        # The encoder may move the video to another folder
+        workpath = dbvideo.path
+        footprint = stager.encode_footprint(comp.invid)
+        if not stager.admit(workpath, footprint, dbvideo.filename):
+            database.update_video(dbvideo, 4)
+            return None
 
-            database.update_video(dbvideo, 5)
+        log.info(u"Compressing {} from {}" .format(
+            dbvideo.filename, dbvideo.vidname))
 
-            log.info(u"Compressing {} from {}" .format(
-                dbvideo.filename, dbvideo.vidname))
-
-            with stopwatch.StopWatch() as t:
+        try:
+            with meter.stage('encode', dbvideo, file_size(comp.invid)) as t:
                 status = comp.compress(
                     args=config['compress']['com'],
                     nice=int(config['compress']['nice']),
                     dbvideo=dbvideo
                 )
 
-            if status:
-                log.info("Video was compressed and encoded successfully")
+                t.success = status
+                t.bytesout = file_size(comp.outvid)
+                t.fps = comp.method.fps
+        except process.Stalled as ex:
+            comp.remove_partial()
+            watchdog_requeue(config, log, dbvideo, ex, 4)
+            notify.compress_fail(dbvideo)
+            return False
+        finally:
+            stager.release(workpath, footprint)
 
-                log.info(u"It took {} minutes to compress {}".format(
-                    t.minutes, dbvideo.filename
-                )
-                )
+        if status:
+            passed, reason = verifier.check_encode(comp.invid, comp.outvid)
+            database.set_verified(dbvideo, passed)
+
+            if not passed:
+                log.error(u"Compressed {} failed verification: {}".format(source, reason))
+                comp.remove_partial()
+
+                with database.atomic():
+                    database.insert_history(dbvideo, u"Verification failed: {}".format(reason), 7)
+
+                    retry = database.count_history(dbvideo, 7) <= verifier.retries
+                    dbvideo.path = workpath
+                    database.update_video(dbvideo, 4 if retry else 2, source)
+
+                if not retry:
+                    notify.compress_fail(dbvideo)
+
+                return False
 
+        if status:
+            log.info("Video was compressed and encoded successfully")
+
+            log.info(u"It took {} minutes to compress {}".format(
+                t.minutes, dbvideo.filename
+            )
+            )
+
+            if os.path.isfile(comp.outvid):
+                dbvideo.encodesize = os.path.getsize(comp.outvid)
+
+            staged = stager.staged(dbvideo)
+
+            with database.atomic():
                 database.insert_history(
                     dbvideo,
                     "Compression Completed successfully"
                 )
 
-                database.update_video(dbvideo, 6)
-
-                if 'compress' in config['notification']['notify_on_state']:
-                    notify.compress_complete(dbvideo)
+                if not staged:
+                    database.update_video(dbvideo, 6)
 
-                comp.cleanup()
+            if 'compress' in config['notification']['notify_on_state']:
+                notify.compress_complete(dbvideo)
 
-            else:
-                database.update_video(dbvideo, 5)
+            comp.cleanup()
 
-                database.insert_history(dbvideo, "Compression failed", 4)
+            if staged:
+                stager.move(dbvideo, moved)
+                return False
 
-                notify.compress_fail(dbvideo)
+            return True
 
-                log.info("Compression did not complete successfully")
         else:
+            comp.remove_partial()
+
             database.update_video(dbvideo, 2)
 
-            database.insert_history(
-                dbvideo, "Input file no longer exists", 4
-            )
+            database.insert_history(dbvideo, "Compression failed", 4)
+
+            notify.compress_fail(dbvideo)
 
+            log.info("Compression did not complete successfully")
     else:
-        log.info("Queue does not exist or is empty")
+        database.update_video(dbvideo, 2)
 
+        database.insert_history(
+            dbvideo, "Input file no longer exists", 4
+        )
 
-def extras(config):
+    return False
+
+
+@tracing.traced('compress')
+@profiling.profiled('compress')
+def compress(config):
     """
-        Main function for filebotting and flagging forced subs
+        Main function for compressing
         Does everything
         Returns nothing
     """
-    log = logger.Logger("Extras", config['debug'], config['silent'])
+    log = logger.Logger("Compress", config['debug'], config['silent'])
 
-    fb = filebot.FileBot(config['debug'], config['silent'])
+    log.debug("Compressing initialised")
+    log.debug("Looking for videos to compress")
 
-    dbvideos = database.next_video_to_filebot()
+    workers = int(config['compress'].get('workers', 1))
 
-    for dbvideo in dbvideos:
-        if config['ForcedSubs']['enable']:
-            forced = mediainfo.ForcedSubs(config)
-            log.info("Attempting to discover foreign subtitle for {}.".format(dbvideo.vidname))
+    if workers > 1:
+        log.debug("Starting {} compression workers".format(workers))
+
+        pool = []
+        for i in range(workers):
+            worker = threading.Thread(
+                target=compress_pool_worker,
+                args=(config,),
+                name="Compress-{}".format(i)
+            )
+            worker.start()
+            pool.append(worker)
+
+        for worker in pool:
+            worker.join()
+
+        return
+
+    # Claims one video at a time, so videos put back in the queue by the
+    # watchdog or a failed verification are retried in the same run
+    compress_pool_worker(config)
+
+    log.info("Queue does not exist or is empty")
+
+
+def compress_pool_worker(config):
+    """
+        Compression pool worker
+        Keeps claiming the next queued video until the queue is empty
+        Returns nothing
+    """
+    from classes import compression, scheduler
+
+    log = logger.Logger("Compress", config['debug'], config['silent'])
+
+    comp = compression.Compression(config)
+    jobs = scheduler.Scheduler(config)
+
+    while True:
+        claimed = False
+
+        for dbvideo in jobs.order(database.next_video_to_compress()):
+            if compress_video(config, log, comp, dbvideo) is not None:
+                claimed = True
+                break
+
+        if not claimed:
+            break
+
+
+@tracing.traced('extra video')
+@profiling.profiled('extra video')
+def extra_video(config, log, fb, dbvideo):
+    """
+        Flags forced subs, renames and fetches subtitles for a single video
+        Returns True if the watchdog put the video back in the queue
+    """
+    if config['ForcedSubs']['enable']:
+        # pymediainfo loads pkg_resources, only pay for it when needed
+        from classes import mediainfo
+
+        forced = mediainfo.ForcedSubs(config)
+        log.info("Attempting to discover foreign subtitle for {}.".format(dbvideo.vidname))
+        with meter.stage('forcedsubs', dbvideo):
             track = forced.discover_forcedsubs(dbvideo)
 
-            if track is not None:
-                log.info("Found foreign subtitle for {}: track {}".format(dbvideo.vidname, track))
-                log.debug("Attempting to flag track for {}: track {}".format(dbvideo.vidname, track))
+        if track is not None:
+            log.info("Found foreign subtitle for {}: track {}".format(dbvideo.vidname, track))
+            log.debug("Attempting to flag track for {}: track {}".format(dbvideo.vidname, track))
+            try:
                 flagged = forced.flag_forced(dbvideo, track)
-                if flagged:
-                    log.info("Flagging success.")
-                else:
-                    log.debug("Flag failed")
+            except process.Stalled as ex:
+                log.error(u"Flagging stopped: {}".format(ex))
+                flagged = False
+            if flagged:
+                database.set_checksum(dbvideo, None)
+                log.info("Flagging success.")
             else:
-                log.debug("Did not find foreign subtitle for {}.".format(dbvideo.vidname))
-                
-        log.info("Attempting video rename")
+                log.debug("Flag failed")
+        else:
+            log.debug("Did not find foreign subtitle for {}.".format(dbvideo.vidname))
+
+    log.info("Attempting video rename")
 
-        database.update_video(dbvideo, 7)
+    database.update_video(dbvideo, 7)
+
+    movePath = dbvideo.path
+    if config['filebot']['move']:
+        if dbvideo.vidtype == "tv":
+            movePath = config['filebot']['tvPath']
+        else:
+            movePath = config['filebot']['moviePath']
+
+    try:
+        with meter.stage('rename', dbvideo, file_size(u"%s/%s" % (dbvideo.path, dbvideo.filename))) as t:
+            status = fb.rename(dbvideo, movePath)
+            t.success = status[0]
+    except process.Stalled as ex:
+        return watchdog_requeue(config, log, dbvideo, ex, 6)
+
+    if status[0]:
+        log.info("Rename success")
+
+        database.update_video(dbvideo, 6)
+
+        if config['filebot']['subtitles']:
+            log.info("Grabbing subtitles")
+
+            try:
+                with meter.stage('subtitles', dbvideo) as t:
+                    status = fb.get_subtitles(
+                        dbvideo, config['filebot']['language'])
+                    t.success = status
+            except process.Stalled as ex:
+                log.error(u"Subtitle download stopped: {}".format(ex))
+                status = False
+
+            if status:
+                log.info("Subtitles downloaded")
+                database.update_video(dbvideo, 8)
 
-        movePath = dbvideo.path
-        if config['filebot']['move']:
-            if dbvideo.vidtype == "tv":
-                movePath = config['filebot']['tvPath']
             else:
-                movePath = config['filebot']['moviePath']
+                log.info("Subtitles not downloaded, no match")
+                database.update_video(dbvideo, 8)
 
-        status = fb.rename(dbvideo, movePath)
+            log.info(u"Completed work on {}".format(dbvideo.vidname))
 
-        if status[0]:
-            log.info("Rename success")
+            if config['commands'] is not None and len(config['commands']) > 0:
+                for com in config['commands']:
+                    subprocess.Popen(
+                        [com],
+                        stderr=subprocess.PIPE,
+                        stdout=subprocess.PIPE,
+                        shell=True
+                    )
 
-            database.update_video(dbvideo, 6)
+        else:
+            log.info("Not grabbing subtitles")
+            database.update_video(dbvideo, 8)
 
-            if config['filebot']['subtitles']:
-                log.info("Grabbing subtitles")
+        if 'extra' in config['notification']['notify_on_state']:
+            notify.extra_complete(dbvideo)
 
-                status = fb.get_subtitles(
-                    dbvideo, config['filebot']['language'])
+        log.debug(u"Attempting to delete %s" % dbvideo.path)
 
-                if status:
-                    log.info("Subtitles downloaded")
-                    database.update_video(dbvideo, 8)
+        try:
+            os.rmdir(dbvideo.path)
+        except OSError as ex:
+            if ex.errno == errno.ENOTEMPTY:
+                log.debug("Directory not empty")
 
-                else:
-                    log.info("Subtitles not downloaded, no match")
-                    database.update_video(dbvideo, 8)
+    else:
+        log.info("Rename failed")
 
-                log.info(u"Completed work on {}".format(dbvideo.vidname))
 
-                if config['commands'] is not None and len(config['commands']) > 0:
-                    for com in config['commands']:
-                        subprocess.Popen(
-                            [com],
-                            stderr=subprocess.PIPE,
-                            stdout=subprocess.PIPE,
-                            shell=True
-                        )
+@tracing.traced('extras')
+@profiling.profiled('extras')
+def extras(config):
+    """
+        Main function for filebotting and flagging forced subs
+        Does everything
+        Returns nothing
+    """
+    from classes import filebot, mover
 
-            else:
-                log.info("Not grabbing subtitles")
-                database.update_video(dbvideo, 8)
+    log = logger.Logger("Extras", config['debug'], config['silent'])
+
+    fb = filebot.FileBot(
+        config['debug'], config['silent'], mover.Mover(config))
+
+    dbvideos = database.next_video_to_filebot()
+
+    for dbvideo in dbvideos:
+        extra_video(config, log, fb, dbvideo)
+
+    else:
+        log.info("No videos ready for filebot")
 
 
+@tracing.traced('recover')
+@profiling.profiled('recover')
+def recover(config):
+    """
+        Puts videos whose worker died while holding them back in the
+            right queue, after removing any half-written output
+        Rips cannot be resumed without the disc, so they are marked as
+            failed and their folder is removed if nothing else is in it,
+            allowing the disc to be ripped again
+        Returns nothing
+    """
+    log = logger.Logger("Recover", config['debug'], config['silent'])
 
-            if 'extra' in config['notification']['notify_on_state']:
-                notify.extra_complete(dbvideo)
+    for dbvideo in database.expired_leases():
+        log.info(u"Recovering {} ({}) from status {}".format(
+            dbvideo.vidname, dbvideo.filename, dbvideo.statusid))
 
-            log.debug(u"Attempting to delete %s" % dbvideo.path)
+        if dbvideo.statusid == 3:
+            remove_file(log, u"%s/%s" % (dbvideo.path, dbvideo.filename))
+            message, status = "Rip was interrupted", 2
 
             try:
                 os.rmdir(dbvideo.path)
-            except OSError as ex:
-                if ex.errno == errno.ENOTEMPTY:
-                    log.debug("Directory not empty")
+            except OSError:
+                pass
+
+        elif dbvideo.statusid == 5:
+            remove_file(log, dbvideo.partial)
+            message, status = "Compression was interrupted", 4
+
+        elif dbvideo.statusid == 9:
+            # The video is still complete on the scratch volume
+            remove_file(log, dbvideo.partial)
+            message, status = "Move to the library was interrupted", 6
 
         else:
-            log.info("Rename failed")
+            message, status = "Rename was interrupted", 6
+
+        with database.atomic():
+            database.insert_history(dbvideo, message, 6)
+            database.update_video(dbvideo, status)
+
+
+def remove_file(log, path):
+    """
+        Deletes a file if it exists
+        Returns nothing
+    """
+    if path and os.path.isfile(path):
+        log.debug(u"Removing {}".format(path))
+        try:
+            os.remove(path)
+        except OSError:
+            log.error(u"Could not remove {}".format(path))
+
+
+def compress_worker(config, compress_queue, extra_queue):
+    """
+        Pipeline stage that compresses videos as soon as they are ripped
+        Stops when it receives None
+        Returns nothing
+    """
+    from classes import compression
+
+    log = logger.Logger("Compress", config['debug'], config['silent'])
+
+    comp = compression.Compression(config)
+
+    def moved(dbvideo):
+        if dbvideo.filebot:
+            extra_queue.put(dbvideo)
+
+    while True:
+        dbvideo = compress_queue.get()
+        if dbvideo is None:
+            break
+
+        result = compress_video(config, log, comp, dbvideo, moved)
+        if result:
+            moved(dbvideo)
+
+        elif result is False and dbvideo.statusid == 4:
+            # Put back by the watchdog or a failed verification
+            compress_queue.put(dbvideo)
+
+
+def extras_worker(config, extra_queue):
+    """
+        Pipeline stage that renames videos as soon as they are compressed
+        Stops when it receives None
+        Returns nothing
+    """
+    from classes import filebot, mover
+
+    log = logger.Logger("Extras", config['debug'], config['silent'])
+
+    fb = filebot.FileBot(
+        config['debug'], config['silent'], mover.Mover(config))
+
+    while True:
+        dbvideo = extra_queue.get()
+        if dbvideo is None:
+            break
+
+        # Retried straight away when the watchdog put it back, as the
+        # queue may already hold the stop marker
+        while extra_video(config, log, fb, dbvideo):
+            pass
+
+
+def pipeline(config, skip_compression=False, ripper=rip, poll=False):
+    """
+        Runs ripping, compression and extras at the same time
+        Each ripped title is handed straight to the compression stage and
+            each compressed video straight to the extras stage, so the
+            drive and the CPU are never waiting on each other
+        ripper(config, ripped) does the ripping, the pipeline shuts down
+            once it returns
+        With poll, an idle compression stage looks for videos waiting in
+            the database, such as ones refused for lack of space
+        Returns nothing
+    """
+    from classes import scheduler
+
+    log = logger.Logger("Pipeline", config['debug'], config['silent'])
+
+    refill = None
+    if poll and not skip_compression:
+        refill = database.next_video_to_compress
+
+    compress_queue = scheduler.JobQueue(
+        scheduler.Scheduler(config),
+        refill,
+        float((config.get('daemon') or {}).get('queueInterval', 60))
+    )
+    extra_queue = Queue.Queue()
 
+    # Work left over from earlier runs goes first
+    if skip_compression:
+        skip_compress(config)
     else:
-        log.info("No videos ready for filebot")
+        for dbvideo in database.next_video_to_compress():
+            compress_queue.put(dbvideo)
+
+    for dbvideo in database.next_video_to_filebot():
+        extra_queue.put(dbvideo)
+
+    def ripped(dbvideo):
+        if not skip_compression:
+            compress_queue.put(dbvideo)
+        elif dbvideo.filebot:
+            if stager.staged(dbvideo):
+                stager.move(dbvideo, extra_queue.put)
+            else:
+                database.update_video(dbvideo, 6)
+                extra_queue.put(dbvideo)
+
+    compressors = []
+    for i in range(max(1, int(config['compress'].get('workers', 1)))):
+        compressors.append(threading.Thread(
+            target=compress_worker,
+            args=(config, compress_queue, extra_queue),
+            name="Compress-{}".format(i)
+        ))
+
+    extractor = threading.Thread(
+        target=extras_worker,
+        args=(config, extra_queue),
+        name="Extras"
+    )
+
+    log.debug("Starting pipeline")
+    for compressor in compressors:
+        compressor.start()
+    extractor.start()
+
+    ripper(config, ripped)
+
+    for compressor in compressors:
+        compress_queue.put(None)
+    for compressor in compressors:
+        compressor.join()
+
+    stager.drain()
+
+    extra_queue.put(None)
+    extractor.join()
+
+    log.debug("Pipeline finished")
+
+
+def daemon(config, skip_compression=False):
+    """
+        Waits for discs to be inserted and rips them straight away
+        Compression and extras keep running in the background
+        Runs until SIGTERM or SIGINT, then finishes the work in hand
+        Returns nothing
+    """
+    from classes import discwatch
+
+    log = logger.Logger("Daemon", config['debug'], config['silent'])
+
+    watcher = discwatch.DiscWatcher(config)
+
+    def shutdown(signum, frame):
+        log.info("Shutting down, waiting for running jobs")
+        watcher.stop()
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    def ripper(config, ripped):
+        drives = {}
+
+        for device in watcher.events():
+            if device in drives and drives[device].is_alive():
+                log.debug(u"{} is still being ripped".format(device))
+                continue
+
+            log.info(u"Disc inserted into {}".format(device))
+            drives[device] = threading.Thread(
+                target=rip_device,
+                args=(config, device, ripped),
+                name=u"Rip-{}".format(os.path.basename(device))
+            )
+            drives[device].start()
+
+        for drive in drives.values():
+            drive.join()
+
+    log.info("Waiting for discs")
+    pipeline(config, skip_compression, ripper, poll=True)
 
 
 if __name__ == '__main__':
     arguments = docopt.docopt(__doc__, version=__version__)
+
+    if arguments['--trace']:
+        tracing.enable(arguments['--trace'])
+
+    if arguments['--profile']:
+        profiling.enable(PROFILE_PATH)
+
     config = yaml.safe_load(open(CONFIG_FILE))
 
     config['debug'] = arguments['--debug']
@@ -430,24 +1187,43 @@ if __name__ == '__main__':
         raise ValueError('{} is not a valid DB.'.format(arguments['--force_db']))
     else:
         config['force_db'] = arguments['--force_db']
-        
-    notify = notification.Notification(
-        config, config['debug'], config['silent'])
+
+    logger.configure(config)
 
     if bool(config['analytics']['enable']):
+        from classes import analytics
         analytics.ping(__version__)
 
     if arguments['--test']:
+        from classes import testing
         testing.perform_testing(config)
 
-    if arguments['--rip'] or arguments['--all']:
-        rip(config)
+    daemon_mode = arguments['--daemon']
 
-    if (arguments['--compress'] or arguments['--all']) and not arguments['--skip-compress']:
-        compress(config)
+    setup(config)
 
-    if arguments['--skip-compress']:
-        skip_compress(config)
+    database.start_heartbeat()
+    recover(config)
+
+    if daemon_mode:
+        daemon(config, arguments['--skip-compress'])
+
+    elif arguments['--all'] and arguments['--pipeline']:
+        pipeline(config, arguments['--skip-compress'])
+
+    else:
+        if arguments['--rip'] or arguments['--all']:
+            rip(config)
+
+        if (arguments['--compress'] or arguments['--all']) and not arguments['--skip-compress']:
+            compress(config)
+
+        if arguments['--skip-compress']:
+            skip_compress(config)
+
+        stager.drain()
+
+        if arguments['--extra'] or arguments['--all']:
+            extras(config)
 
-    if arguments['--extra'] or arguments['--all']:
-        extras(config)
+    profiling.report(config)
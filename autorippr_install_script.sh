@@ -68,7 +68,7 @@ fi
 sudo dpkg --force-depends -i filebot-*.deb && rm filebot-*.deb
 
 # Install Python Required Packages
-sudo pip install tendo pyyaml peewee pushover
+sudo pip install pyyaml peewee pushover
 
 # Install Autorippr
 cd ~
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic disc dumps
+
+Writes makemkvcon robot-mode info output for made-up discs, in the form
+MakeMKV writes to its --messages file. TV discs hold a run of episodes, a
+play-all title covering them and short extras, movie discs a main
+feature and extras. Titles beyond those repeat the main content under
+other playlist names, the way copy protected discs pad themselves out to
+hundreds of titles. The same seed always gives the same disc.
+
+A dump recorded from a real disc with
+    makemkvcon -r info disc:0 --messages=disc.txt
+can be used instead of a generated one.
+
+
+Released under the MIT license
+Copyright (c) 2012, Jason Millward
+
+@category   misc
+@version    $Id: 1.7.0, 2016-08-22 14:53:29 ACST $;
+@author     Jason Millward
+@license    http://opensource.org/licenses/MIT
+
+Usage:
+    discs.py  <file>  <label>  [options]
+
+Options:
+    -h --help           Show this screen.
+    --type=<type>       tv or movie [default: movie].
+    --titles=<n>        Number of titles [default: 40].
+    --episodes=<n>      Episodes on a TV disc [default: 6].
+    --extras=<n>        Short extras on the disc [default: 4].
+    --seed=<n>          Random seed [default: 0].
+
+"""
+
+import os
+import random
+import sys
+
+# Bytes a second of video takes up on a disc, matches the stand-in tools
+DISC_RATE = 2500000
+
+
+def _clock(seconds):
+    return "%d:%02d:%02d" % (seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+def _title(lines, index, label, source, seconds, chapters, segments):
+    size = seconds * DISC_RATE
+
+    lines.append('MSG:3307,0,2,"File %s was added as title #%d","File %%1 was added as title #%%2","%s","%d"' % (
+        source, index, source, index))
+    lines.append('TINFO:%d,2,0,"%s"' % (index, label))
+    lines.append('TINFO:%d,8,0,"%d"' % (index, chapters))
+    lines.append('TINFO:%d,9,0,"%s"' % (index, _clock(seconds)))
+    lines.append('TINFO:%d,10,0,"%.1f GB"' % (index, size / 1073741824.0))
+    lines.append('TINFO:%d,11,0,"%d"' % (index, size))
+    lines.append('TINFO:%d,16,0,"%s"' % (index, source))
+    lines.append('TINFO:%d,25,0,"%d"' % (index, len(segments)))
+    lines.append('TINFO:%d,26,0,"%s"' % (index, ",".join(str(s) for s in segments)))
+    lines.append('TINFO:%d,27,0,"%s_t%02d.mkv"' % (index, label, index))
+    lines.append('SINFO:%d,0,1,6201,"Video"' % index)
+    lines.append('SINFO:%d,0,5,0,"V_MPEG4/ISO/AVC"' % index)
+    lines.append('SINFO:%d,1,1,6202,"Audio"' % index)
+    lines.append('SINFO:%d,1,3,0,"eng"' % index)
+    lines.append('SINFO:%d,1,5,0,"A_AC3"' % index)
+    lines.append('SINFO:%d,2,1,6203,"Subtitles"' % index)
+    lines.append('SINFO:%d,2,3,0,"eng"' % index)
+
+
+def generate(path, label, vidtype='movie', titles=40, episodes=6, extras=4, seed=0):
+    """
+        Writes a synthetic disc dump
+
+        Inputs:
+            path     (Str): Dump file to write
+            label    (Str): Volume label, TV labels should end in _S1_D1
+            vidtype  (Str): tv or movie
+            titles   (Int): Number of titles on the disc
+            episodes (Int): Episodes on a TV disc
+            extras   (Int): Short extras on the disc
+            seed     (Int): Random seed
+
+        Outputs:
+            None
+    """
+    rand = random.Random(seed)
+    lines = [
+        'CINFO:1,6209,"Blu-ray disc"',
+        'CINFO:2,0,"%s"' % label,
+        'CINFO:30,0,"%s"' % label,
+        'CINFO:31,6119,"<b>Source information</b><br>"',
+        'CINFO:32,0,"%s"' % label,
+        'TCOUNT:%d' % titles
+    ]
+
+    content = []
+    segment = 1
+
+    if vidtype == 'tv':
+        for _ in range(episodes):
+            content.append((rand.randint(2520, 2700), rand.randint(6, 10), [segment]))
+            segment += 1
+
+        content.append((sum(c[0] for c in content), sum(c[1] for c in content), range(1, segment)))
+    else:
+        content.append((rand.randint(5400, 9000), rand.randint(16, 32), [segment]))
+        segment += 1
+
+    for _ in range(extras):
+        content.append((rand.randint(60, 600), rand.randint(1, 4), [segment]))
+        segment += 1
+
+    for index in range(titles):
+        if index < len(content):
+            seconds, chapters, segments = content[index]
+        else:
+            seconds, chapters, segments = content[index % max(1, len(content) - extras)]
+
+        _title(lines, index, label, "%05d.mpls" % (index + 800), seconds, chapters, segments)
+
+    folder = os.path.dirname(path)
+    if folder and not os.path.isdir(folder):
+        os.makedirs(folder)
+
+    with open(path, 'w') as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def main():
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from classes import docopt
+
+    arguments = docopt.docopt(__doc__)
+    generate(
+        arguments['<file>'],
+        arguments['<label>'],
+        arguments['--type'],
+        int(arguments['--titles']),
+        int(arguments['--episodes']),
+        int(arguments['--extras']),
+        int(arguments['--seed'])
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+Stand-in for HandBrakeCLI
+
+Prints verbose log lines and "Encoding: task" progress like the real
+tool and writes a sparse encode about half the size of its source.
+
+
+Released under the MIT license
+Copyright (c) 2012, Jason Millward
+
+@category   misc
+@version    $Id: 1.7.0, 2016-08-22 14:53:29 ACST $;
+@author     Jason Millward
+@license    http://opensource.org/licenses/MIT
+"""
+
+import os
+import sys
+
+import common
+
+# Encoded size compared to the source
+RATIO = 0.45
+
+# Log lines HandBrake prints for every slice of work at --verbose
+NOISE = 20
+
+
+def main(args):
+    invid = common.arguments_after('-i', args)
+    outvid = common.arguments_after('-o', args)
+    if invid is None or outvid is None or not os.path.isfile(invid):
+        common.say("ERROR: Missing input or output")
+        return 1
+
+    size = os.path.getsize(invid)
+    frames = float(size) / common.DISC_RATE * common.SOURCE_FPS
+    tasks = 2 if '--two-pass' in args else 1
+
+    common.say("[00:00:00] hb_init: starting libhb thread")
+    common.say("[00:00:00] scan: DVD has 1 title(s)")
+
+    for task in range(1, tasks + 1):
+        for step in range(common.STEPS):
+            common.pause(frames / common.ENCODE_FPS / tasks / common.STEPS)
+            for line in range(NOISE):
+                common.say("[00:00:00] sync: frame %d of task %d" % (step * NOISE + line, task))
+
+            remaining = frames / common.ENCODE_FPS / tasks * (common.STEPS - step) / common.STEPS
+            common.say("Encoding: task %d of %d, %.2f %% (%.2f fps, avg %.2f fps, ETA %s)" % (
+                task, tasks, step * 100.0 / common.STEPS, common.ENCODE_FPS, common.ENCODE_FPS,
+                common.clock(remaining).replace(':', 'h', 1).replace(':', 'm') + 's'))
+
+        common.say("[00:00:00] average encoding speed for job is %f fps" % common.ENCODE_FPS)
+
+    common.sparse(outvid, int(size * RATIO))
+    common.say("[00:00:00] libhb: work result = 0")
+    common.say("Encode done!")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+Shared helpers for the stand-in tools
+
+The stand-ins take the place of makemkvcon, HandBrakeCLI, ffmpeg and
+filebot during benchmarks. They print what the real tools print and
+write sparse files of realistic size, taking as long as the real tool
+would multiplied by AUTORIPPR_BENCH_SCALE.
+
+AUTORIPPR_BENCH is the benchmark folder, drives.json in it lists the disc
+dump loaded in every drive.
+
+
+Released under the MIT license
+Copyright (c) 2012, Jason Millward
+
+@category   misc
+@version    $Id: 1.7.0, 2016-08-22 14:53:29 ACST $;
+@author     Jason Millward
+@license    http://opensource.org/licenses/MIT
+"""
+
+import json
+import os
+import sys
+import time
+
+# Bytes a second of video takes up on a disc
+DISC_RATE = 2500000
+
+# Real tool speeds the scale is applied to
+RIP_RATE = 12 * 1048576
+SCAN_SECONDS = 40
+ENCODE_FPS = 100
+SOURCE_FPS = 23.976
+JVM_SECONDS = 2
+
+# Progress lines printed per job
+STEPS = 10
+
+
+def bench_path(*parts):
+    return os.path.join(os.environ['AUTORIPPR_BENCH'], *parts)
+
+
+def scale():
+    return float(os.environ.get('AUTORIPPR_BENCH_SCALE', 0.001))
+
+
+def pause(seconds):
+    """
+        Waits as long as the real tool would, scaled
+    """
+    time.sleep(max(0.0, seconds * scale()))
+
+
+def say(line):
+    sys.stdout.write(line + "\n")
+    sys.stdout.flush()
+
+
+def drives():
+    with open(bench_path('drives.json')) as f:
+        return json.load(f)
+
+
+def split_values(payload):
+    values = []
+    current = []
+    quoted = False
+    for char in payload:
+        if char == '"':
+            quoted = not quoted
+        elif char == ',' and not quoted:
+            values.append(''.join(current))
+            current = []
+        else:
+            current.append(char)
+    values.append(''.join(current))
+    return values
+
+
+def read_dump(path):
+    """
+        Reads the titles of a robot-mode disc dump
+
+        Inputs:
+            path    (Str): Dump file
+
+        Outputs:
+            titles  (Dict): Title id => {'filename', 'size'}
+    """
+    titles = {}
+    with open(path) as f:
+        for line in f:
+            if not line.startswith('TINFO:'):
+                continue
+
+            values = split_values(line.strip()[6:])
+            title = titles.setdefault(int(values[0]), {'filename': None, 'size': 0})
+            if values[1] == '27':
+                title['filename'] = values[3]
+            elif values[1] == '11':
+                title['size'] = int(values[3])
+
+    return titles
+
+
+def sparse(path, size):
+    """
+        Writes a file of the given size without using the space
+    """
+    with open(path, 'wb') as f:
+        f.truncate(size)
+
+
+def arguments_after(flag, args):
+    if flag in args and args.index(flag) + 1 < len(args):
+        return args[args.index(flag) + 1].strip('"')
+    return None
+
+
+def clock(seconds):
+    seconds = int(seconds)
+    return "%02d:%02d:%02d" % (seconds // 3600, seconds // 60 % 60, seconds % 60)
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""
+Stand-in for ffmpeg
+
+Prints the input duration and "frame= ... speed=" progress like the real
+tool and writes a sparse encode about half the size of its source.
+
+
+Released under the MIT license
+Copyright (c) 2012, Jason Millward
+
+@category   misc
+@version    $Id: 1.7.0, 2016-08-22 14:53:29 ACST $;
+@author     Jason Millward
+@license    http://opensource.org/licenses/MIT
+"""
+
+import os
+import sys
+
+import common
+
+# Encoded size compared to the source
+RATIO = 0.45
+
+
+def main(args):
+    invid = common.arguments_after('-i', args)
+    outvid = args[-1].strip('"')
+    if invid is None or not os.path.isfile(invid) or outvid == invid:
+        sys.stderr.write("Missing input or output\n")
+        return 1
+
+    size = os.path.getsize(invid)
+    duration = float(size) / common.DISC_RATE
+    frames = duration * common.SOURCE_FPS
+    speed = float(common.ENCODE_FPS) / common.SOURCE_FPS
+
+    common.say("Input #0, matroska,webm, from '%s':" % invid)
+    common.say("  Duration: %s.00, start: 0.000000, bitrate: 20000 kb/s" % common.clock(duration))
+
+    for step in range(1, common.STEPS + 1):
+        common.pause(frames / common.ENCODE_FPS / common.STEPS)
+        common.say("frame=%6d fps=%.0f q=28.0 size=%8dkB time=%s.00 bitrate=9000.0kbits/s speed=%.2fx" % (
+            frames * step / common.STEPS, common.ENCODE_FPS, size * RATIO * step / common.STEPS / 1024,
+            common.clock(duration * step / common.STEPS), speed))
+
+    common.sparse(outvid, int(size * RATIO))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+Stand-in for filebot
+
+Answers -rename and -get-subtitles the way FileBot does once its JVM has
+started. Renames always match, the new name is built from the --q query.
+
+
+Released under the MIT license
+Copyright (c) 2012, Jason Millward
+
+@category   misc
+@version    $Id: 1.7.0, 2016-08-22 14:53:29 ACST $;
+@author     Jason Millward
+@license    http://opensource.org/licenses/MIT
+"""
+
+import os
+import shutil
+import sys
+
+import common
+
+
+def rename(args):
+    source = common.arguments_after('-rename', args)
+    query = common.arguments_after('--q', args) or "Unknown"
+    output = common.arguments_after('--output', args) or os.path.dirname(source)
+    action = (common.arguments_after('--action', args) or "move").upper()
+
+    target = os.path.join(output, query, os.path.basename(source))
+
+    common.say("Rename movies using [%s]" % (common.arguments_after('--db', args) or "TheMovieDB"))
+    common.say("Auto-detect movie from context [%s]" % source)
+
+    if action != "TEST":
+        folder = os.path.dirname(target)
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        shutil.move(source, target)
+
+    common.say("[%s] from [%s] to [%s]" % (action, source, target))
+    common.say("Processed 1 files")
+    return 0
+
+
+def subtitles(args):
+    common.say("Looking up subtitles by hash via OpenSubtitles")
+    common.say("Processed 1 files")
+    return 0
+
+
+def main(args):
+    common.pause(common.JVM_SECONDS)
+
+    if '-rename' in args:
+        status = rename(args)
+    elif '-get-subtitles' in args:
+        status = subtitles(args)
+    else:
+        sys.stderr.write("Unsupported arguments: %s\n" % " ".join(args))
+        return 1
+
+    common.say("Done ?(?????)?")
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
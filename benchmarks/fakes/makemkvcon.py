@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+Stand-in for makemkvcon
+
+Lists the drives in drives.json, replays their disc dumps for info and
+writes sparse titles for mkv, in robot mode like the real tool.
+
+
+Released under the MIT license
+Copyright (c) 2012, Jason Millward
+
+@category   misc
+@version    $Id: 1.7.0, 2016-08-22 14:53:29 ACST $;
+@author     Jason Millward
+@license    http://opensource.org/licenses/MIT
+"""
+
+import os
+import shutil
+import sys
+
+import common
+
+
+def started():
+    common.say('MSG:1005,0,1,"MakeMKV v1.17.0 linux(x64-release) started","%1 started","MakeMKV v1.17.0 linux(x64-release)"')
+
+
+def drive(args):
+    for arg in args:
+        if arg.startswith('disc:'):
+            return int(arg[5:])
+    return -1
+
+
+def list_drives():
+    started()
+    drives = common.drives()
+    for index, loaded in enumerate(drives):
+        label = loaded['label'] if loaded.get('dump') else ""
+        flags = 1 if label else 0
+        common.say('DRV:%d,2,999,%d,"BD-RE BENCH %d","%s","%s"' % (
+            index, flags, index, label, loaded['device']))
+    common.say('DRV:%d,256,999,0,"","",""' % len(drives))
+    return 0
+
+
+def info(index, args):
+    loaded = common.drives()[index]
+    messages = None
+    for arg in args:
+        if arg.startswith('--messages='):
+            messages = arg[len('--messages='):]
+
+    started()
+    for step in range(common.STEPS):
+        common.pause(float(common.SCAN_SECONDS) / common.STEPS)
+        common.say('PRGV:%d,%d,65536' % (step * 6553, step * 6553))
+
+    if messages is not None:
+        shutil.copyfile(loaded['dump'], messages)
+    else:
+        with open(loaded['dump']) as f:
+            for line in f:
+                common.say(line.rstrip('\n'))
+
+    return 0
+
+
+def rip(index, args):
+    loaded = common.drives()[index]
+    position = args.index('disc:%d' % index)
+    which, path = args[position + 1], args[position + 2]
+
+    titles = common.read_dump(loaded['dump'])
+    if which != 'all':
+        titles = {int(which): titles[int(which)]}
+
+    started()
+    total = sum(t['size'] for t in titles.values()) or 1
+    done = 0
+    saved = 0
+
+    for title_id in sorted(titles):
+        title = titles[title_id]
+        common.say('PRGT:5018,0,"Saving to MKV file"')
+        common.say('PRGC:5017,0,"Saving to MKV file"')
+
+        for step in range(1, common.STEPS + 1):
+            common.pause(float(title['size']) / common.RIP_RATE / common.STEPS)
+            current = done + title['size'] * step // common.STEPS
+            common.say('PRGV:%d,%d,65536' % (
+                65536 * step // common.STEPS, 65536 * current // total))
+
+        common.sparse(os.path.join(path, title['filename']), title['size'])
+        done += title['size']
+        saved += 1
+
+    common.say('MSG:5036,0,1,"Copy complete. %d titles saved.","Copy complete. %%1 titles saved.","%d"' % (
+        saved, saved))
+    return 0
+
+
+def main(args):
+    if 'info' in args:
+        index = drive(args)
+        if index < 0:
+            return list_drives()
+        return info(index, args)
+
+    if 'mkv' in args:
+        return rip(drive(args), args)
+
+    sys.stderr.write("Unsupported arguments: %s\n" % " ".join(args))
+    return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
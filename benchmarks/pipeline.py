@@ -0,0 +1,358 @@
+# -*- coding: utf-8 -*-
+"""
+Pipeline benchmark
+
+Runs rip(), compress() and extras() end to end without a drive or any of
+the real tools. Stand-ins for makemkvcon, HandBrakeCLI, ffmpeg and filebot
+are put first on PATH. They replay generated disc dumps, print the same
+progress the real tools do and write sparse files, so hundreds of GB of
+video take no space. As nothing is really written, staging is told every
+volume has --space GB free. Tool run times are scaled by --scale, 1 takes as
+long as the real tools would.
+
+Discs are loaded into the drives a round at a time, every round is ripped
+with rip() before the next is loaded. Everything runs in a temporary
+folder with its own database, nothing is read from or written to the
+real autorippr.sqlite or settings.cfg.
+
+Reports jobs an hour for every phase, the time spent in the database,
+parsing disc info, ordering the compression queue and running tools, and
+the stage totals from the metrics table.
+
+
+Released under the MIT license
+Copyright (c) 2012, Jason Millward
+
+@category   misc
+@version    $Id: 1.7.0, 2016-08-22 14:53:29 ACST $;
+@author     Jason Millward
+@license    http://opensource.org/licenses/MIT
+
+Usage:
+    pipeline.py  [options]
+
+Options:
+    -h --help           Show this screen.
+    --discs=<n>         Discs to rip [default: 8].
+    --drives=<n>        Drives ripping at the same time [default: 2].
+    --titles=<n>        Titles on every disc [default: 200].
+    --tv=<share>        Share of TV discs, 0 to 1 [default: 0.5].
+    --encoder=<type>    handbrake or ffmpeg [default: handbrake].
+    --workers=<n>       Compression workers [default: 2].
+    --scale=<factor>    Tool run time compared to the real tools [default: 0.001].
+    --space=<gb>        Free space every volume reports [default: 2000].
+    --dump=<file>       Recorded disc dump to use for every disc instead.
+    --json=<file>       Also write the results as JSON.
+    --keep              Keep the benchmark folder.
+
+"""
+
+import json
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FAKES = os.path.join(ROOT, 'benchmarks', 'fakes')
+TOOLS = ['makemkvcon', 'HandBrakeCLI', 'ffmpeg', 'filebot']
+
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+import yaml
+
+import discs
+from classes import docopt
+
+
+class Timer(object):
+
+    def __init__(self):
+        """
+            Adds up the calls and time spent in wrapped functions, by key
+
+            Inputs:
+                None
+
+            Outputs:
+                The timer instance
+        """
+        self.lock = threading.Lock()
+        self.totals = {}
+
+    def add(self, key, seconds):
+        with self.lock:
+            calls, total = self.totals.get(key, (0, 0.0))
+            self.totals[key] = (calls + 1, total + seconds)
+
+    def wrap(self, function, key):
+        """
+            Returns function timed under key, key may be a function of
+                the call arguments
+        """
+        def wrapper(*args, **kwargs):
+            start = time.time()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.add(key(*args) if callable(key) else key, time.time() - start)
+
+        return wrapper
+
+    def get(self, key):
+        return self.totals.get(key, (0, 0.0))
+
+
+def make_tools(path):
+    """
+        Writes a wrapper for every stand-in tool into path
+    """
+    os.makedirs(path)
+
+    for tool in TOOLS:
+        wrapper = os.path.join(path, tool)
+        with open(wrapper, 'w') as f:
+            f.write('#!/bin/sh\nexec "%s" "%s" "$@"\n' % (
+                sys.executable, os.path.join(FAKES, tool + '.py')))
+
+        os.chmod(wrapper, os.stat(wrapper).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+
+
+def make_discs(path, arguments):
+    """
+        Generates a dump for every disc, or uses the recorded one
+
+        Outputs:
+            loaded  (List): {'label', 'dump'} of every disc
+    """
+    count = int(arguments['--discs'])
+    share = float(arguments['--tv'])
+    loaded = []
+    shows = 0
+
+    for index in range(count):
+        dump = os.path.join(path, 'disc{:03d}.txt'.format(index))
+
+        if arguments['--dump']:
+            label = 'BENCH_DUMP_{:03d}'.format(index)
+            shutil.copyfile(arguments['--dump'], dump)
+        elif int((index + 1) * share) > shows:
+            shows += 1
+            label = 'BENCH_SHOW_{:03d}_S1_D1'.format(index)
+            discs.generate(dump, label, 'tv', int(arguments['--titles']), seed=index)
+        else:
+            label = 'BENCH_MOVIE_{:03d}'.format(index)
+            discs.generate(dump, label, 'movie', int(arguments['--titles']), seed=index)
+
+        loaded.append({'label': label, 'dump': dump})
+
+    return loaded
+
+
+def load_drives(path, drives, loaded):
+    """
+        Puts the given discs in the drives, the rest are left empty
+    """
+    with open(os.path.join(path, 'drives.json'), 'w') as f:
+        json.dump([{
+            'device': '/dev/sr{}'.format(index),
+            'label': loaded[index]['label'] if index < len(loaded) else "",
+            'dump': loaded[index]['dump'] if index < len(loaded) else None
+        } for index in range(drives)], f)
+
+
+def make_config(path, arguments):
+    """
+        Reads settings.example.cfg and points everything at path
+    """
+    with open(os.path.join(ROOT, 'settings.example.cfg')) as f:
+        config = yaml.safe_load(f)
+
+    config['debug'] = False
+    config['silent'] = True
+    config['force_db'] = None
+
+    config['makemkv']['makemkvconPath'] = ""
+    config['makemkv']['savePath'] = os.path.join(path, 'rips')
+    config['makemkv']['eject'] = False
+
+    config['compress']['compressionPath'] = ""
+    config['compress']['type'] = arguments['--encoder']
+    config['compress']['workers'] = int(arguments['--workers'])
+    config['compress']['split']['enable'] = False
+    if arguments['--encoder'] == 'ffmpeg':
+        # FFmpeg writes its encodes under compressionPath
+        config['compress']['compressionPath'] = os.path.join(path, 'encodes')
+        config['compress']['com'] = ['-map 0', '-c copy', '-c:v libx264', '-crf 20', '-preset medium']
+
+    config['filebot']['move'] = True
+    config['filebot']['moviePath'] = os.path.join(path, 'movies')
+    config['filebot']['tvPath'] = os.path.join(path, 'tv')
+
+    config['ForcedSubs']['enable'] = False
+    config['verify']['enable'] = False
+    config['staging']['enable'] = False
+    config['analytics']['enable'] = False
+    config['notification']['enable'] = False
+
+    config['logging']['file'] = os.path.join(path, 'autorippr.log')
+    config['metrics']['enable'] = True
+    config['metrics']['textfile'] = os.path.join(path, 'autorippr.prom')
+
+    os.makedirs(config['makemkv']['savePath'])
+    return config
+
+
+def per_hour(jobs, seconds):
+    return jobs * 3600.0 / seconds if seconds > 0 else 0.0
+
+
+def run(path, arguments):
+    """
+        Rips, compresses and renames every disc in the benchmark folder
+
+        Outputs:
+            results (Dict)
+    """
+    drives = int(arguments['--drives'])
+
+    make_tools(os.path.join(path, 'bin'))
+    loaded = make_discs(os.path.join(path, 'discs'), arguments)
+    config = make_config(path, arguments)
+
+    from classes import logger
+    logger.configure(config)
+
+    import autorippr
+    autorippr.setup(config)
+
+    from classes import database, discinfo, process, scheduler, staging
+
+    space = int(arguments['--space']) * 1073741824
+    staging.free_space = lambda path: space
+
+    timer = Timer()
+    database.database.execute_sql = timer.wrap(database.database.execute_sql, 'database')
+    discinfo.DiscInfo.from_lines = staticmethod(timer.wrap(discinfo.DiscInfo.from_lines, 'parse'))
+    scheduler.Scheduler.order = timer.wrap(scheduler.Scheduler.order, 'scheduling')
+    process.Process.run = timer.wrap(
+        process.Process.run, lambda proc, *args: 'tool ' + (proc.watchdog or 'other'))
+
+    phases = {'rip': 0.0, 'compress': 0.0, 'extras': 0.0}
+    start = time.time()
+
+    for first in range(0, len(loaded), drives):
+        load_drives(path, drives, loaded[first:first + drives])
+        began = time.time()
+        autorippr.rip(config)
+        phases['rip'] += time.time() - began
+
+    began = time.time()
+    autorippr.compress(config)
+    autorippr.stager.drain()
+    phases['compress'] = time.time() - began
+
+    began = time.time()
+    autorippr.extras(config)
+    autorippr.stager.drain()
+    phases['extras'] = time.time() - began
+
+    total = time.time() - start
+
+    statuses = {}
+    for video in database.Videos.select():
+        statuses[video.statusid] = statuses.get(video.statusid, 0) + 1
+
+    stages = {}
+    for row in database.metric_totals():
+        if row.success:
+            stages[row.stage] = (row.runs, row.seconds or 0.0)
+
+    jobs = {
+        'rip': sum(statuses.values()),
+        'compress': stages.get('encode', (0, 0.0))[0],
+        'extras': stages.get('rename', (0, 0.0))[0]
+    }
+
+    return {
+        'discs': len(loaded),
+        'drives': drives,
+        'scale': float(arguments['--scale']),
+        'seconds': total,
+        'completed': statuses.get(8, 0),
+        'failed': statuses.get(2, 0),
+        'jobsPerHour': per_hour(statuses.get(8, 0), total),
+        'phases': dict((name, {
+            'seconds': phases[name],
+            'jobs': jobs[name],
+            'jobsPerHour': per_hour(jobs[name], phases[name])
+        }) for name in phases),
+        'timings': dict((key, {
+            'calls': calls,
+            'seconds': seconds
+        }) for key, (calls, seconds) in timer.totals.items()),
+        'stages': dict((name, {
+            'runs': runs,
+            'seconds': seconds
+        }) for name, (runs, seconds) in stages.items())
+    }
+
+
+def report(results):
+    print "{} discs in {} drives, {} videos completed and {} failed in {:.1f}s, {:.1f} jobs/hour".format(
+        results['discs'], results['drives'], results['completed'], results['failed'],
+        results['seconds'], results['jobsPerHour'])
+
+    print
+    print "%-20s %10s %10s %12s" % ("phase", "jobs", "seconds", "jobs/hour")
+    for name in ['rip', 'compress', 'extras']:
+        phase = results['phases'][name]
+        print "%-20s %10d %10.2f %12.1f" % (name, phase['jobs'], phase['seconds'], phase['jobsPerHour'])
+
+    print
+    print "%-20s %10s %10s %12s" % ("time spent in", "calls", "seconds", "ms/call")
+    for key in sorted(results['timings']):
+        timing = results['timings'][key]
+        print "%-20s %10d %10.3f %12.3f" % (
+            key, timing['calls'], timing['seconds'], timing['seconds'] * 1000 / max(1, timing['calls']))
+
+    print
+    print "%-20s %10s %10s" % ("stage", "runs", "seconds")
+    for name in sorted(results['stages']):
+        stage = results['stages'][name]
+        print "%-20s %10d %10.2f" % (name, stage['runs'], stage['seconds'])
+
+
+def main():
+    arguments = docopt.docopt(__doc__)
+
+    path = tempfile.mkdtemp(prefix='autorippr-bench-')
+
+    # Read by the database and the stand-ins, so they have to be set
+    # before autorippr is imported
+    os.environ['AUTORIPPR_DB'] = os.path.join(path, 'autorippr.sqlite')
+    os.environ['AUTORIPPR_BENCH'] = path
+    os.environ['AUTORIPPR_BENCH_SCALE'] = arguments['--scale']
+    os.environ['PATH'] = os.path.join(path, 'bin') + os.pathsep + os.environ.get('PATH', '')
+
+    try:
+        results = run(path, arguments)
+    finally:
+        if arguments['--keep']:
+            print "Benchmark folder kept in {}".format(path)
+        else:
+            shutil.rmtree(path, ignore_errors=True)
+
+    report(results)
+
+    if arguments['--json']:
+        with open(arguments['--json'], 'w') as f:
+            json.dump(results, f, indent=4, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
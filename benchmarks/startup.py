@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+Startup benchmark
+
+Times how long a fresh interpreter takes to get ready for each mode, which
+is paid on every cron start. Every sample is a new process, so nothing is
+cached between runs except by the operating system. The old behaviour of
+importing every class, along with yaml and tendo as autorippr.py used to, is
+timed as well for comparison.
+
+Every case opens a new database in a temporary folder, so the real
+autorippr.sqlite is left alone.
+
+
+Released under the MIT license
+Copyright (c) 2012, Jason Millward
+
+@category   misc
+@version    $Id: 1.7.0, 2016-08-22 14:53:29 ACST $;
+@author     Jason Millward
+@license    http://opensource.org/licenses/MIT
+
+Usage:
+    startup.py  [options]
+
+Options:
+    -h --help       Show this screen.
+    --runs=<n>      Samples per case [default: 10].
+
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from classes import docopt
+
+# The classes the functions of each mode import when they run, mediainfo
+# only comes with ForcedSubs enabled
+RIP = "makemkv, scheduler, verify"
+COMPRESS = "compression, scheduler, verify"
+EXTRA = "filebot, mover"
+DAEMON = "discwatch, volume"
+
+CASES = [
+    ('interpreter', "pass"),
+    ('import everything', "import yaml; from tendo import singleton; from classes import *"),
+    ('rip', "import autorippr; from classes import %s" % RIP),
+    ('compress', "import autorippr; from classes import %s" % COMPRESS),
+    ('extra', "import autorippr; from classes import %s" % EXTRA),
+    ('all', "import autorippr; from classes import %s, %s, %s" % (RIP, COMPRESS, EXTRA)),
+    ('daemon', "import autorippr; from classes import %s, %s, %s, %s" % (RIP, COMPRESS, EXTRA, DAEMON))
+]
+
+
+def sample(code, env):
+    """
+        Runs code in a new interpreter
+
+        Inputs:
+            code    (Str): Python source
+            env     (Dict): Environment of the interpreter
+
+        Outputs:
+            seconds (Float): Wall time, None if the code failed
+    """
+    start = time.time()
+    proc = subprocess.Popen(
+        [sys.executable, '-c', code],
+        cwd=ROOT,
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE
+    )
+    _, err = proc.communicate()
+    elapsed = time.time() - start
+
+    if proc.returncode != 0:
+        print err.strip().splitlines()[-1] if err.strip() else "exit code %d" % proc.returncode
+        return None
+
+    return elapsed
+
+
+def main():
+    arguments = docopt.docopt(__doc__)
+    runs = int(arguments['--runs'])
+
+    path = tempfile.mkdtemp(prefix='autorippr-startup-')
+    env = dict(os.environ)
+    env['AUTORIPPR_DB'] = os.path.join(path, 'autorippr.sqlite')
+
+    print "%-20s %10s %10s %10s" % ("case", "min ms", "median ms", "max ms")
+
+    try:
+        for name, code in CASES:
+            samples = []
+            for _ in range(runs):
+                elapsed = sample(code, env)
+                if elapsed is None:
+                    break
+                samples.append(elapsed * 1000)
+
+            if len(samples) == 0:
+                print "%-20s %10s" % (name, "failed")
+                continue
+
+            samples.sort()
+            print "%-20s %10.1f %10.1f %10.1f" % (
+                name, samples[0], samples[len(samples) // 2], samples[-1])
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
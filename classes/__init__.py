@@ -3,6 +3,8 @@ __all__ = [
     'analytics',
     'compression',
     'database',
+    'discinfo',
+    'discwatch',
     'docopt',
     'ffmpeg',
     'filebot',
@@ -10,7 +12,18 @@ __all__ = [
     'logger',
     'makemkv',
     'mediainfo',
+    'metrics',
+    'mover',
     'notification',
+    'process',
+    'profiling',
+    'progress',
+    'scheduler',
+    'splitencode',
+    'staging',
     'stopwatch',
-    'testing'
+    'testing',
+    'tracing',
+    'verify',
+    'volume'
 ]
@@ -12,11 +12,20 @@ Copyright (c) 2014, Ian Bird, Jason Millward
 @license    http://opensource.org/licenses/MIT
 """
 
+import multiprocessing
 import os
+import re
+import threading
 
+import database
 import ffmpeg
 import handbrake
 import logger
+import splitencode
+
+# Output names handed out to running encodes, shared by all workers
+_reserved_names = set()
+_reserved_lock = threading.Lock()
 
 
 class Compression(object):
@@ -33,7 +42,40 @@ class Compression(object):
         """
         self.log = logger.Logger("Compression", config['debug'], config['silent'])
         self.method = self.which_method(config)
+        self.vformat = config['compress']['format']
+        self.threads = self.job_threads(config)
+        self.splitter = splitencode.SplitEncoder(config, self.threads)
         self.invid = ""
+        self.outvid = ""
+        self.vidname = None
+
+    @staticmethod
+    def job_threads(config):
+        """
+            Works out how many encoder threads each job may use
+            An explicit compress.threads wins, otherwise the cores are
+                split evenly between the compression workers
+
+            Inputs:
+                config    (??): The configuration
+
+            Outputs:
+                threads   (Int): 0 leaves the choice to the encoder
+        """
+        threads = int(config['compress'].get('threads', 0))
+        if threads > 0:
+            return threads
+
+        workers = int(config['compress'].get('workers', 1))
+        if workers <= 1:
+            return 0
+
+        try:
+            cores = multiprocessing.cpu_count()
+        except NotImplementedError:
+            return 0
+
+        return max(1, cores // workers)
 
     def which_method(self, config):
         if config['compress']['type'] == "ffmpeg":
@@ -51,9 +93,65 @@ class Compression(object):
                 config['silent']
             )
 
+    def reserve_name(self, dbvideo):
+        """
+            Picks the output file name for a video
+            TV episodes are numbered after the episodes already in the
+                database and the ones other workers are encoding right now
+
+            Inputs:
+                dbvideo (Obj): Video database object
+
+            Outputs:
+                vidname (Str)
+        """
+        if dbvideo.vidtype != "tv":
+            return u"%s.%s" % (dbvideo.vidname, self.vformat)
+
+        # Query the SQLite database for similar titles (TV Shows)
+        basename = re.sub(r'D(\d)', '', dbvideo.vidname)
+
+        with _reserved_lock:
+            episode = database.search_video_name(basename) + 1
+            vidname = u"%sE%d.%s" % (basename, episode, self.vformat)
+
+            while (vidname in _reserved_names or
+                   database.search_video_name(vidname) > 0):
+                episode += 1
+                vidname = u"%sE%d.%s" % (basename, episode, self.vformat)
+
+            _reserved_names.add(vidname)
+
+        return vidname
+
+    def release_name(self):
+        """
+            Gives the reserved output name back once the encode is over
+
+            Inputs:
+                None
+
+            Outputs:
+                None
+        """
+        if self.vidname is not None:
+            with _reserved_lock:
+                _reserved_names.discard(self.vidname)
+            self.vidname = None
+
     def compress(self, **args):
+        self.vidname = self.reserve_name(args['dbvideo'])
+        self.outvid = self.method.output_path(args['dbvideo'], self.vidname)
+        database.set_partial(args['dbvideo'], self.outvid)
+        args['vidname'] = self.vidname
+        args['threads'] = self.threads
+        args['splitter'] = self.splitter
+
         self.log.debug('Compression args: {}'.format(args))
-        return self.method.compress(**args)
+        try:
+            return self.method.compress(**args)
+        finally:
+            self.release_name()
 
     def check_exists(self, dbvideo):
         """
@@ -77,6 +175,22 @@ class Compression(object):
             self.log.error("Input file no longer exists, abording")
             return False
 
+    def remove_partial(self):
+        """
+            Deletes the output of an encode that did not finish
+
+            Inputs:
+                None
+
+            Outputs:
+                None
+        """
+        if self.outvid != "" and os.path.isfile(self.outvid):
+            try:
+                os.remove(self.outvid)
+            except OSError:
+                self.log.error(u"Could not remove %s" % self.outvid)
+
     def cleanup(self):
         """
             Deletes files once the compression has finished with them
@@ -87,8 +201,14 @@ class Compression(object):
             Outputs:
                 None
         """
-        if self.invid is not "":
+        if self.invid != "":
             try:
                 os.remove(self.invid)
             except:
                 self.log.error(u"Could not remove %s" % self.invid)
+
+            # Left empty when the encode was written to another folder
+            try:
+                os.rmdir(os.path.dirname(self.invid))
+            except OSError:
+                pass
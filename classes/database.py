@@ -13,12 +13,60 @@ Copyright (c) 2012, Jason Millward
 """
 
 import os
-from datetime import datetime
+import socket
+import threading
+from datetime import datetime, timedelta
 
 from peewee import *
+from playhouse.migrate import SqliteMigrator, migrate
 
 DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-database = SqliteDatabase('%s/autorippr.sqlite' % DIR, **{})
+
+# AUTORIPPR_DB points at another database file, eg. for benchmarks
+PATH = os.environ.get('AUTORIPPR_DB') or '%s/autorippr.sqlite' % DIR
+
+# WAL lets readers and a writer work at the same time, and with it only
+# checkpoints need a full fsync. Writers wait for each other for up to
+# BUSY_TIMEOUT seconds instead of failing with "database is locked"
+BUSY_TIMEOUT = 30
+
+database = SqliteDatabase(
+    PATH,
+    pragmas=(
+        ('journal_mode', 'wal'),
+        ('synchronous', 'normal'),
+        ('busy_timeout', BUSY_TIMEOUT * 1000)
+    ),
+    timeout=BUSY_TIMEOUT
+)
+
+# Indexes for the queue lookups, created on existing databases too.
+# A column may be followed by its collation
+INDEXES = [
+    ('videos_status_filename', 'videos', ('statusID', 'filename', 'vidID')),
+    ('videos_status_filebot', 'videos', ('statusID', 'filebot', 'filename')),
+    ('videos_filename_nocase', 'videos', ('filename COLLATE NOCASE',)),
+    ('videos_disc', 'videos', ('discID', 'statusID')),
+    ('history_video_type', 'history', ('vidID', 'historyTypeID'))
+]
+
+# Indexes since replaced, dropped from existing databases
+OBSOLETE_INDEXES = ['videos_filename']
+
+# Stored in the user_version pragma once the schema is up to date. Bump it
+# whenever a table, column, index or type row is added, so existing
+# databases are upgraded on their next start
+SCHEMA_VERSION = 3
+
+# Statuses a video is in while a worker is busy with it
+IN_FLIGHT = (3, 5, 7, 9)
+
+# Seconds a lease is valid without a heartbeat
+LEASE_TTL = 300
+
+LEASE_HOST = socket.gethostname()
+
+LEASE_OWNER = u"{}:{}".format(LEASE_HOST, os.getpid())
 
 
 class BaseModel(Model):
@@ -55,11 +103,50 @@ class Videos(BaseModel):
     filebot = BooleanField()
     statusid = IntegerField(db_column='statusID')
     lastupdated = DateTimeField(db_column='lastUpdated')
+    leaseowner = CharField(db_column='leaseOwner', null=True)
+    heartbeat = DateTimeField(null=True)
+    leaseexpiry = DateTimeField(db_column='leaseExpiry', null=True)
+    partial = CharField(null=True)
+    discid = IntegerField(db_column='discID', null=True)
+    ripsize = BigIntegerField(db_column='ripSize', null=True)
+    encodesize = BigIntegerField(db_column='encodeSize', null=True)
+    checksum = CharField(null=True)
+    verified = BooleanField(null=True)
+    duration = IntegerField(null=True)
+    priority = IntegerField(null=True, default=0)
 
     class Meta:
         db_table = 'videos'
 
 
+class Discs(BaseModel):
+    discid = PrimaryKeyField(db_column='discID')
+    fingerprint = CharField(unique=True)
+    quickkey = CharField(db_column='quickKey', null=True, index=True)
+    label = CharField()
+    path = CharField(unique=True)
+    info = TextField()
+    lastseen = DateTimeField(db_column='lastSeen')
+
+    class Meta:
+        db_table = 'discs'
+
+
+class Metrics(BaseModel):
+    metricid = PrimaryKeyField(db_column='metricID')
+    vidid = IntegerField(db_column='vidID', null=True)
+    stage = CharField(index=True)
+    started = DateTimeField()
+    seconds = FloatField()
+    success = BooleanField(default=True)
+    bytesin = BigIntegerField(db_column='bytesIn', null=True)
+    bytesout = BigIntegerField(db_column='bytesOut', null=True)
+    fps = FloatField(null=True)
+
+    class Meta:
+        db_table = 'metrics'
+
+
 class Statustypes(BaseModel):
     statusid = PrimaryKeyField(db_column='statusID')
     statustext = CharField(db_column='statusText')
@@ -69,13 +156,54 @@ class Statustypes(BaseModel):
 
 
 def create_tables():
-    database.connect()
+    if database.is_closed():
+        database.connect()
 
     # Fail silently if tables exists
     History.create_table(True)
     Historytypes.create_table(True)
     Videos.create_table(True)
     Statustypes.create_table(True)
+    Discs.create_table(True)
+    Metrics.create_table(True)
+
+
+def add_missing_columns():
+    """
+        Adds columns that were introduced after a table was created
+        New columns are always nullable, so existing rows stay valid
+    """
+    migrator = SqliteMigrator(database)
+
+    for model in (History, Videos, Discs, Metrics):
+        table = model._meta.db_table
+        existing = set(c.name for c in database.get_columns(table))
+
+        for field in model._meta.sorted_fields:
+            if field.db_column not in existing:
+                migrate(migrator.add_column(table, field.db_column, field))
+
+
+def _index_column(column):
+    name, _, collation = column.partition(' ')
+    return ('"%s" %s' % (name, collation)).strip()
+
+
+def create_indexes():
+    for name in OBSOLETE_INDEXES:
+        database.execute_sql('DROP INDEX IF EXISTS "%s"' % name)
+
+    for name, table, columns in INDEXES:
+        database.execute_sql('CREATE INDEX IF NOT EXISTS "%s" ON "%s" (%s)' % (
+            name, table, ', '.join(_index_column(c) for c in columns)))
+
+
+def atomic():
+    """
+        Groups several writes into a single transaction, and a single
+            commit. Use as a context manager
+    """
+    return database.atomic()
 
 
 def create_history_types():
@@ -83,15 +211,16 @@ def create_history_types():
         [1, 'Info'],
         [2, 'Error'],
         [3, 'MakeMKV Error'],
-        [4, 'Handbrake Error']
+        [4, 'Handbrake Error'],
+        [5, 'Watchdog'],
+        [6, 'Recovered'],
+        [7, 'Verification']
     ]
 
-    c = 0
-    for z in Historytypes.select():
-        c += 1
+    existing = set(h.historytypeid for h in Historytypes.select())
 
-    if c != len(historytypes):
-        for hID, hType in historytypes:
+    for hID, hType in historytypes:
+        if hID not in existing:
             Historytypes.create(historytypeid=hID, historytype=hType)
 
 
@@ -104,21 +233,20 @@ def create_status_types():
         [5, 'Submitted to HandBrake'],
         [6, 'Awaiting FileBot'],
         [7, 'Submitted to FileBot'],
-        [8, 'Completed']
+        [8, 'Completed'],
+        [9, 'Moving to library']
     ]
 
-    c = 0
-    for z in Statustypes.select():
-        c += 1
+    existing = set(s.statusid for s in Statustypes.select())
 
-    if c != len(statustypes):
-        for sID, sType in statustypes:
+    for sID, sType in statustypes:
+        if sID not in existing:
             Statustypes.create(statusid=sID, statustext=sType)
 
 
 def next_video_to_compress():
     videos = Videos.select().where((Videos.statusid == 4) & (
-        Videos.filename != "None")).order_by(Videos.titleIndex)
+        Videos.filename != "None")).order_by(Videos.vidid)
     return videos
 
 
@@ -128,8 +256,219 @@ def next_video_to_filebot():
     return videos
 
 
+def _lease(vidobj, now):
+    vidobj.leaseowner = LEASE_OWNER
+    vidobj.heartbeat = now
+    vidobj.leaseexpiry = now + timedelta(seconds=LEASE_TTL)
+
+
+def _release(vidobj):
+    vidobj.leaseowner = None
+    vidobj.heartbeat = None
+    vidobj.leaseexpiry = None
+    vidobj.partial = None
+
+
+def claim_video(vidobj, fromstatus, tostatus):
+    """
+        Atomically moves a video from one status to another
+        Only one worker can win the claim on a given row
+        Claiming an in-flight status also takes out a lease on the row
+
+        Inputs:
+            vidobj      (Obj): Video database object
+            fromstatus  (Int): Status the row is expected to be in
+            tostatus    (Int): Status to move the row to
+
+        Outputs:
+            Bool    Was the claim successful
+    """
+    now = datetime.now()
+    changes = {'statusid': tostatus, 'lastupdated': now}
+
+    if tostatus in IN_FLIGHT:
+        changes.update(
+            leaseowner=LEASE_OWNER,
+            heartbeat=now,
+            leaseexpiry=now + timedelta(seconds=LEASE_TTL)
+        )
+
+    claimed = Videos.update(**changes).where(
+        (Videos.vidid == vidobj.vidid) & (Videos.statusid == fromstatus)
+    ).execute()
+
+    if claimed != 1:
+        return False
+
+    vidobj.statusid = tostatus
+    vidobj.lastupdated = now
+    if tostatus in IN_FLIGHT:
+        _lease(vidobj, now)
+    return True
+
+
+def set_partial(vidobj, path):
+    """
+        Remembers the file a worker is writing, so it can be removed if
+            the worker dies before finishing it
+    """
+    vidobj.partial = path
+    Videos.update(partial=path).where(Videos.vidid == vidobj.vidid).execute()
+
+
+def update_sizes(vidobj, ripsize=None, encodesize=None):
+    """
+        Records the size of a rip or encode, used to predict how much
+            space later jobs need
+    """
+    if ripsize is not None:
+        vidobj.ripsize = ripsize
+    if encodesize is not None:
+        vidobj.encodesize = encodesize
+
+    Videos.update(ripsize=vidobj.ripsize, encodesize=vidobj.encodesize).where(
+        Videos.vidid == vidobj.vidid
+    ).execute()
+
+
+def set_checksum(vidobj, checksum):
+    """
+        Records the SHA-1 of a video's current file, None when the file
+            has changed since it was last hashed
+    """
+    vidobj.checksum = checksum
+    Videos.update(checksum=checksum).where(Videos.vidid == vidobj.vidid).execute()
+
+
+def set_verified(vidobj, verified):
+    vidobj.verified = verified
+    Videos.update(verified=verified).where(Videos.vidid == vidobj.vidid).execute()
+
+
+def encode_ratio():
+    """
+        Returns how large encodes have been compared to their rips on
+            average, None without any history
+    """
+    return Videos.select(
+        fn.AVG(Videos.encodesize * 1.0 / Videos.ripsize)
+    ).where(
+        (Videos.ripsize > 0) & Videos.encodesize.is_null(False)
+    ).scalar()
+
+
+def insert_metric(stage, started, seconds, vidobj=None, success=True,
+                  bytesin=None, bytesout=None, fps=None):
+    return Metrics.create(
+        vidid=vidobj.vidid if vidobj is not None else None,
+        stage=stage,
+        started=started,
+        seconds=seconds,
+        success=success,
+        bytesin=bytesin,
+        bytesout=bytesout,
+        fps=fps
+    )
+
+
+def metric_totals():
+    """
+        Returns the runs, seconds and bytes of every stage, split by
+            whether the run succeeded
+    """
+    return Metrics.select(
+        Metrics.stage,
+        Metrics.success,
+        fn.COUNT(Metrics.metricid).alias('runs'),
+        fn.SUM(Metrics.seconds).alias('seconds'),
+        fn.SUM(Metrics.bytesin).alias('bytesin'),
+        fn.SUM(Metrics.bytesout).alias('bytesout')
+    ).group_by(Metrics.stage, Metrics.success).naive()
+
+
+def last_metrics():
+    """
+        Returns the latest run of every stage
+    """
+    latest = Metrics.select(fn.MAX(Metrics.metricid)).group_by(Metrics.stage)
+    return Metrics.select().where(Metrics.metricid << latest)
+
+
+def renew_leases():
+    """
+        Extends every lease held by this process
+    """
+    now = datetime.now()
+    return Videos.update(
+        heartbeat=now,
+        leaseexpiry=now + timedelta(seconds=LEASE_TTL)
+    ).where(
+        (Videos.leaseowner == LEASE_OWNER) & (Videos.statusid << IN_FLIGHT)
+    ).execute()
+
+
+def start_heartbeat():
+    """
+        Renews this process' leases in the background until it exits
+    """
+    def beat():
+        while True:
+            stop.wait(LEASE_TTL / 3)
+            if stop.is_set():
+                break
+            renew_leases()
+
+    stop = threading.Event()
+    heartbeat = threading.Thread(target=beat, name="Heartbeat")
+    heartbeat.daemon = True
+    heartbeat.start()
+    return stop
+
+
+def expired_leases():
+    """
+        Returns in-flight videos whose worker has gone away
+        Rows without a lease were left behind by an older version
+        Only one autorippr runs on a host at a time, so leases held by
+            another process of this host are dead even before they expire
+    """
+    return Videos.select().where(
+        (Videos.statusid << IN_FLIGHT) &
+        (Videos.leaseexpiry.is_null(True) |
+         (Videos.leaseexpiry < datetime.now()) |
+         ((Videos.leaseowner != LEASE_OWNER) & Videos.leaseowner.startswith(LEASE_HOST + u":")))
+    )
+
+
+def _ascii_lower(text):
+    """
+        Lower-cases A-Z only, the way SQLite's NOCASE collation does
+    """
+    return u"".join(
+        unichr(ord(c) + 32) if u"A" <= c <= u"Z" else c for c in text)
+
+
 def search_video_name(invid):
-    vidqty = Videos.select().where(Videos.filename.startswith(invid)).count()
+    """
+        Counts the videos whose filename starts with invid, ignoring case
+            and with _ and % as LIKE wildcards
+        SQLite cannot use an index for a LIKE with a bound pattern, so the
+            part before the first wildcard is also asked as a range of
+            videos_filename_nocase
+    """
+    query = Videos.filename.startswith(invid)
+
+    prefix = _ascii_lower(invid)
+    for wildcard in (u"_", u"%"):
+        prefix = prefix.split(wildcard)[0]
+
+    if prefix:
+        # The first name after every name starting with prefix
+        upper = prefix[:-1] + unichr(ord(prefix[-1]) + 1)
+        nocase = Clause(Videos.filename, SQL('COLLATE NOCASE'))
+        query = (nocase >= prefix) & (nocase < upper) & query
+
+    vidqty = Videos.select().where(query).count()
     return vidqty
 
 
@@ -142,7 +481,14 @@ def insert_history(dbvideo, text, typeid=1):
     )
 
 
-def insert_video(title, path, vidtype, index, filebot):
+def count_history(dbvideo, typeid):
+    return History.select().where(
+        (History.vidid == dbvideo.vidid) & (History.historytypeid == typeid)
+    ).count()
+
+
+def insert_video(title, path, vidtype, index, filebot, discid=None,
+                 duration=None, priority=0):
     return Videos.create(
         vidname=title,
         vidtype=vidtype,
@@ -151,27 +497,112 @@ def insert_video(title, path, vidtype, index, filebot):
         filename="None",
         filebot=filebot,
         statusid=1,
-        lastupdated=datetime.now()
+        lastupdated=datetime.now(),
+        discid=discid,
+        duration=duration,
+        priority=priority
     )
 
 
+def disc_by_quickkey(quickkey):
+    """
+        Returns the disc with this label, medium size and descriptor hash
+        Nothing is returned when the key is ambiguous
+    """
+    if quickkey is None:
+        return None
+
+    discs = list(Discs.select().where(Discs.quickkey == quickkey).limit(2))
+    if len(discs) != 1:
+        return None
+
+    return discs[0]
+
+
+def disc_by_fingerprint(fingerprint):
+    return Discs.select().where(Discs.fingerprint == fingerprint).first()
+
+
+def disc_by_path(path):
+    return Discs.select().where(Discs.path == path).first()
+
+
+def insert_disc(fingerprint, quickkey, label, path, info):
+    """
+        Registers a newly scanned disc
+        Returns None if the fingerprint or path is already taken
+    """
+    try:
+        return Discs.create(
+            fingerprint=fingerprint,
+            quickkey=quickkey,
+            label=label,
+            path=path,
+            info=info,
+            lastseen=datetime.now()
+        )
+    except IntegrityError:
+        return None
+
+
+def disc_seen(discobj, quickkey):
+    discobj.lastseen = datetime.now()
+    if quickkey is not None:
+        discobj.quickkey = quickkey
+    discobj.save()
+
+
+def disc_ripped(discobj):
+    """
+        Checks whether any title of a disc was ripped, or is being ripped
+        Failed titles do not count
+    """
+    return Videos.select().where(
+        (Videos.discid == discobj.discid) & (Videos.statusid != 2)
+    ).exists()
+
+
 def update_video(vidobj, statusid, filename=None):
     vidobj.statusid = statusid
     vidobj.lastupdated = datetime.now()
 
+    if statusid in IN_FLIGHT:
+        if vidobj.leaseowner != LEASE_OWNER:
+            _lease(vidobj, vidobj.lastupdated)
+    else:
+        _release(vidobj)
+
     if filename is not None:
+        if filename != vidobj.filename:
+            vidobj.checksum = None
+            vidobj.verified = None
         vidobj.filename = filename
 
     vidobj.save()
 
 
+def schema_version():
+    return database.execute_sql('PRAGMA user_version').fetchone()[0]
+
+
 def db_integrity_check():
+    """
+        Brings the database up to SCHEMA_VERSION
+        Once it is, this is a single pragma lookup
+    """
+    if schema_version() >= SCHEMA_VERSION:
+        return
+
     # Stuff
     create_tables()
+    add_missing_columns()
+    create_indexes()
 
     # Things
     create_history_types()
     create_status_types()
 
+    database.execute_sql('PRAGMA user_version = %d' % SCHEMA_VERSION)
+
 
 db_integrity_check()
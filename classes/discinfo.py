@@ -0,0 +1,468 @@
+# -*- coding: utf-8 -*-
+"""
+MakeMKV robot-mode message parser
+
+Reads the output of `makemkvcon -r info` once and indexes it so that
+disc, title and stream attributes can be looked up directly instead of
+rescanning the message file for every query.
+
+
+Released under the MIT license
+Copyright (c) 2012, Jason Millward
+
+@category   misc
+@version    $Id: 1.7.0, 2016-08-22 14:53:29 ACST $;
+@author     Jason Millward
+@license    http://opensource.org/licenses/MIT
+"""
+
+import codecs
+import hashlib
+import time
+
+# Attribute ids, see AP_ItemAttributeId in apdefs.h
+ATTR_TYPE = 1
+ATTR_NAME = 2
+ATTR_LANG_CODE = 3
+ATTR_CODEC_ID = 5
+ATTR_CHAPTERS = 8
+ATTR_DURATION = 9
+ATTR_DISK_SIZE_BYTES = 11
+ATTR_SEGMENTS_COUNT = 25
+ATTR_SEGMENTS_MAP = 26
+ATTR_OUTPUT_FILENAME = 27
+
+# Message codes
+MSG_TITLE_ADDED = 3307
+
+# Titles a play-all has to cover when it is found by durations alone
+MIN_SUMMED_RUN = 3
+
+
+def split_values(payload):
+    """
+        Splits the payload of a robot-mode line into its values
+        Commas inside quoted strings are preserved
+
+        Inputs:
+            payload (Str): Everything after the "TYPE:" prefix
+
+        Outputs:
+            values  (List)
+    """
+    values = []
+    current = []
+    quoted = False
+
+    for char in payload:
+        if char == '"':
+            quoted = not quoted
+        elif char == ',' and not quoted:
+            values.append(u''.join(current).strip())
+            current = []
+        else:
+            current.append(char)
+
+    values.append(u''.join(current).strip())
+    return values
+
+
+class DiscInfo(object):
+
+    def __init__(self):
+        self.tcount = 0
+        self.cinfo = {}
+        self.tinfo = {}
+        self.sinfo = {}
+        self.messages = {}
+        self.titles = []
+        self.streams = {}
+        self.lines = 0
+        self.parseTime = 0.0
+
+    @classmethod
+    def from_file(cls, path):
+        """
+            Parses a makemkvcon message file in a single pass
+
+            Inputs:
+                path    (Str): Message file written by --messages
+
+            Outputs:
+                DiscInfo (Obj)
+        """
+        info = cls()
+        start = time.time()
+
+        with codecs.open(path, 'r', 'utf-8') as messages:
+            for line in messages:
+                info.parse_line(line)
+
+        info.parseTime = time.time() - start
+        return info
+
+    @classmethod
+    def from_lines(cls, lines):
+        """
+            Parses already captured makemkvcon output
+
+            Inputs:
+                lines   (List): Robot-mode output lines
+
+            Outputs:
+                DiscInfo (Obj)
+        """
+        info = cls()
+        start = time.time()
+
+        for line in lines:
+            info.parse_line(line)
+
+        info.parseTime = time.time() - start
+        return info
+
+    def parse_line(self, line):
+        """
+            Adds a single robot-mode line to the index
+
+            Inputs:
+                line    (Str): Line of makemkvcon output
+
+            Outputs:
+                None
+        """
+        self.lines += 1
+
+        stype, sep, payload = line.strip().partition(':')
+        if not sep:
+            return
+
+        values = split_values(payload)
+
+        try:
+            if stype == "CINFO":
+                self.cinfo.setdefault(int(values[0]), values[2])
+
+            elif stype == "TINFO":
+                title = int(values[0])
+                if title not in self.streams:
+                    self.titles.append(title)
+                    self.streams[title] = []
+                self.tinfo.setdefault((title, int(values[1])), values[3])
+
+            elif stype == "SINFO":
+                title = int(values[0])
+                stream = int(values[1])
+                if title not in self.streams:
+                    self.titles.append(title)
+                    self.streams[title] = []
+                if stream not in self.streams[title]:
+                    self.streams[title].append(stream)
+                self.sinfo.setdefault((title, stream, int(values[2])), values[4])
+
+            elif stype == "MSG":
+                self.messages.setdefault(int(values[0]), []).append(values)
+
+            elif stype == "TCOUNT":
+                self.tcount = int(values[0])
+
+        except (IndexError, ValueError):
+            # Truncated or malformed lines are ignored, as before
+            pass
+
+    def get_cinfo(self, attr, default=None):
+        """
+            Returns a disc attribute
+
+            Inputs:
+                attr    (Int): Attribute id
+
+            Outputs:
+                value   (Str)
+        """
+        return self.cinfo.get(attr, default)
+
+    def get_tinfo(self, title, attr, default=None):
+        """
+            Returns a title attribute
+
+            Inputs:
+                title   (Int): MakeMKV title id
+                attr    (Int): Attribute id
+
+            Outputs:
+                value   (Str)
+        """
+        return self.tinfo.get((int(title), attr), default)
+
+    def get_sinfo(self, title, stream, attr, default=None):
+        """
+            Returns a stream attribute
+
+            Inputs:
+                title   (Int): MakeMKV title id
+                stream  (Int): Stream id within the title
+                attr    (Int): Attribute id
+
+            Outputs:
+                value   (Str)
+        """
+        return self.sinfo.get((int(title), int(stream), attr), default)
+
+    def get_streams(self, title):
+        """
+            Returns the stream ids of a title in disc order
+
+            Inputs:
+                title   (Int): MakeMKV title id
+
+            Outputs:
+                streams (List)
+        """
+        return self.streams.get(int(title), [])
+
+    def get_messages(self, code):
+        """
+            Returns all MSG lines with the given code
+
+            Inputs:
+                code    (Int): Message code
+
+            Outputs:
+                messages (List): Value lists in output order
+        """
+        return self.messages.get(code, [])
+
+    def get_duration(self, title):
+        """
+            Returns the length of a title in seconds
+
+            Inputs:
+                title   (Int): MakeMKV title id
+
+            Outputs:
+                seconds (Int), None if unknown
+        """
+        duration = self.get_tinfo(title, ATTR_DURATION)
+        if not duration:
+            return None
+
+        seconds = 0
+        try:
+            for part in duration.split(':'):
+                seconds = seconds * 60 + int(part)
+        except ValueError:
+            return None
+
+        return seconds
+
+    def get_size(self, title):
+        """
+            Returns the size of a title in bytes
+
+            Inputs:
+                title   (Int): MakeMKV title id
+
+            Outputs:
+                bytes   (Int), None if unknown
+        """
+        size = self.get_tinfo(title, ATTR_DISK_SIZE_BYTES)
+        try:
+            return int(size)
+        except (TypeError, ValueError):
+            return None
+
+    def get_chapters(self, title):
+        """
+            Returns the chapter count of a title
+
+            Inputs:
+                title   (Int): MakeMKV title id
+
+            Outputs:
+                chapters (Int)
+        """
+        try:
+            return int(self.get_tinfo(title, ATTR_CHAPTERS, 0))
+        except ValueError:
+            return 0
+
+    def get_segments(self, title):
+        """
+            Returns the segments a title plays, in order
+            Ranges such as "3-5" are expanded
+
+            Inputs:
+                title   (Int): MakeMKV title id
+
+            Outputs:
+                segments (List), empty if unknown
+        """
+        segments = []
+        for part in (self.get_tinfo(title, ATTR_SEGMENTS_MAP) or u"").split(','):
+            part = part.strip()
+            first, sep, last = part.partition('-')
+            if sep and first.isdigit() and last.isdigit():
+                segments.extend(str(n) for n in range(int(first), int(last) + 1))
+            elif part:
+                segments.append(part)
+
+        return segments
+
+    def fingerprint(self):
+        """
+            Returns a key identifying the disc by its content: the volume
+                name plus the duration, size and chapter count of every
+                title, in disc order
+
+            Inputs:
+                None
+
+            Outputs:
+                key     (Str): Hex digest
+        """
+        signature = [self.get_cinfo(ATTR_NAME, u"")]
+        for title in self.titles:
+            signature.append(u"{}/{}/{}".format(
+                self.get_tinfo(title, ATTR_DURATION, u""),
+                self.get_size(title),
+                self.get_chapters(title)
+            ))
+
+        return hashlib.sha1(u"|".join(signature).encode('utf-8')).hexdigest()
+
+    def signature(self, title):
+        """
+            Returns what a title plays, so that titles showing the same
+                content (alternate angles, play lists with the same
+                segments, decoy play lists) compare equal
+            The segment map is used when MakeMKV reports it, since angles
+                of the same title differ in size. Otherwise the size is
+                used instead
+
+            Inputs:
+                title   (Int): MakeMKV title id
+
+            Outputs:
+                signature (Tuple)
+        """
+        streams = tuple(
+            (
+                self.get_sinfo(title, stream, ATTR_TYPE),
+                self.get_sinfo(title, stream, ATTR_CODEC_ID),
+                self.get_sinfo(title, stream, ATTR_LANG_CODE)
+            )
+            for stream in self.get_streams(title)
+        )
+
+        return (
+            self.get_duration(title),
+            self.get_chapters(title),
+            self.get_tinfo(title, ATTR_SEGMENTS_MAP) or self.get_size(title),
+            streams
+        )
+
+    def episodes(self, titles, tolerance=0.15):
+        """
+            Decides which titles of a TV disc are episodes
+            Durations are clustered, a title joins the cluster of the next
+                shorter title when it is at most tolerance longer. The
+                cluster holding the most titles is taken as the episode
+                length. Titles shorter than that are extras, and titles
+                that play a run of other titles back to back are play-all
+                titles. Longer titles that are not play-all titles are
+                kept, they are usually double episodes
+            Nothing is rejected unless at least two titles share the
+                episode length
+
+            Inputs:
+                titles    (List): MakeMKV title ids in disc order
+                tolerance (Float): Relative spread of an episode length
+
+            Outputs:
+                decisions (List): (title, keep (Bool), reason (Str)) in disc order
+        """
+        durations = dict((t, self.get_duration(t) or 0) for t in titles)
+
+        clusters = []
+        for title in sorted(titles, key=lambda t: durations[t]):
+            if len(clusters) > 0 and durations[title] <= durations[clusters[-1][-1]] * (1 + tolerance):
+                clusters[-1].append(title)
+            else:
+                clusters.append([title])
+
+        episodes = []
+        if len(clusters) > 0:
+            episodes = max(clusters, key=lambda c: (len(c), sum(durations[t] for t in c)))
+
+        if len(episodes) < 2:
+            return [(t, True, u"no common episode length") for t in titles]
+
+        shortest = min(durations[t] for t in episodes)
+        longest = max(durations[t] for t in episodes)
+
+        decisions = []
+        for title in titles:
+            duration = durations[title]
+
+            if title in episodes:
+                decisions.append((title, True, u"episode length {}-{}s".format(shortest, longest)))
+
+            elif duration < shortest:
+                decisions.append((title, False, u"shorter than an episode ({}s)".format(duration)))
+
+            else:
+                run = self._play_all_run(title, titles, durations, self.get_segments)
+                if run is not None:
+                    decisions.append((title, False, u"play-all of titles {}".format(
+                        u",".join(str(t) for t in run))))
+                else:
+                    decisions.append((title, True, u"longer than an episode, not a play-all"))
+
+        return decisions
+
+    @staticmethod
+    def _play_all_run(title, titles, durations, segments):
+        """
+            Finds a run of two or more consecutive titles that the given
+                title plays back to back
+            When every title has a segment map the segments have to match.
+                Otherwise the durations have to add up over a run of at
+                least MIN_SUMMED_RUN titles, as two titles adding up to a
+                third is as likely a double episode
+
+            Inputs:
+                title     (Int): MakeMKV title id
+                titles    (List): MakeMKV title ids in disc order
+                durations (Dict): Title id => seconds
+                segments  (Func): Returns the segment list of a title
+
+            Outputs:
+                run       (List): Title ids, None if there is none
+        """
+        others = [t for t in titles if t != title]
+        target = durations[title]
+        slack = max(30, target * 0.02)
+
+        maps = dict((t, segments(t)) for t in titles)
+        useMaps = all(len(m) > 0 for m in maps.values())
+
+        for start in range(len(others)):
+            total = 0
+            played = []
+            for end in range(start, len(others)):
+                total += durations[others[end]]
+                played.extend(maps[others[end]])
+                if total > target + slack:
+                    break
+
+                if end == start:
+                    continue
+
+                if useMaps:
+                    if played == maps[title]:
+                        return others[start:end + 1]
+                elif end - start + 1 >= MIN_SUMMED_RUN and abs(total - target) <= slack:
+                    return others[start:end + 1]
+
+        return None
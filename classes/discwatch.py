@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+Disc insert detection
+
+Waits for discs to be inserted instead of scanning every drive with
+makemkvcon. Events come from udev when pyudev is installed, otherwise the
+drives are polled with the CDROM_DRIVE_STATUS ioctl, which asks the drive
+for its tray state without spinning up the disc. A named pipe can be used
+instead of real drives for testing: every line written to it is treated
+as an insert into that device.
+
+
+Released under the MIT license
+Copyright (c) 2012, Jason Millward
+
+@category   misc
+@version    $Id: 1.7.0, 2016-08-22 14:53:29 ACST $;
+@author     Jason Millward
+@license    http://opensource.org/licenses/MIT
+"""
+
+import errno
+import glob
+import imp
+import os
+import select
+import threading
+
+import logger
+
+# linux/cdrom.h
+CDROM_DRIVE_STATUS = 0x5326
+CDSL_CURRENT = 0x7fffffff
+CDS_DISC_OK = 4
+
+
+class DiscWatcher(object):
+
+    def __init__(self, config):
+        settings = config.get('daemon') or {}
+
+        self.log = logger.Logger("DiscWatch", config['debug'], config['silent'])
+        self.source = settings.get('source') or 'auto'
+        self.devices = settings.get('devices') or sorted(glob.glob('/dev/sr[0-9]*'))
+        self.interval = float(settings.get('pollInterval', 1))
+        self.fifo = settings.get('fifo') or '/tmp/autorippr.events'
+        self.stopped = threading.Event()
+
+    def stop(self):
+        self.stopped.set()
+
+    def events(self):
+        """
+            Yields the device path of every inserted disc until stop() is
+                called. Discs already in a drive are reported first
+
+            Inputs:
+                None
+
+            Outputs:
+                device  (Str)
+        """
+        source = self.source
+        if source == 'auto':
+            source = 'udev' if self._have_pyudev() else 'poll'
+
+        self.log.debug(u"Waiting for discs using {}".format(source))
+
+        if source == 'fifo':
+            return self._fifo_events()
+
+        if source == 'udev':
+            return self._udev_events()
+
+        return self._poll_events()
+
+    @staticmethod
+    def _have_pyudev():
+        try:
+            imp.find_module('pyudev')
+        except ImportError:
+            return False
+
+        return True
+
+    def drive_status(self, device):
+        """
+            Asks a drive whether it holds a readable disc
+
+            Inputs:
+                device  (Str): Block device, eg. /dev/sr0
+
+            Outputs:
+                Bool    Is a disc loaded
+        """
+        import fcntl
+
+        try:
+            fd = os.open(device, os.O_RDONLY | os.O_NONBLOCK)
+        except OSError:
+            return False
+
+        try:
+            return fcntl.ioctl(fd, CDROM_DRIVE_STATUS, CDSL_CURRENT) == CDS_DISC_OK
+        except IOError:
+            return False
+        finally:
+            os.close(fd)
+
+    def _poll_events(self):
+        loaded = {}
+
+        while not self.stopped.is_set():
+            for device in self.devices:
+                status = self.drive_status(device)
+                if status and not loaded.get(device):
+                    yield device
+                loaded[device] = status
+
+            self.stopped.wait(self.interval)
+
+    def _udev_events(self):
+        import pyudev
+
+        context = pyudev.Context()
+        monitor = pyudev.Monitor.from_netlink(context)
+        monitor.filter_by('block')
+        monitor.start()
+
+        for device in self.devices:
+            if self.drive_status(device):
+                yield device
+
+        while not self.stopped.is_set():
+            device = monitor.poll(timeout=1)
+            if device is None:
+                continue
+
+            if device.get('ID_CDROM_MEDIA') == '1' and device.get('DISK_MEDIA_CHANGE') == '1':
+                if device.device_node in self.devices or len(self.devices) == 0:
+                    yield device.device_node
+
+    def _fifo_events(self):
+        try:
+            os.mkfifo(self.fifo)
+        except OSError as ex:
+            if ex.errno != errno.EEXIST:
+                raise
+
+        # Non-blocking, so stop() is noticed while nobody is writing.
+        # Holding a write end open ourselves keeps the pipe from reporting
+        # end of file whenever a writer closes it
+        fd = os.open(self.fifo, os.O_RDONLY | os.O_NONBLOCK)
+        keepalive = os.open(self.fifo, os.O_WRONLY | os.O_NONBLOCK)
+        pending = ''
+
+        try:
+            while not self.stopped.is_set():
+                try:
+                    ready, _, _ = select.select([fd], [], [], 1)
+                except select.error as ex:
+                    if ex.args[0] == errno.EINTR:
+                        continue
+                    raise
+
+                if len(ready) == 0:
+                    continue
+
+                pending += os.read(fd, 4096)
+                lines = pending.split('\n')
+                pending = lines.pop()
+
+                for line in lines:
+                    if line.strip():
+                        yield line.strip().decode('utf-8')
+        finally:
+            os.close(keepalive)
+            os.close(fd)
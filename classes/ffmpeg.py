@@ -11,12 +11,13 @@ Copyright (c) 2014, Ian Bird
 @author     Ian Bird
 @license    http://opensource.org/licenses/MIT
 """
+import errno
 import os
-import re
-import subprocess
 
 import database
 import logger
+import process
+import progress
 
 
 class FFmpeg(object):
@@ -25,44 +26,99 @@ class FFmpeg(object):
         self.log = logger.Logger("FFmpeg", debug, silent)
         self.compressionPath = compressionpath
         self.vformat = vformat
+        self.fps = None
 
-    def compress(self, nice, args, dbvideo):
+    def compress(self, nice, args, dbvideo, vidname, threads=0, splitter=None):
         """
             Passes the necessary parameters to FFmpeg to start an encoding
             Assigns a nice value to allow give normal system tasks priority
 
 
             Inputs:
-                nice    (Int): Priority to assign to task (nice value)
-                args    (Str): All of the FFmpeg arguments taken from the
+                nice     (Int): Priority to assign to task (nice value)
+                args     (Str): All of the FFmpeg arguments taken from the
                                 settings file
-                output  (Str): File to log to. Used to see if the job completed
-                                successfully
+                dbvideo  (Obj): Video database object
+                vidname  (Str): Output file name
+                threads  (Int): Encoder threads to use, 0 for the default
+                splitter (Obj): SplitEncoder used for long titles, optional
 
             Outputs:
                 Bool    Was convertion successful
         """
 
-        if (dbvideo.vidtype == "tv"):
-            # Query the SQLite database for similar titles (TV Shows)
-            vidname = re.sub(r'D(\d)', '', dbvideo.vidname)
-            vidqty = database.search_video_name(vidname)
-            if vidqty == 0:
-                vidname = u"%sE1.%s" % (vidname, self.vformat)
-            else:
-                vidname = u"%sE%s.%s" % (vidname, str(vidqty + 1), self.vformat)
-        else:
-            vidname = u"%s.%s" % (dbvideo.vidname, self.vformat)
-
         invid = u"%s/%s" % (dbvideo.path, dbvideo.filename)
-        outvid = os.path.join(self.compressionPath, os.path.basename(dbvideo.path), vidname)
+        outvid = self.output_path(dbvideo, vidname)
         destination_folder = os.path.dirname(outvid)
 
         if not os.path.exists(destination_folder):
             self.log.info('Destination folder does not exists, creating: {}'.format(
                 destination_folder
             ))
-            os.makedirs(destination_folder)
+            try:
+                os.makedirs(destination_folder)
+            except OSError as ex:
+                # Another worker encoding a title of the same disc
+                if ex.errno != errno.EEXIST:
+                    raise
+
+        self.fps = None
+        status = None
+        if splitter is not None and splitter.wanted(invid, self.vformat):
+            status = splitter.encode(self, nice, args, invid, outvid)
+            # The pieces ran side by side, their frame rates mean little
+            self.fps = None
+
+        if status is None:
+            status = self.encode(nice, args, invid, outvid, threads)
+
+        if status:
+            # The encode is written under compressionPath, the rest of the
+            # pipeline looks for it in the folder of the video
+            dbvideo.path = os.path.dirname(os.path.abspath(outvid))
+            database.update_video(
+                dbvideo, 6, filename=u"%s" % (
+                    vidname
+                ))
+
+        return status
+
+    def output_path(self, dbvideo, vidname):
+        """
+            Returns where the compressed video will be written
+            Without a compressionPath it goes next to the rip, like
+                HandBrake's
+
+            Inputs:
+                dbvideo (Obj): Video database object
+                vidname (Str): Output file name
+
+            Outputs:
+                outvid  (Str)
+        """
+        if not self.compressionPath:
+            return u"%s/%s" % (dbvideo.path, vidname)
+
+        return os.path.join(self.compressionPath, os.path.basename(dbvideo.path), vidname)
+
+    def encode(self, nice, args, invid, outvid, threads=0):
+        """
+            Runs a single FFmpeg encode
+
+            Inputs:
+                nice    (Int): Priority to assign to task (nice value)
+                args    (Str): All of the FFmpeg arguments taken from the
+                                settings file
+                invid   (Str): File to encode
+                outvid  (Str): File to write
+                threads (Int): Encoder threads to use, 0 for the default
+
+            Outputs:
+                Bool    Was convertion successful
+        """
+        args = list(args)
+        if threads > 0:
+            args.append('-threads %d' % threads)
 
         command = 'nice -n {0} ffmpeg -i "{1}" {2} "{3}"'.format(
             nice,
@@ -71,17 +127,25 @@ class FFmpeg(object):
             outvid
         )
 
-        proc = subprocess.Popen(
-            command,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            shell=True
+        job = progress.Progress(
+            u"FFmpeg {}".format(os.path.basename(outvid)),
+            self.log,
+            total_bytes=os.path.getsize(invid)
         )
-        (results, errors) = proc.communicate()
 
-        if proc.returncode is not 0:
+        proc = process.Process(
+            command, shell=True, merge_stderr=True, watchdog='ffmpeg')
+        try:
+            returncode = proc.run(job.parse_ffmpeg)
+        finally:
+            job.finish()
+            self.fps = job.avgFps or job.fps
+
+        if returncode is not 0:
             self.log.error(
-                "FFmpeg (compress) returned status code: %d" % proc.returncode)
+                "FFmpeg (compress) returned status code: %d" % returncode)
+            for line in proc.tail:
+                self.log.error(line)
             return False
 
         return True
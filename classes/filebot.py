@@ -13,19 +13,23 @@ Copyright (c) 2012, Jason Millward
 """
 
 import re
-import subprocess
 
+import database
 import logger
+import process
 
 
 class FileBot(object):
 
-    def __init__(self, debug, silent):
+    def __init__(self, debug, silent, mover=None):
         self.log = logger.Logger("Filebot", debug, silent)
+        self.mover = mover
 
     def rename(self, dbvideo, movePath):
         """
             Renames video file upon successful database lookup
+            With a mover, FileBot only looks up the new name and the file
+                is moved by the mover instead of copied by FileBot
 
             Inputs:
                 dbvideo (Obj): Video database object
@@ -42,59 +46,65 @@ class FileBot(object):
         vidname = re.sub(r'S(\d)', '', dbvideo.vidname)
         vidname = re.sub(r'D(\d)', '', vidname)
 
+        command = [
+            'filebot',
+            '-rename',
+            u'%s/%s' % (dbvideo.path, dbvideo.filename),
+            '--q',
+            u'"%s"' % vidname,
+            '-non-strict',
+            '--db',
+            u'%s' % db,
+            '--output',
+            u'%s' % movePath
+        ]
 
-        proc = subprocess.Popen(
-            [
-                'filebot',
-                '-rename',
-                u'%s/%s' % (dbvideo.path, dbvideo.filename),
-                '--q',
-                u'"%s"' % vidname,
-                '-non-strict',
-                '--db',
-                u'%s' % db,
-                '--output',
-                u'%s' % movePath
-            ],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
-        )
+        action = "MOVE"
+        if self.mover is not None:
+            command.extend(['--action', 'test'])
+            action = "TEST"
 
-        (results, errors) = proc.communicate()
+        proc = process.Process(command, watchdog='filebot')
 
-        if proc.returncode is not 0:
-            self.log.error(
-                "Filebot (rename) returned status code: %d" % proc.returncode)
+        state = {'checks': 0, 'renamedvideo': ""}
 
-        renamedvideo = ""
-        checks = 0
+        def classify(line):
+            self.log.tool(line)
 
-        if results is not None:
-            results = results.decode('utf-8')
+            if action in line and u"] to [" in line:
+                state['renamedvideo'] = line.split(u"] to [", 1)[1].rstrip(']')
+                state['checks'] += 1
 
-        #if errors is not None:
-        #    errors = errors.decode('utf-8')
+            if "Processed" in line:
+                state['checks'] += 1
 
-        if len(results) is not 0:
-            lines = results.split(u"\n")
-            for line in lines:
-                if line:
-                    self.log.debug(line.strip())
-                if "MOVE" in line:
-                    renamedvideo = line.split(u"] to [", 1)[1].rstrip(']')
-                    checks += 1
+            if "Done" in line:
+                state['checks'] += 1
 
-                if "Processed" in line:
-                    checks += 1
+        returncode = proc.run(classify)
 
-                if "Done" in line:
-                    checks += 1
+        if returncode is not 0:
+            self.log.error(
+                "Filebot (rename) returned status code: %d" % returncode)
 
-        if checks >= 3 and renamedvideo:
-            return [True, renamedvideo]
-        else:
+        if state['checks'] < 3 or not state['renamedvideo']:
             return [False]
 
+        if self.mover is not None:
+            try:
+                digest = self.mover.move(
+                    u'%s/%s' % (dbvideo.path, dbvideo.filename),
+                    state['renamedvideo'],
+                    dbvideo.checksum
+                )
+                if digest is not None:
+                    database.set_checksum(dbvideo, digest)
+            except (IOError, OSError) as ex:
+                self.log.error(u"Moving to {} failed: {}".format(state['renamedvideo'], ex))
+                return [False]
+
+        return [True, state['renamedvideo']]
+
     def get_subtitles(self, dbvideo, lang):
         """
             Downloads subtitles of specified language
@@ -106,7 +116,7 @@ class FileBot(object):
             Outputs:
                 Bool    Was download successful
         """
-        proc = subprocess.Popen(
+        proc = process.Process(
             [
                 'filebot',
                 '-get-subtitles',
@@ -121,36 +131,27 @@ class FileBot(object):
                 'utf8',
                 '-non-strict'
             ],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
+            watchdog='filebot'
         )
 
-        (results, errors) = proc.communicate()
+        state = {'checks': 0}
 
-        if proc.returncode is not 0:
-            self.log.error(
-                "Filebot (get_subtitles) returned status code: %d" % proc.returncode)
+        def classify(line):
+            self.log.tool(line)
 
-        checks = 0
+            if "Processed" in line:
+                state['checks'] += 1
 
-        if results is not None:
-            results = results.decode('utf-8')
+            if "Done" in line:
+                state['checks'] += 1
 
-        #if errors is not None:
-        #    errors = errors.decode('utf-8')
+        returncode = proc.run(classify)
 
-        if len(results) is not 0:
-            lines = results.split(u"\n")
-            for line in lines:
-                self.log.debug(line.strip())
-
-                if "Processed" in line:
-                    checks += 1
-
-                if "Done" in line:
-                    checks += 1
+        if returncode is not 0:
+            self.log.error(
+                "Filebot (get_subtitles) returned status code: %d" % returncode)
 
-        if checks >= 2:
+        if state['checks'] >= 2:
             return True
         else:
             return False
@@ -12,11 +12,12 @@ Copyright (c) 2012, Jason Millward
 @license    http://opensource.org/licenses/MIT
 """
 
-import re
-import subprocess
+import os
 
 import database
 import logger
+import process
+import progress
 
 
 class HandBrake(object):
@@ -25,37 +26,81 @@ class HandBrake(object):
         self.log = logger.Logger("HandBrake", debug, silent)
         self.compressionPath = compressionpath
         self.vformat = vformat
+        self.fps = None
 
-    def compress(self, nice, args, dbvideo):
+    def compress(self, nice, args, dbvideo, vidname, threads=0, splitter=None):
         """
             Passes the necessary parameters to HandBrake to start an encoding
             Assigns a nice value to allow give normal system tasks priority
 
+            Inputs:
+                nice     (Int): Priority to assign to task (nice value)
+                args     (Str): All of the handbrake arguments taken from the
+                                settings file
+                dbvideo  (Obj): Video database object
+                vidname  (Str): Output file name
+                threads  (Int): Encoder threads to use, 0 for the default
+                splitter (Obj): SplitEncoder used for long titles, optional
+
+            Outputs:
+                Bool    Was convertion successful
+        """
+        invid = u"%s/%s" % (dbvideo.path, dbvideo.filename)
+        outvid = self.output_path(dbvideo, vidname)
+
+        self.fps = None
+        status = None
+        if splitter is not None and splitter.wanted(invid, self.vformat):
+            status = splitter.encode(self, nice, args, invid, outvid)
+            # The pieces ran side by side, their frame rates mean little
+            self.fps = None
+
+        if status is None:
+            status = self.encode(nice, args, invid, outvid, threads)
+
+        if status:
+            database.update_video(
+                dbvideo, 6, filename=u"%s" % (
+                    vidname
+                ))
+
+        return status
+
+    def output_path(self, dbvideo, vidname):
+        """
+            Returns where the compressed video will be written
+
+            Inputs:
+                dbvideo (Obj): Video database object
+                vidname (Str): Output file name
+
+            Outputs:
+                outvid  (Str)
+        """
+        return u"%s/%s" % (dbvideo.path, vidname)
+
+    def encode(self, nice, args, invid, outvid, threads=0):
+        """
+            Runs a single HandBrakeCLI encode
+
             Inputs:
                 nice    (Int): Priority to assign to task (nice value)
                 args    (Str): All of the handbrake arguments taken from the
                                 settings file
-                output  (Str): File to log to. Used to see if the job completed
-                                successfully
+                invid   (Str): File to encode
+                outvid  (Str): File to write
+                threads (Int): Encoder threads to use, 0 for the default
 
             Outputs:
                 Bool    Was convertion successful
         """
-        checks = 0
-
-        if (dbvideo.vidtype == "tv"):
-            # Query the SQLite database for similar titles (TV Shows)
-            vidname = re.sub(r'D(\d)', '', dbvideo.vidname)
-            vidqty = database.search_video_name(vidname)
-            if vidqty == 0:
-                vidname = u"%sE1.%s" % (vidname, self.vformat)
+        args = list(args)
+        if threads > 0:
+            if any(a.startswith(('-x', '--encopts')) for a in args):
+                self.log.debug("Encoder options already set, not limiting threads")
             else:
-                vidname = u"%sE%s.%s" % (vidname, str(vidqty + 1), self.vformat)
-        else:
-            vidname = u"%s.%s" % (dbvideo.vidname, self.vformat)
+                args.append('-x threads=%d' % threads)
 
-        invid = u"%s/%s" % (dbvideo.path, dbvideo.filename)
-        outvid = u"%s/%s" % (dbvideo.path, vidname)
         command = u'nice -n {0} {1}HandBrakeCLI --verbose -i "{2}" -o "{3}" {4}'.format(
             nice,
             self.compressionPath,
@@ -64,51 +109,55 @@ class HandBrake(object):
             ' '.join(args)
         )
 
-        proc = subprocess.Popen(
-            command,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            shell=True
+        state = {'checks': 0, 'failed': False}
+        job = progress.Progress(
+            u"HandBrake {}".format(os.path.basename(outvid)),
+            self.log,
+            total_bytes=os.path.getsize(invid)
         )
-        (results, errors) = proc.communicate()
-
-        if proc.returncode is not 0:
-            self.log.error(
-                "HandBrakeCLI (compress) returned status code: %d" % proc.returncode)
 
-        if results is not None:
-            results = results.decode('utf-8')
+        def classify(line):
+            if state['failed']:
+                return
 
-        # if errors is not None:
-        #     errors = errors.decode('utf-8')
+            if "Encoding: task" in line:
+                job.parse_handbrake(line)
+            else:
+                self.log.tool(line)
 
-        if results is not None and len(results) is not 0:
-            lines = results.split(u"\n")
-            for line in lines:
-                if "Encoding: task" not in line:
-                    self.log.debug(line.strip())
+            if "average encoding speed for job" in line:
+                state['checks'] += 1
 
-                if "average encoding speed for job" in line:
-                    checks += 1
+            if "Encode done!" in line:
+                state['checks'] += 1
 
-                if "Encode done!" in line:
-                    checks += 1
+            if "ERROR" in line and "opening" not in line and "udfread" not in line:
+                self.log.error(
+                    "HandBrakeCLI encountered the following error: ")
+                self.log.error(line)
 
-                if "ERROR" in line and "opening" not in line and "udfread" not in line:
-                    self.log.error(
-                        "HandBrakeCLI encountered the following error: ")
-                    self.log.error(line)
+                state['failed'] = True
 
-                    return False
+        proc = process.Process(
+            command, shell=True, merge_stderr=True, watchdog='handbrake')
+        try:
+            returncode = proc.run(classify)
+        finally:
+            job.finish()
+            self.fps = job.avgFps or job.fps
 
-        if checks >= 2:
-            self.log.debug("HandBrakeCLI Completed successfully")
+        if returncode is not 0:
+            self.log.error(
+                "HandBrakeCLI (compress) returned status code: %d" % returncode)
 
-            database.update_video(
-                dbvideo, 6, filename=u"%s" % (
-                    vidname
-                ))
+        if state['failed']:
+            return False
 
+        if state['checks'] >= 2:
+            self.log.debug("HandBrakeCLI Completed successfully")
             return True
         else:
+            self.log.error("HandBrakeCLI did not finish, last output:")
+            for line in proc.tail:
+                self.log.error(line)
             return False
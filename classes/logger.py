@@ -2,6 +2,11 @@
 """
 Simple logging class
 
+Every Logger shares one set of handlers per process. Records are put on a
+queue and written to autorippr.log and the console by a background thread,
+so logging never waits on the disk, and creating a Logger per object no
+longer adds handlers or open files.
+
 
 Released under the MIT license
 Copyright (c) 2012, Jason Millward
@@ -12,49 +17,271 @@ Copyright (c) 2012, Jason Millward
 @license    http://opensource.org/licenses/MIT
 """
 
+import Queue
+import atexit
+import json
 import logging
+import logging.handlers
 import os
 import sys
+import threading
+import time
+
+DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SETTINGS = {
+    'file': '%s/autorippr.log' % DIR,
+    'format': 'text',
+    'rotate': 'size',
+    'maxSize': 10,
+    'when': 'midnight',
+    'backups': 5,
+    'toolRate': 20,
+    'queueSize': 10000
+}
+
+_lock = threading.Lock()
+_queue = None
+_writer = None
+_sinks = {}
+_limits = {}
+_dropped = [0]
+
+
+def configure(config):
+    """
+        Reads the logging settings
+        Call before the first message is logged
+
+        Inputs:
+            config    (??): The configuration
+
+        Outputs:
+            None
+    """
+    settings = config.get('logging') or {}
+    for key in SETTINGS:
+        if settings.get(key) is not None:
+            SETTINGS[key] = settings[key]
+
+
+class JsonFormatter(logging.Formatter):
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record, u'%Y-%m-%dT%H:%M:%S'),
+            'name': record.name,
+            'level': record.levelname,
+            'thread': record.threadName,
+            'message': record.getMessage()
+        }
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+
+        return json.dumps(entry)
+
+
+class QueueHandler(logging.Handler):
+
+    def __init__(self, sink):
+        """
+            Hands records to the writer thread
+            When the queue is full the record is dropped and counted,
+                rather than blocking the job that logged it
+
+            Inputs:
+                sink    (Str): file or stream
+
+            Outputs:
+                The handler instance
+        """
+        logging.Handler.__init__(self)
+        self.sink = sink
+
+    def emit(self, record):
+        # Format now, the arguments may change before the writer gets to them
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+
+        try:
+            _start().put_nowait((self.sink, record))
+        except Queue.Full:
+            _dropped[0] += 1
+
+
+_fileHandler = QueueHandler('file')
+_streamHandler = QueueHandler('stream')
+
+
+def _open_sinks():
+    text = logging.Formatter(
+        u'%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        u'%Y-%m-%d %H:%M:%S'
+    )
+
+    if SETTINGS['rotate'] == 'size':
+        fh = logging.handlers.RotatingFileHandler(
+            SETTINGS['file'],
+            maxBytes=int(SETTINGS['maxSize']) * 1048576,
+            backupCount=int(SETTINGS['backups'])
+        )
+    elif SETTINGS['rotate'] == 'time':
+        fh = logging.handlers.TimedRotatingFileHandler(
+            SETTINGS['file'],
+            when=SETTINGS['when'],
+            backupCount=int(SETTINGS['backups'])
+        )
+    else:
+        fh = logging.FileHandler(SETTINGS['file'])
+
+    if SETTINGS['format'] == 'json':
+        fh.setFormatter(JsonFormatter())
+    else:
+        fh.setFormatter(text)
+
+    sh = logging.StreamHandler(sys.stdout)
+    sh.setFormatter(text)
+
+    _sinks['file'] = fh
+    _sinks['stream'] = sh
+
+
+def _start():
+    global _queue, _writer
+
+    if _writer is None:
+        with _lock:
+            if _writer is None:
+                _open_sinks()
+                _queue = Queue.Queue(int(SETTINGS['queueSize']))
+                _writer = threading.Thread(target=_write, name="Logger")
+                _writer.daemon = True
+                _writer.start()
+                atexit.register(shutdown)
+
+    return _queue
+
+
+def _write():
+    while True:
+        item = _queue.get()
+        if item is None:
+            break
+
+        sink, record = item
+
+        if _dropped[0] > 0:
+            dropped, _dropped[0] = _dropped[0], 0
+            _sinks['file'].handle(logging.makeLogRecord({
+                'name': 'Logger',
+                'levelno': logging.WARNING,
+                'levelname': 'WARNING',
+                'msg': u"{} messages were dropped, the log queue was full".format(dropped)
+            }))
+
+        try:
+            _sinks[sink].handle(record)
+        except Exception:
+            pass
+
+
+def shutdown():
+    """
+        Writes out every queued message and closes the log file
+        Registered to run at exit
+
+        Inputs:
+            None
+
+        Outputs:
+            None
+    """
+    global _writer
+
+    if _writer is None:
+        return
+
+    try:
+        _queue.put(None, timeout=5)
+    except Queue.Full:
+        pass
+
+    _writer.join(5)
+    _writer = None
+
+    for handler in _sinks.values():
+        handler.flush()
+        handler.close()
+
+
+class RateLimit(object):
+
+    def __init__(self, rate):
+        """
+            Allows a burst of rate lines, then rate lines a second
+
+            Inputs:
+                rate    (Float): Lines per second, 0 for no limit
+
+            Outputs:
+                The limiter instance
+        """
+        self.rate = float(rate)
+        self.allowance = self.rate
+        self.last = time.time()
+        self.skipped = 0
+        self.lock = threading.Lock()
+
+    def take(self):
+        """
+            Outputs:
+                result  (Tuple): (Bool allowed, Int lines skipped before
+                                  this one)
+        """
+        if self.rate <= 0:
+            return (True, 0)
+
+        with self.lock:
+            now = time.time()
+            self.allowance = min(self.rate, self.allowance + (now - self.last) * self.rate)
+            self.last = now
+
+            if self.allowance < 1:
+                self.skipped += 1
+                return (False, 0)
+
+            self.allowance -= 1
+            skipped, self.skipped = self.skipped, 0
+            return (True, skipped)
 
 
 class Logger(object):
 
     def __init__(self, name, debug, silent):
+        self.name = name
         self.silent = silent
 
-        frmt = logging.Formatter(
-            u'%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-            u'%Y-%m-%d %H:%M:%S'
-        )
-
         if debug:
             loglevel = logging.DEBUG
         else:
             loglevel = logging.INFO
 
-        self.createhandlers(frmt, name, loglevel)
-
-    def __del__(self):
-        if not self.silent:
-            self.log.removeHandler(self.sh)
-        self.log.removeHandler(self.fh)
-        self.log = None
+        self.createhandlers(name, loglevel)
 
-    def createhandlers(self, frmt, name, loglevel):
+    def createhandlers(self, name, loglevel):
         self.log = logging.getLogger(name)
         self.log.setLevel(loglevel)
+        self.log.propagate = False
 
-        if not self.silent:
-            self.sh = logging.StreamHandler(sys.stdout)
-            self.sh.setLevel(loglevel)
-            self.sh.setFormatter(frmt)
-            self.log.addHandler(self.sh)
+        with _lock:
+            if _fileHandler not in self.log.handlers:
+                self.log.addHandler(_fileHandler)
 
-        DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        self.fh = logging.FileHandler('%s/autorippr.log' % DIR)
-        self.fh.setLevel(loglevel)
-        self.fh.setFormatter(frmt)
-        self.log.addHandler(self.fh)
+            if not self.silent and _streamHandler not in self.log.handlers:
+                self.log.addHandler(_streamHandler)
 
     def debug(self, msg):
         self.log.debug(msg)
@@ -70,3 +297,26 @@ class Logger(object):
 
     def critical(self, msg):
         self.log.critical(msg)
+
+    def tool(self, msg):
+        """
+            Logs a line of output from an external tool at debug level
+            At most logging.toolRate lines a second are kept per logger
+                name, the rest are counted and skipped
+        """
+        if not self.log.isEnabledFor(logging.DEBUG):
+            return
+
+        with _lock:
+            limit = _limits.get(self.name)
+            if limit is None:
+                limit = _limits[self.name] = RateLimit(SETTINGS['toolRate'])
+
+        allowed, skipped = limit.take()
+        if not allowed:
+            return
+
+        if skipped > 0:
+            self.log.debug(u"({} lines of output skipped)".format(skipped))
+
+        self.log.debug(msg)
@@ -13,28 +13,36 @@ Copyright (c) 2012, Jason Millward
 """
 
 import codecs
-import datetime
-import re
-import subprocess
-import time
 import os
+import re
 
+import discinfo
 import logger
+import process
+import progress
+import volume
 
 
 class MakeMKV(object):
 
     def __init__(self, config):
         self.discIndex = 0
+        self.source = 'disc:0'
         self.vidName = ""
+        self.label = ""
         self.path = ""
         self.vidType = ""
         self.minLength = int(config['makemkv']['minLength'])
         self.maxLength = int(config['makemkv']['maxLength'])
+        self.episodeDetection = bool(config['makemkv'].get('episodeDetection', True))
+        self.episodeTolerance = float(config['makemkv'].get('episodeTolerance', 0.15))
         self.cacheSize = int(config['makemkv']['cache'])
         self.ignore_region = bool(config['makemkv']['ignore_region'])
         self.log = logger.Logger("Makemkv", config['debug'], config['silent'])
         self.makemkvconPath = config['makemkv']['makemkvconPath']
+        self.messagesPath = '/tmp/makemkvMessages0'
+        self.discInfo = None
+        self.infoLines = []
         self.saveFiles = []
 
     def _clean_title(self):
@@ -72,52 +80,6 @@ class MakeMKV(object):
 
         return new_list
 
-    @staticmethod
-    def _read_mkv_messages(index, stype, sid=None, scode=None):
-        """
-            Returns a list of messages that match the search string
-            Parses message output.
-
-            Inputs:
-                index   (Int): Element to return from input string (all: None)
-                stype   (Str): Type of message
-                sid     (Int): ID of message
-                scode   (Int): Code of message
-
-            Outputs:
-                result  (List)
-        """
-        result = []
-
-        with codecs.open('/tmp/makemkvMessages', 'r', 'utf-8') as messages:
-            for line in messages:
-                if line[:len(stype)] == stype:
-                    temp = line[len(stype)+1:].strip().split(',')
-
-                    values = []
-                    for value in temp:
-                        values.append(value.strip('" '))
-
-                    if index is None:
-                        element = values
-                    elif index < len(values):
-                        element = values[index]
-                    else:
-                        continue
-
-                    if sid is not None:
-                        if int(values[0]) != int(sid):
-                            continue
-
-                        if scode is not None:
-                            if int(values[1]) != int(scode):
-                                continue
-
-                    if element is not None and element not in result:
-                        result.append(element)
-
-        return result
-
     def set_title(self, vidname):
         """
             Sets local video name
@@ -129,6 +91,7 @@ class MakeMKV(object):
                 None
         """
         self.vidName = vidname
+        self.label = vidname
 
     def set_index(self, index):
         """
@@ -141,6 +104,22 @@ class MakeMKV(object):
                 None
         """
         self.discIndex = int(index)
+        self.source = 'disc:%d' % self.discIndex
+        self.messagesPath = '/tmp/makemkvMessages%d' % self.discIndex
+
+    def set_device(self, location):
+        """
+            Opens the disc by its drive instead of its MakeMKV index
+
+            Inputs:
+                location  (Str): Drive device, eg. /dev/sr0
+
+            Outputs:
+                None
+        """
+        device = location.strip('"')
+        self.source = 'dev:%s' % device
+        self.messagesPath = '/tmp/makemkvMessages-%s' % os.path.basename(device)
 
     def rip_disc(self, path, titleIndex):
         """
@@ -148,7 +127,7 @@ class MakeMKV(object):
                 of the currently inserted DVD or BD
 
             Inputs:
-                path    (Str):  Where the video will be saved to
+                path    (Str):  Folder of the disc the video is saved to
                 output  (Str):  Temp file to save output to
 
             Outputs:
@@ -156,63 +135,52 @@ class MakeMKV(object):
         """
         self.path = path
 
-        fullpath = u'%s/%s' % (self.path, self.vidName)
-
-        proc = subprocess.Popen(
+        proc = process.Process(
             [
                 '%smakemkvcon' % self.makemkvconPath,
+                '-r',
+                '--progress=-same',
                 'mkv',
-                'disc:%d' % self.discIndex,
+                self.source,
                 titleIndex,
-                fullpath,
+                self.path,
                 '--cache=%d' % self.cacheSize,
                 '--noscan',
                 '--decrypt',
                 '--minlength=%d' % self.minLength
             ],
-            stderr=subprocess.PIPE,
-            stdout=subprocess.PIPE
+            watchdog='makemkv'
         )
 
-        (results, errors) = proc.communicate()
+        state = {'checks': 0, 'failed': False}
 
-        if results is not None:
-            results = results.decode('utf-8')
+        badstrings = [
+            "failed",
+            "fail",
+            "error"
+        ]
 
-        if errors is not None:
-            errors = errors.decode('utf-8')
+        job = progress.Progress(
+            u"MakeMKV {} title {}".format(self.vidName, titleIndex),
+            self.log,
+            total_bytes=self._title_size(titleIndex)
+        )
 
-        if proc.returncode is not 0:
-            self.log.error(
-                "MakeMKV (rip_disc) returned status code: %d" % proc.returncode)
-
-        errorList = errors.split("\n")
-        if errors is not None:
-            for error in errorList:
-                error = error.strip()
-                if len(error) is not 0:
-                    if "Redirecting output to" in error:
-                        p = re.compile("Redirecting output to .(.*).\.")
-                        m = p.match(error)
-                        self.log.debug("Removing " + m.group(1))
-                        os.remove(m.group(1))
-                    else:
-                        self.log.error("MakeMKV encountered the following error: ")
-                        self.log.error(errors)
-                        return []
-
-        checks = 0
-
-        lines = results.split("\n")
-        for line in lines:
-            if "skipped" in line:
-                continue
+        def classify(line):
+            if job.parse_makemkv(line):
+                return
+
+            # Robot mode: only the text of MSG lines is of interest
+            if line.startswith("MSG:"):
+                values = discinfo.split_values(line[4:])
+                if len(values) < 4:
+                    return
+                line = values[3]
+            elif re.match(r'^[A-Z]+:', line):
+                return
 
-            badstrings = [
-                "failed",
-                "fail",
-                "error"
-            ]
+            if state['failed'] or "skipped" in line:
+                return
 
             if any(x in line.lower() for x in badstrings):
                 if self.ignore_region and "RPC protection" in line:
@@ -221,19 +189,122 @@ class MakeMKV(object):
                     self.log.warn(line)
                 else:
                     self.log.error(line)
-                    return False
+                    state['failed'] = True
+                    return
 
             if "Copy complete" in line:
-                checks += 1
+                state['checks'] += 1
 
             if "titles saved" in line:
-                checks += 1
+                state['checks'] += 1
+
+        def classify_error(line):
+            if not self._redirected_output(line):
+                self.log.error("MakeMKV encountered the following error: ")
+                self.log.error(line)
+                state['failed'] = True
+
+        try:
+            returncode = proc.run(classify, classify_error)
+        finally:
+            job.finish()
+
+        if returncode is not 0:
+            self.log.error(
+                "MakeMKV (rip_disc) returned status code: %d" % returncode)
+
+        if state['failed']:
+            return False
 
-        if checks >= 2:
+        if state['checks'] >= 2:
             return True
         else:
             return False
 
+    def _title_size(self, titleIndex):
+        """
+            Returns the expected size of a rip in bytes
+
+            Inputs:
+                titleIndex (Str): MakeMKV title id or "all"
+
+            Outputs:
+                bytes   (Int), None if unknown
+        """
+        if self.discInfo is None:
+            return None
+
+        if titleIndex == 'all':
+            titles = self.discInfo.titles
+        else:
+            titles = [int(titleIndex)]
+
+        sizes = [self.discInfo.get_size(title) for title in titles]
+        if None in sizes:
+            return None
+
+        return sum(sizes)
+
+    def _redirected_output(self, line):
+        """
+            Removes the log file makemkvcon mentions on stderr when it
+                redirects its output
+
+            Inputs:
+                line    (Str): Line of stderr output
+
+            Outputs:
+                Bool    Was the line a redirect notice
+        """
+        if "Redirecting output to" not in line:
+            return False
+
+        p = re.compile("Redirecting output to .(.*).\.")
+        m = p.match(line)
+        self.log.debug("Removing " + m.group(1))
+        os.remove(m.group(1))
+        return True
+
+    def rip_titles(self, path, titles):
+        """
+            Rips several titles of the currently inserted DVD or BD
+            When every title on the disc was selected, makemkvcon is started
+                once with "all" so the disc is only opened and authenticated
+                a single time. Otherwise, or if the batch fails, the titles
+                are ripped one at a time
+
+            Inputs:
+                path    (Str):  Folder of the disc the videos are saved to
+                titles  (List): Entries returned by get_savefiles()
+
+            Outputs:
+                results (Dict): Title index => Success (Bool)
+        """
+        results = {}
+        indexes = set(t['index'] for t in titles)
+        discTitles = set()
+        if self.discInfo is not None:
+            discTitles = set(str(t) for t in self.discInfo.titles)
+
+        if len(titles) > 1 and indexes == discTitles:
+            self.log.debug(u"Ripping {} titles from {} in one session".format(
+                len(titles), self.vidName))
+
+            if self.rip_disc(path, 'all'):
+                for title in titles:
+                    outfile = u'%s/%s' % (path, title['title'])
+                    results[title['index']] = (
+                        os.path.isfile(outfile) and os.path.getsize(outfile) > 0
+                    )
+                return results
+
+            self.log.info("Batch rip failed, falling back to one title at a time")
+
+        for title in titles:
+            results[title['index']] = self.rip_disc(path, title['index'])
+
+        return results
+
     def find_disc(self):
         """
             Use makemkvcon to list all DVDs or BDs inserted
@@ -246,39 +317,35 @@ class MakeMKV(object):
                 Success (Bool)
         """
         drives = []
-        proc = subprocess.Popen(
+        proc = process.Process(
             ['%smakemkvcon' % self.makemkvconPath, '-r', 'info', 'disc:-1'],
-            stderr=subprocess.PIPE,
-            stdout=subprocess.PIPE
+            watchdog='makemkv'
         )
 
-        (results, errors) = proc.communicate()
+        state = {'failed': False}
 
-        if results is not None:
-            results = results.decode('utf-8')
+        def classify_error(line):
+            if not self._redirected_output(line):
+                self.log.error("MakeMKV encountered the following error: ")
+                self.log.error(line)
+                state['failed'] = True
+
+        lines = []
+        try:
+            returncode = proc.run(lines.append, classify_error)
+        except process.Stalled as ex:
+            self.log.error(u"MakeMKV (find_disc): {}".format(ex))
+            return []
 
-        if errors is not None:
-            errors = errors.decode('utf-8')
+        results = u"\n".join(lines)
 
         self.log.info(results)
-        if proc.returncode is not 0:
+        if returncode is not 0:
             self.log.error(
-                "MakeMKV (find_disc) returned status code: %d" % proc.returncode)
-
-        errorList = errors.split("\n")
-        if errors is not None:
-            for error in errorList:
-                error = error.strip()
-                if len(error) is not 0:
-                    if "Redirecting output to" in error:
-                        p = re.compile("Redirecting output to .(.*).\.")
-                        m = p.match(error)
-                        self.log.info("Removing " + m.group(1))
-                        os.remove(m.group(1))
-                    else:
-                        self.log.error("MakeMKV encountered the following error: ")
-                        self.log.error(errors)
-                        return []
+                "MakeMKV (find_disc) returned status code: %d" % returncode)
+
+        if state['failed']:
+            return []
 
         if "This application version is too old." in results:
             self.log.error("Your MakeMKV version is too old."
@@ -288,7 +355,6 @@ class MakeMKV(object):
             return []
 
         # Passed the simple tests, now check for disk drives
-        lines = results.split(u"\n")
         for line in lines:
             self.log.info(line)
             if line[:4] == "DRV:":
@@ -318,54 +384,79 @@ class MakeMKV(object):
                 None
         """
 
-        proc = subprocess.Popen(
+        # Progress goes to stdout so the watchdog can see the scan is alive
+        proc = process.Process(
             [
                 '%smakemkvcon' % self.makemkvconPath,
                 '-r',
                 'info',
-                'disc:%d' % self.discIndex,
+                self.source,
                 '--decrypt',
                 '--minlength=%d' % self.minLength,
-                '--messages=/tmp/makemkvMessages'
+                '--messages=%s' % self.messagesPath,
+                '--progress=-stdout'
             ],
-            stderr=subprocess.PIPE
+            watchdog='makemkv'
         )
 
-        (results, errors) = proc.communicate()
+        state = {'failed': False}
 
-        if results is not None:
-            results = results.decode('utf-8')
+        def classify_error(line):
+            if not self._redirected_output(line):
+                self.log.error("MakeMKV encountered the following error: ")
+                self.log.error(line)
+                state['failed'] = True
 
-        if errors is not None:
-            errors = errors.decode('utf-8')
+        returncode = proc.run(None, classify_error)
 
-        if proc.returncode is not 0:
+        if returncode is not 0:
             self.log.error(
-                "MakeMKV (get_disc_info) returned status code: %d" % proc.returncode)
-
-        errorList = errors.split("\n")
-        if errors is not None:
-            for error in errorList:
-                error = error.strip()
-                if len(error) is not 0:
-                    if "Redirecting output to" in error:
-                        p = re.compile("Redirecting output to .(.*).\.")
-                        m = p.match(error)
-                        self.log.info("Removing " + m.group(1))
-                        os.remove(m.group(1))
-                    else:
-                        self.log.error("MakeMKV encountered the following error: ")
-                        self.log.error(errors)
-                        return []
-
-        foundtitles = int(self._read_mkv_messages(0, "TCOUNT")[0])
+                "MakeMKV (get_disc_info) returned status code: %d" % returncode)
+
+        if state['failed']:
+            return []
+
+        with codecs.open(self.messagesPath, 'r', 'utf-8') as messages:
+            self.infoLines = messages.read().splitlines()
+
+        self.load_disc_info(self.infoLines)
+
+    def load_disc_info(self, lines):
+        """
+            Selects the titles to rip from makemkvcon info output, either
+                from a fresh scan or cached from an earlier one
+
+            Inputs:
+                lines   (List): Robot-mode output lines
+
+            Outputs:
+                None
+        """
+        self.discInfo = discinfo.DiscInfo.from_lines(lines)
+        self.infoLines = lines
+        self.saveFiles = []
+        self.titleDecisions = []
+        info = self.discInfo
+
+        self.log.debug("Parsed {} message lines in {:.3f} seconds".format(
+            info.lines,
+            info.parseTime
+        ))
+
+        foundtitles = info.tcount
 
         index = 0
+        seen = set()
         addedTitles = []
-        for title in self._read_mkv_messages(5, "MSG", 3307):
-            if len(title) is 0:
+        for message in info.get_messages(discinfo.MSG_TITLE_ADDED):
+            if len(message) < 6:
                 continue
 
+            title = message[5]
+            if len(title) is 0 or title in seen:
+                continue
+
+            seen.add(title)
             addedTitles.append((title, index))
             index += 1
 
@@ -382,26 +473,32 @@ class MakeMKV(object):
         self.log.debug("MakeMKV found {} titles".format(foundtitles))
 
         if foundtitles > 0:
-            for makemkvTitleNo in self._read_mkv_messages(0, "TINFO"):
-                disc_title = self._read_mkv_messages(2, "CINFO", 2)[0].title()
-                if len(self._read_mkv_messages(3, "TINFO", makemkvTitleNo, 2)) > 0:
-                    title = self._read_mkv_messages(3, "TINFO", makemkvTitleNo, 2)[0].title()
+            disc_title = info.get_cinfo(discinfo.ATTR_NAME, u"").title()
+            signatures = {}
+            duplicates = 0
+            candidates = []
+
+            for makemkvTitleNo in info.titles:
+                title = info.get_tinfo(makemkvTitleNo, discinfo.ATTR_NAME)
+                if title:
+                    title = title.title()
                 else:
                     title = disc_title
-                filename = self._read_mkv_messages(3, "TINFO", makemkvTitleNo, 27)[0]
-                chapters = self._read_mkv_messages(3, "TINFO", makemkvTitleNo, 8)
 
-                if (len(chapters) == 0) or (int(chapters[0]) == 0):
+                filename = info.get_tinfo(
+                    makemkvTitleNo, discinfo.ATTR_OUTPUT_FILENAME)
+                if filename is None:
+                    self.log.debug(u"Skipping title {} ({}) because no filename found.".format(makemkvTitleNo, title))
+                    continue
+
+                if info.get_chapters(makemkvTitleNo) == 0:
                     self.log.debug(u"Skipping title {} ({}) because chapters found.".format(makemkvTitleNo, title))
                     continue
 
-                durTemp = self._read_mkv_messages(3, "TINFO", makemkvTitleNo, 9)[0]
-                x = time.strptime(durTemp, u'%H:%M:%S')
-                titleDur = datetime.timedelta(
-                    hours=x.tm_hour,
-                    minutes=x.tm_min,
-                    seconds=x.tm_sec
-                ).total_seconds()
+                titleDur = info.get_duration(makemkvTitleNo)
+                if titleDur is None:
+                    self.log.debug(u"Skipping title {} ({}) because no duration found.".format(makemkvTitleNo, title))
+                    continue
 
                 if self.vidType == "tv" and titleDur > self.maxLength:
                     self.log.debug(u"Excluding title {} ({}). Exceeds maxLength".format(makemkvTitleNo, title))
@@ -411,6 +508,23 @@ class MakeMKV(object):
                     self.log.debug(u"Excluding title {} ({}), only the first title is extracted.".format(makemkvTitleNo, title))
                     continue
 
+                signature = info.signature(makemkvTitleNo)
+                if signature in signatures:
+                    self.log.debug(u"Skipping title {} ({}), same content as title {}".format(
+                        makemkvTitleNo, title, signatures[signature]))
+                    duplicates += 1
+                    continue
+                signatures[signature] = makemkvTitleNo
+
+                candidates.append((makemkvTitleNo, title, filename))
+
+            if duplicates > 0:
+                self.log.info(u"Skipped {} title(s) duplicating another title".format(duplicates))
+
+            if self.vidType == "tv" and self.episodeDetection:
+                candidates = self._select_episodes(candidates)
+
+            for makemkvTitleNo, title, filename in candidates:
                 if len(transposition) > 0:
                     realTitleNo = int(transposition[int(makemkvTitleNo)])
                 else:
@@ -418,11 +532,66 @@ class MakeMKV(object):
                 self.log.debug(u"{}: {}=>{} ({})".format(disc_title, makemkvTitleNo, realTitleNo, title))
 
                 self.saveFiles.append({
-                    'index': makemkvTitleNo,
+                    'index': str(makemkvTitleNo),
                     'realIndex': realTitleNo,
                     'title': filename
                 })
 
+    def _select_episodes(self, candidates):
+        """
+            Drops extras and play-all titles from the titles of a TV disc
+            Every decision is logged and kept in titleDecisions
+
+            Inputs:
+                candidates (List): (title id, name, filename) in disc order
+
+            Outputs:
+                candidates (List): The titles that are episodes
+        """
+        decisions = self.discInfo.episodes(
+            [c[0] for c in candidates], self.episodeTolerance)
+        self.titleDecisions = decisions
+
+        keep = set()
+        for makemkvTitleNo, selected, reason in decisions:
+            self.log.info(u"Title {}: {} ({})".format(
+                makemkvTitleNo, "episode" if selected else "skipped", reason))
+            if selected:
+                keep.add(makemkvTitleNo)
+
+        return [c for c in candidates if c[0] in keep]
+
+    def get_quick_key(self, location):
+        """
+            Identifies the disc in a drive without scanning it, from its
+                volume label, the size of the medium and a hash of its
+                volume descriptors
+            Only available where the kernel reports the medium size and
+                the drive can be read directly
+
+            Inputs:
+                location  (Str): Drive device, eg. /dev/sr0
+
+            Outputs:
+                key       (Str), None if unavailable
+        """
+        device = os.path.basename(location.strip('"'))
+
+        try:
+            with open('/sys/class/block/%s/size' % device) as sizefile:
+                sectors = int(sizefile.read().strip())
+        except (IOError, ValueError):
+            return None
+
+        if sectors <= 0:
+            return None
+
+        digest = volume.fingerprint(location.strip('"'))
+        if digest is None:
+            return None
+
+        return u"{}:{}:{}".format(self.label.strip('"'), sectors, digest)
+
     def get_type(self):
         """
             Returns the type of video (tv/movie)
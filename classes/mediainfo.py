@@ -25,8 +25,8 @@ import os
 from pymediainfo import MediaInfo
 from pipes import quote
 import logger
+import process
 import shlex
-import subprocess
 
 # main class that initializes settings for discovering/flagging a forced subtitle track
 # edits python's os.environ in favor of putting full string when calling executables
@@ -112,25 +112,14 @@ class ForcedSubs(object):
         cmd = shlex.split(cmd_raw)
         self.log.debug("mkpropedit cmd: {}".format(cmd))
 
-        proc = subprocess.Popen(
-                                cmd,
-                                stdout=subprocess.PIPE,
-                                stderr=subprocess.PIPE
-                                )
-        
-        (results, error) = proc.communicate()
+        proc = process.Process(cmd, watchdog='mkvpropedit')
+        returncode = proc.run(self.log.tool)
 
-
-        if proc.returncode is not 0:
+        if returncode is not 0:
             self.log.error(
-                           "mkvpropedit (forced subtitles) returned status code {}".format(proc.returncode)
+                           "mkvpropedit (forced subtitles) returned status code {}".format(returncode)
                            )
             return False
 
-        if len(results) is not 0:
-            lines = results.split('\n')
-            for line in lines:
-                self.log.debug(line.strip())
-
         return True
 
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""
+Stage metrics
+
+Times every stage a video goes through (disc scan, rip, encode, forced
+subtitle probe, rename, subtitle download, notification) and keeps each
+run in the metrics table with the bytes read and written and the frame
+rate where known. The totals are written to a Prometheus textfile so the
+node exporter's textfile collector can pick them up.
+
+
+Released under the MIT license
+Copyright (c) 2012, Jason Millward
+
+@category   misc
+@version    $Id: 1.7.0, 2016-08-22 14:53:29 ACST $;
+@author     Jason Millward
+@license    http://opensource.org/licenses/MIT
+"""
+
+import os
+import threading
+import time
+from datetime import datetime
+
+import database
+import logger
+import stopwatch
+import tracing
+
+# Every Metrics instance writes the same textfile
+_export_lock = threading.Lock()
+
+
+class Stage(stopwatch.StopWatch):
+
+    def __init__(self, metrics, stage, dbvideo=None, bytesin=None):
+        """
+            Times one run of a stage, use as a context manager
+            The run counts as failed if it raises or success is set False
+            bytesout and fps can be set before the block ends
+
+            Inputs:
+                metrics (Obj): Metrics instance to record to
+                stage   (Str): Stage name
+                dbvideo (Obj): Video database object, optional
+                bytesin (Int): Bytes the stage reads, optional
+
+            Outputs:
+                The stage instance
+        """
+        self.metrics = metrics
+        self.stage = stage
+        self.dbvideo = dbvideo
+        self.bytesin = bytesin
+        self.bytesout = None
+        self.fps = None
+        self.success = True
+
+    def __exit__(self, exc_type, *args):
+        stopwatch.StopWatch.__exit__(self, exc_type, *args)
+
+        if tracing.enabled():
+            details = {'success': bool(self.success) and exc_type is None}
+            if self.dbvideo is not None:
+                details['video'] = self.dbvideo.filename
+            tracing.record(
+                self.stage, self.startTime, self.startTime + self.seconds, 'stage', details)
+
+        self.metrics.record(
+            self.stage,
+            datetime.fromtimestamp(self.startTime),
+            self.seconds,
+            self.dbvideo,
+            bool(self.success) and exc_type is None,
+            self.bytesin,
+            self.bytesout,
+            self.fps
+        )
+
+
+class Metrics(object):
+
+    def __init__(self, config):
+        settings = config.get('metrics') or {}
+
+        self.log = logger.Logger("Metrics", config['debug'], config['silent'])
+        self.enable = bool(settings.get('enable', True))
+        self.textfile = settings.get('textfile') or ""
+
+    def stage(self, stage, dbvideo=None, bytesin=None):
+        return Stage(self, stage, dbvideo, bytesin)
+
+    def record(self, stage, started, seconds, dbvideo=None, success=True,
+               bytesin=None, bytesout=None, fps=None):
+        """
+            Stores one run of a stage and updates the textfile
+
+            Inputs:
+                stage    (Str): Stage name
+                started  (DateTime): When the run started
+                seconds  (Float): How long it took
+                dbvideo  (Obj): Video database object, optional
+                success  (Bool): Did it succeed
+                bytesin  (Int): Bytes read, optional
+                bytesout (Int): Bytes written, optional
+                fps      (Float): Average frames per second, optional
+
+            Outputs:
+                None
+        """
+        if not self.enable:
+            return
+
+        database.insert_metric(
+            stage, started, seconds, dbvideo, success, bytesin, bytesout, fps)
+
+        self.log.debug(u"{} took {:.3f} seconds".format(stage, seconds))
+
+        if len(self.textfile) > 0:
+            self.export()
+
+    def export(self):
+        """
+            Writes the totals and the latest run of every stage in the
+                Prometheus text format
+            The file is replaced in one rename, so the collector never
+                reads half of it
+
+            Inputs:
+                None
+
+            Outputs:
+                None
+        """
+        lines = []
+
+        def metric(name, kind, description, samples):
+            lines.append(u"# HELP autorippr_{} {}".format(name, description))
+            lines.append(u"# TYPE autorippr_{} {}".format(name, kind))
+            for labels, value in samples:
+                lines.append(u"autorippr_{}{{{}}} {}".format(
+                    name,
+                    u",".join(u'{}="{}"'.format(k, v) for k, v in labels),
+                    repr(float(value or 0))
+                ))
+
+        totals = list(database.metric_totals())
+        latest = list(database.last_metrics())
+
+        def result(row):
+            return (('stage', row.stage), ('result', 'success' if row.success else 'failure'))
+
+        metric('stage_runs_total', 'counter', 'Runs of each stage',
+               [(result(r), r.runs) for r in totals])
+        metric('stage_seconds_total', 'counter', 'Seconds spent in each stage',
+               [(result(r), r.seconds) for r in totals])
+        metric('stage_bytes_in_total', 'counter', 'Bytes read by each stage',
+               [(result(r), r.bytesin) for r in totals])
+        metric('stage_bytes_out_total', 'counter', 'Bytes written by each stage',
+               [(result(r), r.bytesout) for r in totals])
+
+        metric('stage_last_seconds', 'gauge', 'Length of the latest run of each stage',
+               [((('stage', r.stage),), r.seconds) for r in latest])
+        metric('stage_last_timestamp_seconds', 'gauge', 'When the latest run of each stage ended',
+               [((('stage', r.stage),), time.mktime(r.started.timetuple()) + r.seconds) for r in latest])
+        metric('stage_last_bytes_per_second', 'gauge', 'Read rate of the latest run of each stage',
+               [((('stage', r.stage),), r.bytesin / r.seconds)
+                for r in latest if r.bytesin and r.seconds > 0])
+        metric('stage_last_fps', 'gauge', 'Frame rate of the latest run of each stage',
+               [((('stage', r.stage),), r.fps) for r in latest if r.fps is not None])
+
+        with _export_lock:
+            partial = u"{}.{}.tmp".format(self.textfile, os.getpid())
+            try:
+                with open(partial, 'w') as f:
+                    f.write(u"\n".join(lines).encode('utf-8') + "\n")
+                os.rename(partial, self.textfile)
+            except (IOError, OSError) as ex:
+                self.log.error(u"Could not write {}: {}".format(self.textfile, ex))
@@ -0,0 +1,347 @@
+# -*- coding: utf-8 -*-
+"""
+File mover
+
+Moves finished videos without copying data where the filesystem allows
+it: a rename on the same filesystem, a reflink on copy-on-write
+filesystems, otherwise an in-kernel copy with copy_file_range or
+sendfile. Copies are checksummed from the source as it streams, while
+the kernel still has it cached, so no data is read twice. The checksum is
+recorded with the video and checked on every later copy. Reading every
+copy back from disk is optional. Data is dropped from the page
+cache behind every read and copy, so a large file does not push
+everything else out of memory.
+
+
+Released under the MIT license
+Copyright (c) 2012, Jason Millward
+
+@category   misc
+@version    $Id: 1.7.0, 2016-08-22 14:53:29 ACST $;
+@author     Jason Millward
+@license    http://opensource.org/licenses/MIT
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import hashlib
+import os
+import shutil
+
+import logger
+
+# linux/fs.h
+FICLONE = 0x40049409
+
+POSIX_FADV_SEQUENTIAL = 2
+POSIX_FADV_DONTNEED = 4
+
+_libc = None
+
+
+class ChecksumMismatch(IOError):
+    pass
+
+
+def _load_libc():
+    global _libc
+
+    if _libc is None:
+        try:
+            _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        except OSError:
+            _libc = False
+
+    return _libc
+
+
+def _libc_function(name, restype, argtypes):
+    libc = _load_libc()
+    if not libc:
+        return None
+
+    function = getattr(libc, name, None)
+    if function is not None:
+        function.restype = restype
+        function.argtypes = argtypes
+
+    return function
+
+
+def fadvise(fd, offset, length, advice):
+    """
+        Tells the kernel how a file will be used, where supported
+
+        Inputs:
+            fd      (Int): Open file descriptor
+            offset  (Int): Start of the range
+            length  (Int): Length of the range, 0 for the rest of the file
+            advice  (Int): POSIX_FADV_* value
+
+        Outputs:
+            None
+    """
+    function = _libc_function(
+        'posix_fadvise64', ctypes.c_int,
+        [ctypes.c_int, ctypes.c_int64, ctypes.c_int64, ctypes.c_int]
+    )
+    if function is not None:
+        function(fd, offset, length, advice)
+
+
+class Mover(object):
+
+    def __init__(self, config):
+        settings = config.get('mover') or {}
+
+        self.log = logger.Logger("Mover", config['debug'], config['silent'])
+        self.checksum = bool(settings.get('checksum', True))
+        self.chunkSize = int(settings.get('chunkSize', 64)) * 1048576
+        self.readBack = bool(settings.get('readBack', False))
+
+        self.copyFileRange = _libc_function(
+            'copy_file_range', ctypes.c_ssize_t,
+            [ctypes.c_int, ctypes.POINTER(ctypes.c_int64),
+             ctypes.c_int, ctypes.POINTER(ctypes.c_int64),
+             ctypes.c_size_t, ctypes.c_uint]
+        )
+        self.sendfile = _libc_function(
+            'sendfile64', ctypes.c_ssize_t,
+            [ctypes.c_int, ctypes.c_int,
+             ctypes.POINTER(ctypes.c_int64), ctypes.c_size_t]
+        )
+
+    def _hash_fd(self, fd):
+        """
+            Hashes an open file from start to end, dropping it from the
+                page cache behind the read
+        """
+        hasher = hashlib.sha1()
+        fadvise(fd, 0, 0, POSIX_FADV_SEQUENTIAL)
+        os.lseek(fd, 0, os.SEEK_SET)
+
+        offset = 0
+        while True:
+            data = os.read(fd, 1048576)
+            if not data:
+                break
+            hasher.update(data)
+            offset += len(data)
+            if offset % self.chunkSize < len(data):
+                fadvise(fd, 0, offset, POSIX_FADV_DONTNEED)
+
+        fadvise(fd, 0, 0, POSIX_FADV_DONTNEED)
+        return hasher.hexdigest()
+
+    def move(self, source, target, expected=None):
+        """
+            Moves a file, creating the target folder if needed
+            An existing target is never overwritten
+            When the data had to be copied and its checksum differs from
+                the expected one, the copy is removed, the source is kept
+                and ChecksumMismatch is raised
+
+            Inputs:
+                source   (Str): File to move
+                target   (Str): New path of the file
+                expected (Str): SHA-1 recorded for the file, optional
+
+            Outputs:
+                digest   (Str): SHA-1 of the data when it had to be copied
+                                and checksums are enabled, otherwise None
+        """
+        folder = os.path.dirname(target)
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder)
+
+        if os.path.exists(target):
+            raise OSError(errno.EEXIST, "Target already exists", target)
+
+        try:
+            os.rename(source, target)
+            self.log.debug(u"Renamed {} to {}".format(source, target))
+            return None
+        except OSError as ex:
+            if ex.errno != errno.EXDEV:
+                raise
+
+        digest = self.copy(source, target)
+
+        if expected is not None and digest is not None and digest != expected:
+            os.remove(target)
+            raise ChecksumMismatch(
+                errno.EIO, u"Checksum {} does not match {}".format(digest, expected), source)
+
+        os.remove(source)
+        return digest
+
+    def copy(self, source, target):
+        """
+            Copies a file, by reflink where possible
+            The data is written to a temporary name next to the target and
+                only renamed into place once it is on disk, so the target
+                is either complete or missing
+            With readBack the copy is read back from disk once it is
+                written and ChecksumMismatch is raised if it differs from
+                the source
+
+            Inputs:
+                source  (Str): File to copy
+                target  (Str): Path of the copy
+
+            Outputs:
+                digest  (Str): SHA-1 of the copied data, None when no data
+                                was copied or checksums are disabled
+        """
+        partial = os.path.join(
+            os.path.dirname(target), u".%s.part" % os.path.basename(target))
+
+        src = os.open(source, os.O_RDONLY)
+        try:
+            # Read as well, for readBack
+            dst = os.open(partial, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+            try:
+                digest = self._copy_data(src, dst, source)
+                os.fsync(dst)
+
+                if self.readBack and digest is not None:
+                    # Now that it is on disk the copy can be dropped from
+                    # the cache, so this reads what was really written
+                    fadvise(dst, 0, 0, POSIX_FADV_DONTNEED)
+                    written = self._hash_fd(dst)
+                    if written != digest:
+                        raise ChecksumMismatch(
+                            errno.EIO, u"Copy reads back as {}, not {}".format(written, digest), target)
+            finally:
+                os.close(dst)
+
+            shutil.copystat(source, partial)
+            os.rename(partial, target)
+
+        except (IOError, OSError):
+            if os.path.exists(partial):
+                os.remove(partial)
+            raise
+
+        finally:
+            os.close(src)
+
+        return digest
+
+    def _copy_data(self, src, dst, name):
+        if self._reflink(src, dst):
+            self.log.debug(u"Reflinked {}".format(name))
+            return None
+
+        size = os.fstat(src).st_size
+        hasher = hashlib.sha1() if self.checksum else None
+        fadvise(src, 0, 0, POSIX_FADV_SEQUENTIAL)
+
+        offset = 0
+        while offset < size:
+            count = min(self.chunkSize, size - offset)
+            copied = self._copy_chunk(src, dst, offset, count, hasher)
+            if copied <= 0:
+                raise IOError(errno.EIO, "Copy stopped early", name)
+
+            # Neither side is needed in memory again
+            fadvise(src, offset, copied, POSIX_FADV_DONTNEED)
+            fadvise(dst, offset, copied, POSIX_FADV_DONTNEED)
+            offset += copied
+
+        self.log.debug(u"Copied {} bytes of {}".format(offset, name))
+
+        if hasher is None:
+            return None
+
+        return hasher.hexdigest()
+
+    @staticmethod
+    def _reflink(src, dst):
+        import fcntl
+
+        try:
+            fcntl.ioctl(dst, FICLONE, src)
+        except (IOError, OSError):
+            return False
+
+        return True
+
+    def _copy_chunk(self, src, dst, offset, count, hasher):
+        """
+            Copies one range of a file, in the kernel where possible
+            The data is hashed from the source as it is copied
+
+            Inputs:
+                src     (Int): Source file descriptor
+                dst     (Int): Destination file descriptor
+                offset  (Int): Start of the range
+                count   (Int): Length of the range
+                hasher  (Obj): hashlib object, None to skip hashing
+
+            Outputs:
+                copied  (Int): Bytes copied
+        """
+        copied = self._kernel_copy(src, dst, offset, count)
+
+        if copied is None:
+            os.lseek(src, offset, os.SEEK_SET)
+            data = os.read(src, count)
+            os.lseek(dst, offset, os.SEEK_SET)
+            written = 0
+            while written < len(data):
+                written += os.write(dst, data[written:])
+            copied = len(data)
+            if hasher is not None:
+                hasher.update(data)
+
+        elif hasher is not None and copied > 0:
+            # The kernel copy has just pulled the range into the page
+            # cache, hashing it from there reads nothing from disk
+            os.lseek(src, offset, os.SEEK_SET)
+            remaining = copied
+            while remaining > 0:
+                data = os.read(src, min(remaining, 1048576))
+                if not data:
+                    break
+                hasher.update(data)
+                remaining -= len(data)
+
+        return copied
+
+    def _kernel_copy(self, fdin, fdout, offset, count):
+        """
+            Copies a range with copy_file_range, or sendfile on kernels
+                without it. Whichever is unsupported is not tried again
+
+            Outputs:
+                copied  (Int), None when neither is available
+        """
+        if self.copyFileRange is not None:
+            offin = ctypes.c_int64(offset)
+            offout = ctypes.c_int64(offset)
+            copied = self.copyFileRange(
+                fdin, ctypes.byref(offin), fdout, ctypes.byref(offout), count, 0)
+            if copied >= 0:
+                return copied
+
+            error = ctypes.get_errno()
+            if error not in (errno.ENOSYS, errno.EXDEV, errno.EINVAL, errno.EOPNOTSUPP):
+                raise OSError(error, os.strerror(error))
+            self.copyFileRange = None
+
+        if self.sendfile is not None:
+            # sendfile writes at the current position of the destination
+            os.lseek(fdout, offset, os.SEEK_SET)
+            offin = ctypes.c_int64(offset)
+            copied = self.sendfile(fdout, fdin, ctypes.byref(offin), count)
+            if copied >= 0:
+                return copied
+
+            error = ctypes.get_errno()
+            if error not in (errno.ENOSYS, errno.EINVAL):
+                raise OSError(error, os.strerror(error))
+            self.sendfile = None
+
+        return None
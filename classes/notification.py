@@ -13,6 +13,7 @@ Copyright (c) 2014, Jason Millward
 """
 
 import logger
+import metrics
 
 
 class Notification(object):
@@ -22,23 +23,34 @@ class Notification(object):
         self.debug = debug
         self.silent = silent
         self.log = logger.Logger("Notification", debug, silent)
+        self.metrics = metrics.Metrics(config)
+
+        # Backends are only imported once they have something to send, and
+        # only the enabled ones, so their libraries stay unloaded otherwise
+        self.methods = []
+        if bool(self.config.get('enable', True)):
+            self.methods = [
+                method for method in self.config['methods']
+                if bool(self.config['methods'][method]['enable'])
+            ]
+        self.classes = {}
 
     def import_from(self, module, name, config):
-        module = __import__(module, fromlist=[name])
-        class_ = getattr(module, name)
-        return class_(config, self.debug, self.silent)
+        if module not in self.classes:
+            self.classes[module] = getattr(__import__(module, fromlist=[name]), name)
+        return self.classes[module](config, self.debug, self.silent)
 
     def _send(self, status):
-        for method in self.config['methods']:
-            if bool(self.config['methods'][method]['enable']):
-                try:
-                    method_class = self.import_from('classes.{}'.format(
-                        method), method.capitalize(), self.config['methods'][method])
+        for method in self.methods:
+            try:
+                method_class = self.import_from('classes.{}'.format(
+                    method), method.capitalize(), self.config['methods'][method])
+                with self.metrics.stage(u"notify_{}".format(method)):
                     method_class.send_notification(status)
-                    del method_class
-                except ImportError:
-                    self.log.error(
-                        "Error loading notification class: {}".format(method))
+                del method_class
+            except ImportError:
+                self.log.error(
+                    "Error loading notification class: {}".format(method))
 
     def rip_complete(self, dbvideo):
 
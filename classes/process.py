@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming process runner
+
+Runs an external tool and hands its output to a callback one line at a
+time as it is produced. Only a bounded number of recent lines is kept for
+error reports, so memory use does not grow with the length of the job.
+
+A watchdog kills the whole process group of a tool that has not printed
+anything for a configurable time and raises Stalled to the caller.
+
+
+Released under the MIT license
+Copyright (c) 2012, Jason Millward
+
+@category   misc
+@version    $Id: 1.7.0, 2016-08-22 14:53:29 ACST $;
+@author     Jason Millward
+@license    http://opensource.org/licenses/MIT
+"""
+
+import codecs
+import collections
+import os
+import re
+import signal
+import subprocess
+import threading
+import time
+
+import tracing
+
+# Number of recent lines kept for error reports
+TAIL_LINES = 50
+
+READ_SIZE = 65536
+
+# Progress output is usually redrawn with \r, treat it as a line break
+LINE_BREAK = re.compile(u'\r\n|\r|\n')
+
+# Seconds between SIGTERM and SIGKILL for a stalled tool
+KILL_GRACE = 10
+
+# Seconds of silence before a tool is considered stalled, 0 disables
+TIMEOUTS = {
+    'makemkv': 1800,
+    'handbrake': 900,
+    'ffmpeg': 900,
+    'mkvmerge': 900,
+    'filebot': 600,
+    'mkvpropedit': 300
+}
+
+
+def configure(config):
+    """
+        Reads the watchdog settings
+
+        Inputs:
+            config    (??): The configuration
+
+        Outputs:
+            None
+    """
+    settings = config.get('watchdog') or {}
+    for tool in TIMEOUTS:
+        if tool in settings:
+            TIMEOUTS[tool] = int(settings[tool] or 0)
+
+
+class Stalled(Exception):
+    pass
+
+
+class Process(object):
+
+    def __init__(self, command, shell=False, merge_stderr=False, tail=TAIL_LINES,
+                 watchdog=None):
+        """
+            Prepares an external command
+
+            Inputs:
+                command      (List/Str): Command to run
+                shell        (Bool): Run the command through the shell
+                merge_stderr (Bool): Read stderr together with stdout
+                tail         (Int): Number of recent lines to keep
+                watchdog     (Str): Key in TIMEOUTS for this tool, optional
+
+            Outputs:
+                The process instance
+        """
+        self.command = command
+        self.shell = shell
+        self.merge_stderr = merge_stderr
+        self.watchdog = watchdog
+        self.timeout = TIMEOUTS.get(watchdog, 0)
+        self.proc = None
+        self.returncode = None
+        self.stalled = False
+        self.lastOutput = None
+        self.firstOutput = None
+        self.finished = threading.Event()
+        self.tail = collections.deque(maxlen=tail)
+        self.errorTail = collections.deque(maxlen=tail)
+
+    def start(self):
+        if self.merge_stderr:
+            stderr = subprocess.STDOUT
+        else:
+            stderr = subprocess.PIPE
+
+        # Own process group, so the watchdog can kill the tool together
+        # with anything it started (nice, shells)
+        extra = {}
+        if self.timeout > 0:
+            if os.name == 'posix':
+                extra['preexec_fn'] = os.setsid
+            elif hasattr(subprocess, 'CREATE_NEW_PROCESS_GROUP'):
+                extra['creationflags'] = subprocess.CREATE_NEW_PROCESS_GROUP
+
+        self.proc = subprocess.Popen(
+            self.command,
+            stdout=subprocess.PIPE,
+            stderr=stderr,
+            shell=self.shell,
+            **extra
+        )
+        self.lastOutput = time.time()
+
+    def run(self, on_line=None, on_error=None):
+        """
+            Runs the command to completion
+
+            Inputs:
+                on_line  (Func): Called with every stdout line (unicode)
+                on_error (Func): Called with every stderr line (unicode)
+
+            Outputs:
+                returncode (Int)
+        """
+        started = time.time()
+        self.start()
+        spawned = time.time()
+
+        watcher = None
+        if self.timeout > 0:
+            watcher = threading.Thread(target=self._watch)
+            watcher.daemon = True
+            watcher.start()
+
+        reader = None
+        if not self.merge_stderr:
+            reader = threading.Thread(
+                target=self._read,
+                args=(self.proc.stderr, self.errorTail, on_error)
+            )
+            reader.daemon = True
+            reader.start()
+
+        self._read(self.proc.stdout, self.tail, on_line)
+
+        if reader is not None:
+            reader.join()
+
+        self.returncode = self.proc.wait()
+
+        if watcher is not None:
+            self.finished.set()
+            watcher.join()
+
+        if tracing.enabled():
+            self._trace(started, spawned, time.time())
+
+        if self.stalled:
+            raise Stalled(u"{} produced no output for {} seconds and was killed".format(
+                self.watchdog, self.timeout))
+
+        return self.returncode
+
+    def _trace(self, started, spawned, ended):
+        """
+            Records the run as a trace span, split into starting the
+                process, waiting for its first output and working
+
+            Inputs:
+                started (Float): Before the process was started
+                spawned (Float): Once it was running
+                ended   (Float): Once it had exited
+
+            Outputs:
+                None
+        """
+        name = self.watchdog
+        if name is None:
+            command = self.command
+            if not isinstance(command, list):
+                command = command.split()
+            name = os.path.basename(command[0]) if len(command) > 0 else u"process"
+
+        if isinstance(self.command, list):
+            command = u" ".join(self.command)
+        else:
+            command = self.command
+
+        first = self.firstOutput if self.firstOutput is not None else ended
+
+        tracing.record(name, started, ended, 'process', {
+            'command': command,
+            'returncode': self.returncode,
+            'stalled': self.stalled
+        })
+        tracing.record(u"{} start".format(name), started, spawned, 'process')
+        tracing.record(u"{} first output".format(name), spawned, first, 'process')
+        tracing.record(u"{} working".format(name), first, ended, 'process')
+
+    def _watch(self):
+        """
+            Kills the process once it has been silent for too long
+
+            Inputs:
+                None
+
+            Outputs:
+                None
+        """
+        while not self.finished.wait(min(5, self.timeout)):
+            if time.time() - self.lastOutput > self.timeout:
+                self.stalled = True
+                self.kill()
+                return
+
+    def kill(self):
+        """
+            Terminates the whole process group, forcefully if it does not
+                exit within KILL_GRACE seconds
+
+            Inputs:
+                None
+
+            Outputs:
+                None
+        """
+        if os.name != 'posix':
+            self.proc.kill()
+            return
+
+        try:
+            os.killpg(self.proc.pid, signal.SIGTERM)
+        except OSError:
+            return
+
+        if self.finished.wait(KILL_GRACE):
+            return
+
+        try:
+            os.killpg(self.proc.pid, signal.SIGKILL)
+        except OSError:
+            pass
+
+    def _read(self, stream, tail, callback):
+        """
+            Reads a stream until it closes, splitting it into lines
+
+            Inputs:
+                stream   (File): Pipe to read
+                tail     (Deque): Ring buffer of recent lines
+                callback (Func): Called with every non-empty line
+
+            Outputs:
+                None
+        """
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        fd = stream.fileno()
+        pending = u''
+
+        while True:
+            data = os.read(fd, READ_SIZE)
+            if not data:
+                break
+
+            self.lastOutput = time.time()
+            if self.firstOutput is None:
+                self.firstOutput = self.lastOutput
+
+            pending += decoder.decode(data)
+            lines = LINE_BREAK.split(pending)
+            pending = lines.pop()
+
+            for line in lines:
+                self._line(line, tail, callback)
+
+        pending += decoder.decode(b'', final=True)
+        self._line(pending, tail, callback)
+        stream.close()
+
+    @staticmethod
+    def _line(line, tail, callback):
+        line = line.strip()
+        if len(line) == 0:
+            return
+
+        tail.append(line)
+        if callback is not None:
+            callback(line)
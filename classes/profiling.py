@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+Stage profiling
+
+Runs each stage under cProfile when profiling is enabled and adds up the
+results of every call of a stage. After each call the totals of that
+stage are saved as a pstats file, which can be opened with pstats,
+snakeviz or gprof2dot, and report() logs the functions that took the
+longest in every stage.
+
+cProfile only sees the thread it runs in, so stages that run in worker
+threads are profiled in those threads. A stage called from inside
+another stage on the same thread counts towards the outer one.
+
+
+Released under the MIT license
+Copyright (c) 2012, Jason Millward
+
+@category   misc
+@version    $Id: 1.7.0, 2016-08-22 14:53:29 ACST $;
+@author     Jason Millward
+@license    http://opensource.org/licenses/MIT
+"""
+
+import StringIO
+import cProfile
+import functools
+import os
+import pstats
+import threading
+
+import logger
+
+# Functions listed per stage by report()
+TOP = 20
+
+_lock = threading.Lock()
+_local = threading.local()
+_stats = {}
+_state = {'path': None}
+
+
+def enable(path):
+    """
+        Starts profiling stages, pstats files are written to path
+
+        Inputs:
+            path    (Str): Folder for the pstats files
+
+        Outputs:
+            None
+    """
+    if not os.path.isdir(path):
+        os.makedirs(path)
+
+    _state['path'] = path
+
+
+def filename(name):
+    return os.path.join(_state['path'], u"{}.pstats".format(name.replace(' ', '_')))
+
+
+def profiled(name):
+    """
+        Decorator running every call of a function under the profiler
+
+        Inputs:
+            name    (Str): Stage name
+
+        Outputs:
+            decorator (Func)
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _state['path'] is None or getattr(_local, 'active', False):
+                return function(*args, **kwargs)
+
+            profile = cProfile.Profile()
+            _local.active = True
+            try:
+                return profile.runcall(function, *args, **kwargs)
+            finally:
+                _local.active = False
+                _collect(name, profile)
+
+        return wrapper
+
+    return decorator
+
+
+def _collect(name, profile):
+    with _lock:
+        stats = _stats.get(name)
+        if stats is None:
+            stats = _stats[name] = pstats.Stats(profile)
+        else:
+            stats.add(profile)
+
+        stats.dump_stats(filename(name))
+
+
+def report(config):
+    """
+        Logs the TOP functions by cumulative time for every stage
+
+        Inputs:
+            config  (??): The configuration
+
+        Outputs:
+            None
+    """
+    if _state['path'] is None:
+        return
+
+    log = logger.Logger("Profile", config['debug'], config['silent'])
+
+    with _lock:
+        for name in sorted(_stats):
+            output = StringIO.StringIO()
+            stats = _stats[name]
+            stats.stream = output
+            stats.sort_stats('cumulative').print_stats(TOP)
+
+            log.info(u"{}, saved to {}\n{}".format(
+                name, filename(name), output.getvalue().strip('\n')))
@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+"""
+Job progress tracking
+
+Parses the progress output of makemkvcon, HandBrakeCLI and FFmpeg into a
+record per running job with percent done, fps, MB/s and ETA. Every running
+job is listed in a shared registry which can be written to a JSON status
+file for monitoring.
+
+
+Released under the MIT license
+Copyright (c) 2012, Jason Millward
+
+@category   misc
+@version    $Id: 1.7.0, 2016-08-22 14:53:29 ACST $;
+@author     Jason Millward
+@license    http://opensource.org/licenses/MIT
+"""
+
+import json
+import os
+import re
+import threading
+import time
+
+import discinfo
+
+HANDBRAKE_PROGRESS = re.compile(
+    r'Encoding: task (\d+) of (\d+), ([\d.]+) %'
+    r'(?: \(([\d.]+) fps, avg ([\d.]+) fps, ETA (\d+)h(\d+)m(\d+)s\))?'
+)
+FFMPEG_DURATION = re.compile(r'Duration: (\d+):(\d+):([\d.]+)')
+FFMPEG_PROGRESS = re.compile(r'frame=\s*(\d+)\s+fps=\s*([\d.]+).*?time=(\d+):(\d+):([\d.]+)')
+FFMPEG_SPEED = re.compile(r'speed=\s*([\d.]+)x')
+
+# Seconds between progress log lines for a job
+LOG_INTERVAL = 60
+
+statusFile = None
+
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+
+def configure(config):
+    """
+        Reads the progress settings
+
+        Inputs:
+            config    (??): The configuration
+
+        Outputs:
+            None
+    """
+    global statusFile, LOG_INTERVAL
+
+    settings = config.get('progress') or {}
+    statusFile = settings.get('statusFile') or None
+    LOG_INTERVAL = int(settings.get('interval', LOG_INTERVAL))
+
+
+def jobs():
+    """
+        Returns a snapshot of every running job
+
+        Inputs:
+            None
+
+        Outputs:
+            jobs    (List): One dict per job
+    """
+    with _jobs_lock:
+        return [job.as_dict() for job in _jobs.values()]
+
+
+def write_status():
+    """
+        Writes the running jobs to the status file, if one is configured
+
+        Inputs:
+            None
+
+        Outputs:
+            None
+    """
+    if statusFile is None:
+        return
+
+    tmpfile = u'%s.tmp' % statusFile
+    try:
+        with open(tmpfile, 'w') as status:
+            json.dump(jobs(), status, indent=2)
+        os.rename(tmpfile, statusFile)
+    except (IOError, OSError):
+        pass
+
+
+def _seconds(hours, minutes, seconds):
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+class Progress(object):
+
+    def __init__(self, job, log, total_bytes=None):
+        """
+            Starts tracking a job
+
+            Inputs:
+                job         (Str): Name of the job
+                log         (Obj): Logger to report progress to
+                total_bytes (Int): Size of the input, used for MB/s
+
+            Outputs:
+                The progress instance
+        """
+        self.job = job
+        self.log = log
+        self.totalBytes = total_bytes
+        self.started = time.time()
+        self.updated = self.started
+        self.logged = self.started
+        self.percent = 0.0
+        self.fps = None
+        self.avgFps = None
+        self.mbps = None
+        self.eta = None
+        self.duration = None
+
+        with _jobs_lock:
+            _jobs[id(self)] = self
+
+    def finish(self):
+        with _jobs_lock:
+            _jobs.pop(id(self), None)
+        write_status()
+
+    def as_dict(self):
+        return {
+            'job': self.job,
+            'percent': round(self.percent, 2),
+            'fps': self.fps,
+            'avgFps': self.avgFps,
+            'mbps': self.mbps,
+            'eta': self.eta,
+            'elapsed': int(time.time() - self.started),
+            'updated': self.updated
+        }
+
+    def update(self, percent, fps=None, avg_fps=None, eta=None):
+        """
+            Records a new progress reading
+            Fills in MB/s and ETA from the elapsed time where the tool
+                does not report them
+
+            Inputs:
+                percent (Float): Overall percent done
+                fps     (Float): Current frames per second
+                avg_fps (Float): Average frames per second
+                eta     (Int): Seconds left
+
+            Outputs:
+                None
+        """
+        now = time.time()
+        elapsed = now - self.started
+
+        self.percent = min(100.0, max(0.0, percent))
+        self.fps = fps
+        self.avgFps = avg_fps
+        self.updated = now
+
+        if self.totalBytes and elapsed > 0:
+            done = self.totalBytes * self.percent / 100
+            self.mbps = round(done / elapsed / 1048576, 2)
+
+        if eta is None and self.percent > 0:
+            eta = elapsed * (100 - self.percent) / self.percent
+        if eta is not None:
+            self.eta = int(eta)
+
+        if now - self.logged >= LOG_INTERVAL:
+            self.logged = now
+            self.report()
+
+    def report(self):
+        message = u"{}: {:.1f}%".format(self.job, self.percent)
+
+        if self.fps is not None:
+            message += u", {:.1f} fps".format(self.fps)
+
+        if self.mbps is not None:
+            message += u", {:.1f} MB/s".format(self.mbps)
+
+        if self.eta is not None:
+            message += u", ETA {}:{:02d}:{:02d}".format(
+                self.eta // 3600, self.eta // 60 % 60, self.eta % 60)
+
+        self.log.info(message)
+        write_status()
+
+    def parse_handbrake(self, line):
+        """
+            Reads an "Encoding: task ..." line from HandBrakeCLI
+
+            Inputs:
+                line    (Str): Line of output
+
+            Outputs:
+                Bool    Was the line a progress line
+        """
+        match = HANDBRAKE_PROGRESS.search(line)
+        if match is None:
+            return False
+
+        task, tasks, percent = match.group(1, 2, 3)
+        overall = ((int(task) - 1) + float(percent) / 100) / int(tasks) * 100
+
+        fps = avg_fps = eta = None
+        if match.group(4) is not None:
+            fps = float(match.group(4))
+            avg_fps = float(match.group(5))
+            # HandBrake only estimates the current pass
+            eta = _seconds(*match.group(6, 7, 8))
+            eta += eta / max(100 - float(percent), 1) * 100 * (int(tasks) - int(task))
+
+        self.update(overall, fps, avg_fps, eta)
+        return True
+
+    def parse_ffmpeg(self, line):
+        """
+            Reads the "Duration:" and "frame= ... speed=" lines from FFmpeg
+
+            Inputs:
+                line    (Str): Line of output
+
+            Outputs:
+                Bool    Was the line a progress line
+        """
+        if self.duration is None:
+            match = FFMPEG_DURATION.search(line)
+            if match is not None:
+                self.duration = _seconds(*match.group(1, 2, 3))
+                return True
+
+        match = FFMPEG_PROGRESS.search(line)
+        if match is None:
+            return False
+
+        fps = float(match.group(2))
+        position = _seconds(*match.group(3, 4, 5))
+
+        percent = 0.0
+        eta = None
+        if self.duration:
+            percent = position / self.duration * 100
+
+            speed = FFMPEG_SPEED.search(line)
+            if speed is not None and float(speed.group(1)) > 0:
+                eta = (self.duration - position) / float(speed.group(1))
+
+        self.update(percent, fps, None, eta)
+        return True
+
+    def parse_makemkv(self, line):
+        """
+            Reads a robot-mode PRGV line from makemkvcon
+
+            Inputs:
+                line    (Str): Line of output
+
+            Outputs:
+                Bool    Was the line a progress line
+        """
+        if not line.startswith("PRG"):
+            return False
+
+        if line.startswith("PRGV:"):
+            values = discinfo.split_values(line[5:])
+            try:
+                total = float(values[1])
+                maximum = float(values[2])
+            except (IndexError, ValueError):
+                return True
+
+            if maximum > 0:
+                self.update(total / maximum * 100)
+
+        return True
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+Compression scheduling
+
+Orders the compression queue shortest job first, so a batch of short TV
+episodes is not held up behind one long film. The cost of a job is
+estimated from the size of the rip, or from the title length while the
+size is unknown. A per-video priority moves a job forward, and every job
+gains credit while it waits so long jobs are not starved.
+
+
+Released under the MIT license
+Copyright (c) 2012, Jason Millward
+
+@category   misc
+@version    $Id: 1.7.0, 2016-08-22 14:53:29 ACST $;
+@author     Jason Millward
+@license    http://opensource.org/licenses/MIT
+"""
+
+import threading
+from datetime import datetime
+
+# MB of source assumed per second of video when the rip size is unknown
+DEFAULT_RATE = 2
+
+
+class Scheduler(object):
+
+    def __init__(self, config):
+        settings = config.get('scheduler') or {}
+
+        self.enable = bool(settings.get('enable', True))
+        self.aging = float(settings.get('aging', 100))
+        self.priorityWeight = float(settings.get('priorityWeight', 10000))
+        self.priorities = settings.get('priority') or {}
+
+    def default_priority(self, vidtype):
+        """
+            Returns the priority new videos of a type start with
+
+            Inputs:
+                vidtype (Str): tv or movie
+
+            Outputs:
+                priority (Int)
+        """
+        return int(self.priorities.get(vidtype, 0))
+
+    @staticmethod
+    def cost(dbvideo):
+        """
+            Estimates the work of compressing a video, in MB of source
+
+            Inputs:
+                dbvideo (Obj): Video database object
+
+            Outputs:
+                cost    (Float)
+        """
+        if dbvideo.ripsize:
+            return dbvideo.ripsize / 1048576.0
+
+        if dbvideo.duration:
+            return dbvideo.duration * DEFAULT_RATE
+
+        return 0.0
+
+    def score(self, dbvideo, now=None):
+        """
+            Returns the position of a video in the queue, lowest first
+            Each point of priority is worth priorityWeight MB, and every
+                minute spent waiting is worth aging MB
+
+            Inputs:
+                dbvideo (Obj): Video database object
+                now     (DateTime): Time to age the video to
+
+            Outputs:
+                score   (Float)
+        """
+        if now is None:
+            now = datetime.now()
+
+        waited = 0.0
+        if dbvideo.lastupdated is not None:
+            waited = max(0.0, (now - dbvideo.lastupdated).total_seconds() / 60)
+
+        return (
+            self.cost(dbvideo) -
+            (dbvideo.priority or 0) * self.priorityWeight -
+            waited * self.aging
+        )
+
+    def order(self, dbvideos):
+        """
+            Sorts videos into the order they should be compressed in
+
+            Inputs:
+                dbvideos (List): Video database objects
+
+            Outputs:
+                dbvideos (List)
+        """
+        dbvideos = list(dbvideos)
+        if not self.enable:
+            return sorted(dbvideos, key=lambda v: v.vidid)
+
+        now = datetime.now()
+        return sorted(dbvideos, key=lambda v: (self.score(v, now), v.vidid))
+
+
+class JobQueue(object):
+
+    def __init__(self, scheduler, refill=None, interval=60):
+        """
+            Queue handing out the video with the lowest score first
+            Scores are worked out when a video is taken, so waiting videos
+                keep aging
+            None is handed out only once no videos are left
+            With refill, an idle queue asks it for videos every interval
+                seconds, picking up videos put back in the database
+
+            Inputs:
+                scheduler (Obj): Scheduler instance
+                refill    (Func): Returns the videos waiting, optional
+                interval  (Float): Seconds between refills
+
+            Outputs:
+                The queue instance
+        """
+        self.scheduler = scheduler
+        self.refill = refill
+        self.interval = interval
+        self.jobs = []
+        self.stops = 0
+        self.ready = threading.Condition()
+
+    def _add(self, dbvideo):
+        if all(job.vidid != dbvideo.vidid for job in self.jobs):
+            self.jobs.append(dbvideo)
+
+    def put(self, dbvideo):
+        with self.ready:
+            if dbvideo is None:
+                self.stops += 1
+            else:
+                self._add(dbvideo)
+            self.ready.notify()
+
+    def get(self):
+        with self.ready:
+            while len(self.jobs) == 0 and self.stops == 0:
+                if self.refill is None:
+                    self.ready.wait()
+                    continue
+
+                self.ready.wait(self.interval)
+                if len(self.jobs) == 0 and self.stops == 0:
+                    for dbvideo in self.refill():
+                        self._add(dbvideo)
+
+            if len(self.jobs) == 0:
+                self.stops -= 1
+                return None
+
+            dbvideo = self.scheduler.order(self.jobs)[0]
+            self.jobs.remove(dbvideo)
+            return dbvideo
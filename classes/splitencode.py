@@ -0,0 +1,373 @@
+# -*- coding: utf-8 -*-
+"""
+Chapter split encoding
+
+Cuts a long title into parts at chapter boundaries with mkvmerge, encodes
+the parts at the same time and joins the results back together.
+
+
+Released under the MIT license
+Copyright (c) 2014, Jason Millward
+
+@category   misc
+@version    $Id: 1.7.0, 2016-08-22 14:53:29 ACST $;
+@author     Jason Millward
+@license    http://opensource.org/licenses/MIT
+"""
+
+import glob
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+
+import logger
+import process
+
+
+class SplitEncoder(object):
+
+    def __init__(self, config, budget=0):
+        """
+            Reads the split settings
+
+            Inputs:
+                config  (??): The configuration
+                budget  (Int): Cores the compression worker may use, 0 for
+                                all of them
+
+            Outputs:
+                The SplitEncoder instance
+        """
+        split = config['compress'].get('split') or {}
+
+        self.log = logger.Logger("SplitEncoder", config['debug'], config['silent'])
+        self.enable = bool(split.get('enable', False))
+        self.minChapters = int(split.get('minChapters', 8))
+        self.minLength = int(split.get('minLength', 3600))
+        self.tolerance = float(split.get('tolerance', 1))
+        self.mkvmergePath = split.get('mkvmergePath') or ""
+
+        cores = budget
+        if cores <= 0:
+            try:
+                cores = multiprocessing.cpu_count()
+            except NotImplementedError:
+                cores = 1
+
+        self.jobs = int(split.get('jobs', 0))
+        if self.jobs <= 0:
+            self.jobs = max(2, cores // 4)
+
+        # The parts share the cores of the worker running them
+        self.threads = max(1, cores // self.jobs)
+        self.sourceInfo = (None, None)
+
+    def _identify(self, path):
+        """
+            Reads container information with mkvmerge
+
+            Inputs:
+                path    (Str): Matroska file
+
+            Outputs:
+                info    (Dict), None on failure
+        """
+        proc = process.Process(
+            ['%smkvmerge' % self.mkvmergePath, '-J', path],
+            watchdog='mkvmerge'
+        )
+
+        lines = []
+        returncode = proc.run(lines.append)
+
+        if returncode != 0:
+            self.log.debug(
+                "mkvmerge (identify) returned status code: %d" % returncode)
+            return None
+
+        try:
+            return json.loads(u"\n".join(lines))
+        except ValueError:
+            return None
+
+    def _chapters(self, info):
+        chapters = info.get('chapters') or []
+        if len(chapters) == 0:
+            return 0
+
+        return int(chapters[0].get('num_entries', 0))
+
+    def _duration(self, info):
+        duration = info.get('container', {}).get('properties', {}).get('duration')
+        if duration is None:
+            return 0
+
+        # Nanoseconds
+        return int(duration) / 1000000000.0
+
+    def wanted(self, invid, vformat):
+        """
+            Decides whether a video is worth splitting
+
+            Inputs:
+                invid   (Str): File to encode
+                vformat (Str): Output container format
+
+            Outputs:
+                Bool
+        """
+        if not self.enable:
+            return False
+
+        if vformat != "mkv" or not invid.endswith(".mkv"):
+            self.log.debug("Split encoding needs mkv input and output")
+            return False
+
+        info = self._identify(invid)
+        self.sourceInfo = (invid, info)
+        if info is None:
+            return False
+
+        chapters = self._chapters(info)
+        duration = self._duration(info)
+
+        if chapters < self.minChapters or duration < self.minLength:
+            return False
+
+        self.log.debug(u"Splitting {} ({} chapters, {} seconds)".format(
+            invid, chapters, int(duration)))
+        return True
+
+    def encode(self, method, nice, args, invid, outvid):
+        """
+            Encodes a title in parallel parts
+
+            Inputs:
+                method  (Obj): HandBrake or FFmpeg instance
+                nice    (Int): Priority to assign to task (nice value)
+                args    (Str): Compression arguments from the settings file
+                invid   (Str): File to encode
+                outvid  (Str): File to write
+
+            Outputs:
+                Bool    Was convertion successful
+                None    Splitting was not possible, encode normally instead
+        """
+        path, info = self.sourceInfo
+        if path != invid:
+            info = self._identify(invid)
+        if info is None:
+            return None
+
+        parts = min(self.jobs, self._chapters(info))
+        if parts < 2:
+            return None
+
+        workdir = tempfile.mkdtemp(
+            prefix='.split-', dir=os.path.dirname(outvid))
+
+        try:
+            chunks = self._split(invid, workdir, self._chapters(info), parts)
+            if chunks is None:
+                return None
+
+            encoded = self._encode_parts(method, nice, args, chunks)
+            if encoded is None:
+                return False
+
+            if not self._join(encoded, outvid):
+                return False
+
+            if not self._verify(invid, outvid):
+                self.log.error(u"Split encode of {} failed verification, encoding in one piece".format(invid))
+                os.remove(outvid)
+                return None
+
+            return True
+
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    def _split(self, invid, workdir, chapters, parts):
+        """
+            Cuts the source into parts with roughly the same number of
+                chapters each. No re-encoding takes place
+
+            Inputs:
+                invid    (Str): File to split
+                workdir  (Str): Folder for the parts
+                chapters (Int): Number of chapters in the source
+                parts    (Int): Number of parts to create
+
+            Outputs:
+                chunks   (List): Part files in order, None on failure
+        """
+        # mkvmerge starts a new file before each of these chapters
+        starts = []
+        for part in range(1, parts):
+            chapter = int(round(part * chapters / float(parts))) + 1
+            if chapter not in starts:
+                starts.append(chapter)
+
+        proc = process.Process(
+            [
+                '%smkvmerge' % self.mkvmergePath,
+                '-o', os.path.join(workdir, 'chunk.mkv'),
+                '--split', 'chapters:%s' % ','.join(str(c) for c in starts),
+                invid
+            ],
+            merge_stderr=True,
+            watchdog='mkvmerge'
+        )
+
+        returncode = proc.run(self.log.tool)
+
+        # 1 means warnings only
+        if returncode not in (0, 1):
+            self.log.error(
+                "mkvmerge (split) returned status code: %d" % returncode)
+            return None
+
+        chunks = sorted(glob.glob(os.path.join(workdir, 'chunk-*.mkv')))
+        if len(chunks) < 2:
+            return None
+
+        return chunks
+
+    def _encode_parts(self, method, nice, args, chunks):
+        """
+            Encodes every part at the same time
+
+            Inputs:
+                method  (Obj): HandBrake or FFmpeg instance
+                nice    (Int): Priority to assign to task (nice value)
+                args    (Str): Compression arguments from the settings file
+                chunks  (List): Part files to encode
+
+            Outputs:
+                encoded (List): Encoded part files in order, None on failure
+        """
+        encoded = [u"%s.enc.mkv" % chunk[:-4] for chunk in chunks]
+        results = [False] * len(chunks)
+        stalls = []
+
+        def worker(index):
+            try:
+                results[index] = method.encode(
+                    nice, args, chunks[index], encoded[index], self.threads)
+            except process.Stalled as ex:
+                stalls.append(ex)
+
+        workers = []
+        for index in range(len(chunks)):
+            thread = threading.Thread(target=worker, args=(index,))
+            thread.start()
+            workers.append(thread)
+
+        for thread in workers:
+            thread.join()
+
+        if len(stalls) > 0:
+            raise stalls[0]
+
+        if not all(results):
+            self.log.error("One or more parts failed to encode")
+            return None
+
+        return encoded
+
+    def _join(self, encoded, outvid):
+        """
+            Appends the encoded parts into the final file
+
+            Inputs:
+                encoded (List): Encoded part files in order
+                outvid  (Str): File to write
+
+            Outputs:
+                Bool    Was the join successful
+        """
+        command = ['%smkvmerge' % self.mkvmergePath, '-o', outvid, encoded[0]]
+        for part in encoded[1:]:
+            command.extend(['+', part])
+
+        proc = process.Process(command, merge_stderr=True, watchdog='mkvmerge')
+        returncode = proc.run(self.log.tool)
+
+        if returncode not in (0, 1):
+            self.log.error(
+                "mkvmerge (join) returned status code: %d" % returncode)
+            return False
+
+        return True
+
+    def _durations(self, path):
+        """
+            Returns the general, video and audio durations of a file
+
+            Inputs:
+                path    (Str): Media file
+
+            Outputs:
+                durations (Dict): Track type => seconds, only the general
+                                  one from mkvmerge without pymediainfo
+        """
+        try:
+            from pymediainfo import MediaInfo
+        except ImportError:
+            info = self._identify(path)
+            duration = self._duration(info) if info is not None else 0
+            if duration <= 0:
+                return {}
+
+            return {'General': duration}
+
+        durations = {}
+        for track in MediaInfo.parse(path).tracks:
+            if track.track_type in durations or track.duration is None:
+                continue
+
+            try:
+                durations[track.track_type] = float(track.duration) / 1000
+            except (TypeError, ValueError):
+                continue
+
+        return durations
+
+    def _verify(self, invid, outvid):
+        """
+            Checks that the joined file is as long as the source and that
+                audio and video are no further apart than they were before
+
+            Inputs:
+                invid   (Str): Source file
+                outvid  (Str): Joined file
+
+            Outputs:
+                Bool    Does the output match the source
+        """
+        source = self._durations(invid)
+        output = self._durations(outvid)
+
+        if 'General' not in source or 'General' not in output:
+            self.log.error("Could not read durations for verification")
+            return False
+
+        difference = abs(source['General'] - output['General'])
+        if difference > self.tolerance:
+            self.log.error(u"Duration differs from source by {:.2f} seconds".format(difference))
+            return False
+
+        if 'Video' in output and 'Audio' in output:
+            drift = abs(output['Video'] - output['Audio'])
+            if 'Video' in source and 'Audio' in source:
+                drift -= abs(source['Video'] - source['Audio'])
+
+            if drift > self.tolerance:
+                self.log.error(u"Audio and video drifted apart by {:.2f} seconds".format(drift))
+                return False
+
+        return True
@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+"""
+Scratch disk staging
+
+Rips and encodes run on a fast scratch volume and finished videos are
+moved to the library volume (makemkv.savePath) in the background. Before
+a rip or encode starts, its output size is predicted and the job is only
+admitted if the volume it writes to has room for it on top of every job
+already running there. Moves to the library volume reserve the size of
+the video there the same way.
+
+
+Released under the MIT license
+Copyright (c) 2012, Jason Millward
+
+@category   misc
+@version    $Id: 1.7.0, 2016-08-22 14:53:29 ACST $;
+@author     Jason Millward
+@license    http://opensource.org/licenses/MIT
+"""
+
+import Queue
+import errno
+import os
+import threading
+import time
+
+import database
+import logger
+import mover
+
+# Seconds between free space checks while a job waits for room
+WAIT_INTERVAL = 30
+
+# Bytes promised to running jobs, per device
+_reserved = {}
+_reserved_lock = threading.Lock()
+
+
+def free_space(path):
+    """
+        Returns the space available to us on the volume holding a path
+
+        Inputs:
+            path    (Str): File or folder, need not exist yet
+
+        Outputs:
+            bytes   (Int)
+    """
+    path = _existing(path)
+    stat = os.statvfs(path)
+    return stat.f_bavail * stat.f_frsize
+
+
+def _existing(path):
+    path = os.path.abspath(path)
+    while not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+
+    return path
+
+
+def _device(path):
+    return os.stat(_existing(path)).st_dev
+
+
+class Staging(object):
+
+    def __init__(self, config):
+        settings = config.get('staging') or {}
+
+        self.log = logger.Logger("Staging", config['debug'], config['silent'])
+        self.enable = bool(settings.get('enable', False))
+        self.scratchPath = settings.get('scratchPath') or ""
+        self.libraryPath = config['makemkv']['savePath']
+        self.reserve = int(settings.get('reserve', 2048)) * 1048576
+        self.wait = int(settings.get('wait', 0))
+        self.encodeRatio = float(settings.get('encodeRatio', 0.5))
+        self.queue = Queue.Queue()
+        self.mover = mover.Mover(config)
+        self.worker = None
+        self.workerLock = threading.Lock()
+
+        if self.enable and len(self.scratchPath) == 0:
+            self.log.error("Staging is enabled but no scratchPath is set, staging disabled")
+            self.enable = False
+
+    def work_path(self):
+        """
+            Returns the folder new rips are written to
+
+            Inputs:
+                None
+
+            Outputs:
+                path    (Str)
+        """
+        if self.enable:
+            return self.scratchPath
+
+        return self.libraryPath
+
+    def staged(self, dbvideo):
+        """
+            Checks whether a video is on the scratch volume
+
+            Inputs:
+                dbvideo (Obj): Video database object
+
+            Outputs:
+                Bool
+        """
+        if not self.enable:
+            return False
+
+        scratch = os.path.abspath(self.scratchPath)
+        return os.path.abspath(dbvideo.path).startswith(scratch + os.sep)
+
+    def rip_footprint(self, discinfo, titles):
+        """
+            Predicts the space a rip needs from the title sizes MakeMKV
+                reports
+
+            Inputs:
+                discinfo (Obj): DiscInfo of the disc
+                titles   (List): Entries returned by get_savefiles()
+
+            Outputs:
+                bytes    (Int)
+        """
+        total = 0
+        for title in titles:
+            total += discinfo.get_size(title['index']) or 0
+
+        return total
+
+    def encode_footprint(self, invid):
+        """
+            Predicts the space an encode needs from the size of its source
+                and how much earlier encodes shrank their sources
+
+            Inputs:
+                invid   (Str): File to encode
+
+            Outputs:
+                bytes   (Int)
+        """
+        ratio = database.encode_ratio() or self.encodeRatio
+
+        try:
+            return int(os.path.getsize(invid) * ratio)
+        except OSError:
+            return 0
+
+    def admit(self, path, size, job):
+        """
+            Reserves room for a job on the volume holding path
+            Waits up to staging.wait seconds for other jobs to free space
+
+            Inputs:
+                path    (Str): Where the job writes
+                size    (Int): Predicted output size in bytes
+                job     (Str): Job name for the log
+
+            Outputs:
+                Bool    Was the job admitted, release() it when done
+        """
+        device = _device(path)
+        deadline = time.time() + self.wait
+        waiting = False
+
+        while True:
+            with _reserved_lock:
+                free = free_space(path) - _reserved.get(device, 0) - self.reserve
+                if free >= size:
+                    _reserved[device] = _reserved.get(device, 0) + size
+                    return True
+
+            if time.time() >= deadline:
+                self.log.error(u"Not enough space for {}: needs {} MB, {} MB available".format(
+                    job, size // 1048576, max(free, 0) // 1048576))
+                return False
+
+            if not waiting:
+                self.log.info(u"Waiting for space for {}".format(job))
+                waiting = True
+
+            time.sleep(min(WAIT_INTERVAL, max(deadline - time.time(), 0)))
+
+    def release(self, path, size):
+        """
+            Returns the room reserved by admit()
+
+            Inputs:
+                path    (Str): Where the job wrote
+                size    (Int): Size passed to admit()
+
+            Outputs:
+                None
+        """
+        device = _device(path)
+        with _reserved_lock:
+            _reserved[device] = max(0, _reserved.get(device, 0) - size)
+
+    def move(self, dbvideo, moved=None):
+        """
+            Queues a finished video to be moved to the library volume
+            The video waits in status 9 until it has been moved, then goes
+                on to status 6. If the move fails, or the library volume
+                has no room for it, it goes on to status 6 where it is, on
+                the scratch volume
+
+            Inputs:
+                dbvideo (Obj): Video database object
+                moved   (Func): Called with the video once it is in status 6
+
+            Outputs:
+                None
+        """
+        database.update_video(dbvideo, 9)
+        self.queue.put((dbvideo, moved))
+
+        with self.workerLock:
+            if self.worker is None:
+                self.worker = threading.Thread(target=self._mover, name="Mover")
+                self.worker.daemon = True
+                self.worker.start()
+
+    def drain(self):
+        """
+            Waits until every queued move has finished
+
+            Inputs:
+                None
+
+            Outputs:
+                None
+        """
+        self.queue.join()
+
+    def _mover(self):
+        while True:
+            dbvideo, moved = self.queue.get()
+            try:
+                if self._move(dbvideo) and moved is not None:
+                    moved(dbvideo)
+            except (IOError, OSError) as ex:
+                self.log.error(u"Moving {} failed: {}".format(dbvideo.filename, ex))
+
+                # The video stays on the scratch volume
+                source = u"%s/%s" % (dbvideo.path, dbvideo.filename)
+                if dbvideo.partial and os.path.isfile(source) and os.path.isfile(dbvideo.partial):
+                    os.remove(dbvideo.partial)
+                database.update_video(dbvideo, 6)
+
+                if moved is not None:
+                    moved(dbvideo)
+            finally:
+                self.queue.task_done()
+
+    def _move(self, dbvideo):
+        """
+            Moves a video from the scratch volume to the library volume
+
+            Inputs:
+                dbvideo (Obj): Video database object
+
+            Outputs:
+                Bool    Was the video moved
+        """
+        source = u"%s/%s" % (dbvideo.path, dbvideo.filename)
+        folder = u"%s/%s" % (self.libraryPath, os.path.basename(dbvideo.path))
+        target = u"%s/%s" % (folder, dbvideo.filename)
+
+        # A rename takes no room, a copy needs the whole video
+        size = 0
+        if _device(source) != _device(folder):
+            size = os.path.getsize(source)
+
+        if not self.admit(folder, size, dbvideo.filename):
+            raise OSError(errno.ENOSPC, "No room on the library volume", folder)
+
+        try:
+            database.set_partial(dbvideo, target)
+
+            self.log.debug(u"Moving {} to {}".format(source, folder))
+            digest = self.mover.move(source, target, dbvideo.checksum)
+            if digest is not None:
+                database.set_checksum(dbvideo, digest)
+        finally:
+            self.release(folder, size)
+
+        try:
+            os.rmdir(dbvideo.path)
+        except OSError:
+            pass
+
+        dbvideo.path = folder
+        with database.atomic():
+            database.update_video(dbvideo, 6)
+            database.insert_history(dbvideo, "Moved to the library volume")
+        return True
@@ -12,16 +12,15 @@ Copyright (c) 2012, Jason Millward
 @license    http://opensource.org/licenses/MIT
 """
 
-import datetime
+import time
 
 
 class StopWatch(object):
 
     def __enter__(self):
-        self.startTime = datetime.datetime.now()
+        self.startTime = time.time()
         return self
 
     def __exit__(self, *args):
-        endtime = datetime.datetime.now()
-        totaltime = endtime - self.startTime
-        self.minutes = totaltime.seconds / 60
+        self.seconds = time.time() - self.startTime
+        self.minutes = int(self.seconds // 60)
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+Run tracing
+
+Records spans for every step of a run and every external tool it starts,
+and writes them as a Chrome trace-event file that chrome://tracing or
+Perfetto can open. Each worker thread gets its own row, so parallel rips
+and encodes can be seen side by side. Tool runs are split into the time
+taken to start the process, the time until it first printed anything and
+the time it spent working after that.
+
+Tracing is off until enable() is called, until then a span costs a single
+check.
+
+
+Released under the MIT license
+Copyright (c) 2012, Jason Millward
+
+@category   misc
+@version    $Id: 1.7.0, 2016-08-22 14:53:29 ACST $;
+@author     Jason Millward
+@license    http://opensource.org/licenses/MIT
+"""
+
+import atexit
+import functools
+import json
+import os
+import threading
+import time
+
+# Events kept in memory, later ones are counted and dropped
+MAX_EVENTS = 200000
+
+_lock = threading.Lock()
+_events = []
+_threads = {}
+_state = {'path': None, 'origin': 0.0, 'dropped': 0}
+
+
+def enable(path):
+    """
+        Starts recording, the trace is written to path at exit
+
+        Inputs:
+            path    (Str): Trace file to write
+
+        Outputs:
+            None
+    """
+    if _state['path'] is None:
+        atexit.register(write)
+
+    _state['path'] = path
+    _state['origin'] = time.time()
+
+
+def enabled():
+    return _state['path'] is not None
+
+
+def record(name, start, end, category='stage', args=None):
+    """
+        Records a span that has already finished
+
+        Inputs:
+            name     (Str): Span name
+            start    (Float): time.time() when it started
+            end      (Float): time.time() when it ended
+            category (Str): Span category, shown in the viewer
+            args     (Dict): Extra details, optional
+
+        Outputs:
+            None
+    """
+    if _state['path'] is None:
+        return
+
+    thread = threading.current_thread()
+    event = {
+        'name': name,
+        'cat': category,
+        'ph': 'X',
+        'ts': int((start - _state['origin']) * 1000000),
+        'dur': max(0, int((end - start) * 1000000)),
+        'pid': os.getpid(),
+        'tid': thread.ident
+    }
+    if args:
+        event['args'] = args
+
+    with _lock:
+        _threads[thread.ident] = thread.name
+        if len(_events) < MAX_EVENTS:
+            _events.append(event)
+        else:
+            _state['dropped'] += 1
+
+
+class Span(object):
+
+    def __init__(self, name, category='stage', args=None):
+        """
+            Records the time spent inside a with block
+
+            Inputs:
+                name     (Str): Span name
+                category (Str): Span category
+                args     (Dict): Extra details, optional
+
+            Outputs:
+                The span instance
+        """
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *args):
+        record(self.name, self.start, time.time(), self.category, self.args)
+
+
+def traced(name, category='step'):
+    """
+        Decorator recording every call of a function as a span
+
+        Inputs:
+            name     (Str): Span name
+            category (Str): Span category
+
+        Outputs:
+            decorator (Func)
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with Span(name, category):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def write():
+    """
+        Writes everything recorded so far to the trace file
+
+        Inputs:
+            None
+
+        Outputs:
+            None
+    """
+    if _state['path'] is None:
+        return
+
+    pid = os.getpid()
+    with _lock:
+        events = [{
+            'name': 'process_name', 'ph': 'M', 'pid': pid,
+            'args': {'name': 'autorippr'}
+        }]
+        for tid, name in _threads.items():
+            events.append({
+                'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid,
+                'args': {'name': name}
+            })
+        events.extend(_events)
+        dropped = _state['dropped']
+
+    trace = {
+        'traceEvents': events,
+        'displayTimeUnit': 'ms',
+        'otherData': {'droppedEvents': dropped}
+    }
+
+    with open(_state['path'], 'w') as f:
+        json.dump(trace, f)
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+Output verification
+
+Checks that a rip or encode is a complete, readable container before it
+is passed on: the container has to parse, must not be truncated and has
+to be as long as expected. Its video track has to hold as many frames as
+its length and frame rate promise, and an encode as many as its source
+once the frame rates are accounted for. Only the container headers are
+read, the data itself is checksummed by the mover as it is moved.
+
+
+Released under the MIT license
+Copyright (c) 2012, Jason Millward
+
+@category   misc
+@version    $Id: 1.7.0, 2016-08-22 14:53:29 ACST $;
+@author     Jason Millward
+@license    http://opensource.org/licenses/MIT
+"""
+
+import imp
+import os
+
+import logger
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _frame_length(tracks):
+    """
+        Returns how long the frames of the video track last in seconds,
+            None without a frame count and rate
+    """
+    video = tracks.get('Video')
+    if video is None:
+        return None
+
+    frames = _number(video.frame_count)
+    rate = _number(video.frame_rate)
+    if frames is None or not rate:
+        return None
+
+    return frames / rate
+
+
+class Verifier(object):
+
+    def __init__(self, config):
+        settings = config.get('verify') or {}
+
+        self.log = logger.Logger("Verify", config['debug'], config['silent'])
+        self.enable = bool(settings.get('enable', True))
+        self.tolerance = float(settings.get('tolerance', 2))
+        self.retries = int(settings.get('retries', 1))
+
+        if self.enable:
+            try:
+                imp.find_module('pymediainfo')
+            except ImportError:
+                self.log.debug("pymediainfo is not installed, verification disabled")
+                self.enable = False
+
+    def _tracks(self, path):
+        """
+            Reads the first track of every type in a file
+
+            Inputs:
+                path    (Str): Media file
+
+            Outputs:
+                tracks  (Dict): Track type => track, None if unreadable
+        """
+        from pymediainfo import MediaInfo
+
+        try:
+            info = MediaInfo.parse(path)
+        except Exception as ex:
+            self.log.debug(u"MediaInfo could not read {}: {}".format(path, ex))
+            return None
+
+        tracks = {}
+        for track in info.tracks:
+            tracks.setdefault(track.track_type, track)
+
+        return tracks
+
+    def check(self, path, duration=None, frames=None):
+        """
+            Checks that a file is a complete container of the right length
+                with all of its video frames
+
+            Inputs:
+                path     (Str): Media file
+                duration (Float): Expected length in seconds, optional
+                frames   (Float): Expected length of the video frames in
+                                  seconds, optional
+
+            Outputs:
+                result   (Tuple): (Bool passed, Str reason)
+        """
+        if not self.enable:
+            return (True, u"verification disabled")
+
+        if not os.path.isfile(path) or os.path.getsize(path) == 0:
+            return (False, u"file is missing or empty")
+
+        tracks = self._tracks(path)
+        if tracks is None or 'General' not in tracks:
+            return (False, u"container could not be read")
+
+        general = tracks['General']
+        if getattr(general, 'istruncated', None) == 'Yes':
+            return (False, u"container is truncated")
+
+        length = _number(general.duration)
+        if length is None:
+            return (False, u"container has no duration")
+        length /= 1000
+
+        if duration is not None and abs(length - duration) > self.tolerance:
+            return (False, u"length is {:.1f}s, expected {:.1f}s".format(length, duration))
+
+        framed = _frame_length(tracks)
+        if framed is not None:
+            video = _number(tracks['Video'].duration)
+            if video is not None and abs(framed - video / 1000) > self.tolerance:
+                return (False, u"video frames last {:.1f}s, the track {:.1f}s".format(framed, video / 1000))
+
+            if frames is not None and abs(framed - frames) > self.tolerance:
+                return (False, u"video frames last {:.1f}s, expected {:.1f}s".format(framed, frames))
+
+        return (True, u"{:.1f}s".format(length))
+
+    def check_encode(self, invid, outvid):
+        """
+            Checks an encode against the file it was made from
+
+            Inputs:
+                invid   (Str): Source file
+                outvid  (Str): Encoded file
+
+            Outputs:
+                result  (Tuple): (Bool passed, Str reason)
+        """
+        if not self.enable:
+            return (True, u"verification disabled")
+
+        tracks = self._tracks(invid)
+        if tracks is None or 'General' not in tracks:
+            return self.check(outvid)
+
+        duration = _number(tracks['General'].duration)
+        if duration is not None:
+            duration /= 1000
+
+        return self.check(outvid, duration, _frame_length(tracks))
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+Optical disc volume descriptors
+
+Reads the volume label of a disc straight from the drive, from the UDF
+descriptors DVDs and Blu-rays carry or from the ISO 9660 descriptor of
+older discs, and hashes the descriptors to tell discs with the same label
+apart. Only a few sectors are read, so only the drive the disc is in is
+touched and nothing has to be scanned by MakeMKV.
+
+
+Released under the MIT license
+Copyright (c) 2012, Jason Millward
+
+@category   misc
+@version    $Id: 1.7.0, 2016-08-22 14:53:29 ACST $;
+@author     Jason Millward
+@license    http://opensource.org/licenses/MIT
+"""
+
+import hashlib
+import struct
+
+SECTOR = 2048
+
+# UDF anchor volume descriptor pointer, always at sector 256
+ANCHOR = 256
+
+# Sectors of the volume descriptor sequence read at most
+MAX_SEQUENCE = 64
+
+# UDF descriptor tag identifiers
+TAG_PRIMARY = 1
+TAG_ANCHOR = 2
+TAG_TERMINATOR = 8
+
+# ISO 9660 volume descriptors start at sector 16, type 255 ends them
+ISO_FIRST = 16
+ISO_TERMINATOR = 255
+
+
+def _read(disc, sector, count=1):
+    disc.seek(sector * SECTOR)
+    return disc.read(count * SECTOR)
+
+
+def _dstring(field):
+    """
+        Decodes a UDF dstring, the last byte holds its length
+    """
+    length = ord(field[-1])
+    if length < 2:
+        return u""
+
+    data = field[1:length]
+    if ord(field[0]) == 8:
+        return data.decode('latin-1')
+    if ord(field[0]) == 16:
+        return data.decode('utf-16-be', 'replace')
+    return u""
+
+
+def _udf_sequence(disc):
+    """
+        Returns the main volume descriptor sequence, None on non-UDF discs
+    """
+    anchor = _read(disc, ANCHOR)
+    if len(anchor) < 24 or struct.unpack('<H', anchor[:2])[0] != TAG_ANCHOR:
+        return None
+
+    length, location = struct.unpack('<II', anchor[16:24])
+    count = min(max(1, length // SECTOR), MAX_SEQUENCE)
+    return _read(disc, location, count)
+
+
+def _udf_label(sequence):
+    for offset in range(0, len(sequence) - SECTOR + 1, SECTOR):
+        tag = struct.unpack('<H', sequence[offset:offset + 2])[0]
+        if tag == TAG_PRIMARY:
+            return _dstring(sequence[offset + 24:offset + 56])
+        if tag == TAG_TERMINATOR:
+            break
+
+    return None
+
+
+def _iso_sequence(disc):
+    """
+        Returns the ISO 9660 volume descriptors, None when there are none
+    """
+    descriptors = []
+    for sector in range(ISO_FIRST, ISO_FIRST + MAX_SEQUENCE):
+        descriptor = _read(disc, sector)
+        if descriptor[1:6] != 'CD001':
+            break
+
+        descriptors.append(descriptor)
+        if ord(descriptor[0]) == ISO_TERMINATOR:
+            break
+
+    if len(descriptors) == 0:
+        return None
+
+    return ''.join(descriptors)
+
+
+def _iso_label(disc):
+    descriptor = _read(disc, ISO_FIRST)
+    if descriptor[:6] != '\x01CD001':
+        return None
+
+    return descriptor[40:72].decode('latin-1')
+
+
+def read_label(device):
+    """
+        Reads the volume label of the disc in a drive
+
+        Inputs:
+            device  (Str): Block device, eg. /dev/sr0
+
+        Outputs:
+            label   (Str), None if the disc cannot be read
+    """
+    try:
+        with open(device, 'rb') as disc:
+            sequence = _udf_sequence(disc)
+            label = None
+            if sequence is not None:
+                label = _udf_label(sequence)
+            if not label:
+                label = _iso_label(disc)
+    except (IOError, OSError):
+        return None
+
+    if label is None or not label.strip():
+        return None
+
+    return label.strip()
+
+
+def fingerprint(device):
+    """
+        Hashes the volume descriptors of the disc in a drive
+        They hold the creation time and volume set of the disc as well as
+            its label, so pressings that share a label differ
+
+        Inputs:
+            device  (Str): Block device, eg. /dev/sr0
+
+        Outputs:
+            digest  (Str): SHA-1 of the descriptors, None if the disc
+                            cannot be read
+    """
+    try:
+        with open(device, 'rb') as disc:
+            descriptors = [_udf_sequence(disc), _iso_sequence(disc)]
+    except (IOError, OSError):
+        return None
+
+    descriptors = [d for d in descriptors if d]
+    if len(descriptors) == 0:
+        return None
+
+    return hashlib.sha1(''.join(descriptors)).hexdigest()
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+Database tests
+
+Runs against a database in a temporary folder, the real autorippr.sqlite
+is left alone.
+
+
+Released under the MIT license
+Copyright (c) 2012, Jason Millward
+
+@category   misc
+@version    $Id: 1.7.0, 2016-08-22 14:53:29 ACST $;
+@author     Jason Millward
+@license    http://opensource.org/licenses/MIT
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Read when the database is imported
+FOLDER = tempfile.mkdtemp(prefix='autorippr-test-')
+os.environ['AUTORIPPR_DB'] = os.path.join(FOLDER, 'autorippr.sqlite')
+
+from classes import database
+
+
+def tearDownModule():
+    database.database.close()
+    shutil.rmtree(FOLDER, ignore_errors=True)
+
+
+class SearchVideoNameTest(unittest.TestCase):
+
+    def setUp(self):
+        database.Videos.delete().execute()
+
+        for filename in [u"Show_S1E1.mkv", u"show_s1E2.mkv", u"Shox.mkv"]:
+            database.Videos.create(
+                vidname=u"Show", vidtype=u"tv", titleIndex=1, path=u"/rips",
+                filename=filename, filebot=False, statusid=4,
+                lastupdated=datetime.now())
+
+    def test_ignores_case(self):
+        self.assertEqual(database.search_video_name(u"Show_S1"), 2)
+        self.assertEqual(database.search_video_name(u"SHOW_S1E2"), 1)
+
+    def test_counts_only_the_prefix(self):
+        self.assertEqual(database.search_video_name(u"Show"), 2)
+        self.assertEqual(database.search_video_name(u"Sho"), 3)
+        self.assertEqual(database.search_video_name(u"Movie"), 0)
+
+    def test_uses_the_filename_index(self):
+        plan = database.database.execute_sql(
+            'EXPLAIN QUERY PLAN SELECT COUNT(*) FROM "videos" '
+            'WHERE "filename" COLLATE NOCASE >= ? AND "filename" COLLATE NOCASE < ?',
+            (u"show", u"shox")).fetchall()
+        self.assertIn(u"videos_filename_nocase", u" ".join(row[-1] for row in plan))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+Verifier tests
+
+The MediaInfo tracks are faked, so neither pymediainfo nor real video
+files are needed.
+
+
+Released under the MIT license
+Copyright (c) 2012, Jason Millward
+
+@category   misc
+@version    $Id: 1.7.0, 2016-08-22 14:53:29 ACST $;
+@author     Jason Millward
+@license    http://opensource.org/licenses/MIT
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from classes import verify
+
+
+class Track(object):
+
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+
+def tracks(duration, frames, rate):
+    """
+        Returns MediaInfo-like tracks of a file, durations in seconds
+    """
+    return {
+        'General': Track(duration=duration * 1000, istruncated=None),
+        'Video': Track(duration=duration * 1000, frame_count=frames, frame_rate=rate)
+    }
+
+
+class VerifierTest(unittest.TestCase):
+
+    def setUp(self):
+        self.verifier = verify.Verifier({
+            'debug': False,
+            'silent': True,
+            'verify': {'enable': True, 'tolerance': 2}
+        })
+        self.verifier.enable = True
+
+        handle, self.path = tempfile.mkstemp(suffix='.mkv')
+        os.write(handle, 'video')
+        os.close(handle)
+
+        self.files = {}
+        self.verifier._tracks = lambda path: self.files.get(path)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_complete_file_passes(self):
+        self.files[self.path] = tracks(3600, 86314, 23.976)
+
+        passed, reason = self.verifier.check(self.path, 3600)
+        self.assertTrue(passed, reason)
+
+    def test_missing_frames_fail(self):
+        # Half an hour of frames in an hour long track
+        self.files[self.path] = tracks(3600, 43157, 23.976)
+
+        passed, reason = self.verifier.check(self.path, 3600)
+        self.assertFalse(passed)
+        self.assertIn(u"frames", reason)
+
+    def test_encode_with_fewer_frames_than_source_fails(self):
+        self.files['/source.mkv'] = tracks(3600, 86314, 23.976)
+        encode = tracks(3600, 86314, 23.976)
+        encode['Video'].frame_count = 80000
+        encode['Video'].duration = 80000 / 23.976 * 1000
+        self.files[self.path] = encode
+
+        passed, reason = self.verifier.check_encode('/source.mkv', self.path)
+        self.assertFalse(passed)
+        self.assertIn(u"expected", reason)
+
+    def test_encode_at_another_frame_rate_passes(self):
+        # Deinterlaced to double the frame rate, the frames last as long
+        self.files['/source.mkv'] = tracks(3600, 107892, 29.97)
+        self.files[self.path] = tracks(3600, 215784, 59.94)
+
+        passed, reason = self.verifier.check_encode('/source.mkv', self.path)
+        self.assertTrue(passed, reason)
+
+
+if __name__ == '__main__':
+    unittest.main()